@@ -19,6 +19,10 @@ const nextConfig: NextConfig = {
           source: '/invoke',
           destination: 'http://localhost:8000/invoke',
         },
+        {
+          source: '/invoke_batch',
+          destination: 'http://localhost:8000/invoke_batch',
+        },
         {
           source: '/join_room',
           destination: 'http://localhost:8000/join_room',
@@ -1,6 +1,7 @@
 import json
 from typing import List, Tuple, Dict, Any, Optional
-import uuid  # uuid をインポート
+import hashlib
+import unicodedata
 
 # Vertex AI SDK
 try:
@@ -10,13 +11,51 @@ except ImportError:
     pass
 
 from models import Message
-from config import logger, VERTEX_AI_AVAILABLE, VERTEX_MODEL_NAME
+from config import logger, LLM_AVAILABLE, VERTEX_MODEL_NAME
+from response_cache import mark_agent_succeeded
+from prompt_templates import (PromptTemplate, ANALYZE_INPUTS_JA, TRANSCRIPT_ERROR_NOTE,
+                              SESSION_DATA_SECTION, HISTORY_SECTION, INSTRUCTION_SECTION)
 import os  # osモジュールをインポート
 
 # BaseAgentのインポートパスはmain.pyの構造に依存するため、ここでは一旦コメントアウト
 # from .base_agent import MeetingAgent
 
 
+AGENDA_PROMPT = PromptTemplate(
+    "AgendaManagementAgent",
+    static_sections=[
+        ("role", f"""あなたは会議のアジェンダ管理アシスタントです。
+{ANALYZE_INPUTS_JA}
+その上で、「現在の主要な議題の主題」、「現在の議題に関する詳細（会話の要点や背景情報など、できるだけ多く、3点以上あると望ましい）」、「次に議論すべき推奨議題のリスト（できるだけ多く、3点以上あると望ましい）」を更新し、結果を以下のJSON形式で返してください。"""),
+        ("schema", f"""JSON形式: {{"current_agenda_main_topic": "更新された現在の主要議題テキスト", "current_agenda_details": ["詳細1テキスト", "詳細2テキスト"], "suggested_next_topics_list": ["更新された推奨議題1", "更新された推奨議題2"]}}
+`current_agenda_details` は現在の主要議題に関連する重要な会話のポイントや補足情報を簡潔にまとめた文字列のリストです。基本的には複数出力してほしいですが、もし詳細がなければ空のリスト `[]` としてください。6項目以上など、リストが多くなりすぎた場合には、それぞれ適宜まとめてください。基本的には5項目以下にすると良いでしょう。
+{TRANSCRIPT_ERROR_NOTE}
+JSONオブジェクトのみ出力してください。"""),
+    ],
+    dynamic_sections=[
+        ("session_data", SESSION_DATA_SECTION),
+        ("history", HISTORY_SECTION),
+        ("instruction", INSTRUCTION_SECTION + "\n更新された議題 (JSONオブジェクト):"),
+    ],
+)
+
+
+def _content_id(prefix: str, text: str, used_ids: set) -> str:
+    """
+    内容から決まるIDを返す（同じ内容なら実行ごとに同じIDになり、変更のない書き込みを省ける）。
+    同じ内容が複数ある場合は連番を付けて重複を避ける。
+    """
+    digest = hashlib.sha256(unicodedata.normalize(
+        "NFKC", text).strip().encode("utf-8")).hexdigest()[:10]
+    content_id = f"{prefix}_{digest}"
+    suffix = 1
+    while content_id in used_ids:
+        suffix += 1
+        content_id = f"{prefix}_{digest}_{suffix}"
+    used_ids.add(content_id)
+    return content_id
+
+
 class AgendaManagementAgent:  # MeetingAgent): # BaseAgentを継承する場合はコメントを外す
     def __init__(self, config_path: str):
         self.config_path = config_path  # 現状は使用しないが、将来的な設定読み込みのために保持
@@ -31,7 +70,8 @@ class AgendaManagementAgent:  # MeetingAgent): # BaseAgentを継承する場合
             instruction=instruction,
             conversation_history=conversation_history,
             current_data=current_data,
-            llm_model=llm_model
+            llm_model=llm_model,
+            history_str=kwargs.get("history_str")
             # speaker_name は handle_agenda_management_request が直接受け取らないため渡さない
         )
 
@@ -40,7 +80,8 @@ async def handle_agenda_management_request(
     instruction: str,
     conversation_history: List[Message],
     current_data: Dict[str, Any],
-    llm_model: GenerativeModel
+    llm_model: GenerativeModel,
+    history_str: Optional[str] = None
 ) -> Tuple[Dict[str, Any], str]:
     logger.info(f"Agenda management for instruction: {instruction}")
     session_data = current_data
@@ -61,36 +102,25 @@ async def handle_agenda_management_request(
         else:
             suggested_next_topics_obj = {}
 
-    if not VERTEX_AI_AVAILABLE or llm_model is None:
+    if not LLM_AVAILABLE or llm_model is None:
         logger.warning(
             "Vertex AI not available for agenda management or LLM model not provided.")
         return {"currentAgenda": current_agenda_obj, "suggestedNextTopics": suggested_next_topics_obj}, "Agenda not updated (Vertex AI unavailable or LLM model not provided)."
     try:
         model = llm_model  # 引数で受け取ったllm_modelを使用
 
-        history_str = "\n".join(
-            [f"{msg.role.capitalize()}: {msg.parts[0]['text']}" for msg in conversation_history if msg.parts and msg.parts[0].get('text')])
+        if history_str is None:
+            history_str = "\n".join(
+                [f"{msg.role.capitalize()}: {msg.parts[0]['text']}" for msg in conversation_history if msg.parts and msg.parts[0].get('text')])
 
         # Include the entire session_data in the prompt for context
         session_data_json_str = json.dumps(
             session_data, ensure_ascii=False, indent=2)
 
-        prompt = f"""あなたは会議のアジェンダ管理アシスタントです。
-以下の現在の完全なセッションデータ（JSON形式）、過去の会話履歴（参考情報）、そして今回対応すべき新しい指示「{instruction}」を分析してください。
-その上で、「現在の主要な議題の主題」、「現在の議題に関する詳細（会話の要点や背景情報など、できるだけ多く、3点以上あると望ましい）」、「次に議論すべき推奨議題のリスト（できるだけ多く、3点以上あると望ましい）」を更新し、結果を以下のJSON形式で返してください。
-JSON形式: {{"current_agenda_main_topic": "更新された現在の主要議題テキスト", "current_agenda_details": ["詳細1テキスト", "詳細2テキスト"], "suggested_next_topics_list": ["更新された推奨議題1", "更新された推奨議題2"]}}
-`current_agenda_details` は現在の主要議題に関連する重要な会話のポイントや補足情報を簡潔にまとめた文字列のリストです。基本的には複数出力してほしいですが、もし詳細がなければ空のリスト `[]` としてください。6項目以上など、リストが多くなりすぎた場合には、それぞれ適宜まとめてください。基本的には5項目以下にすると良いでしょう。
-トランスクリプトのため、文字起こしに誤りがある場合があります。推測して補ってください。
-JSONオブジェクトのみ出力してください。
-
-現在のセッションデータ:
-```json
-{session_data_json_str}
-```
-
-過去の会話履歴 (参考情報):\n{history_str}
-今回対応すべき新しい指示: {instruction}
-更新された議題 (JSONオブジェクト):"""
+        prompt = AGENDA_PROMPT.render(
+            session_data_json=session_data_json_str,
+            history=history_str,
+            instruction=instruction)
         logger.info(
             f"Sending agenda prompt to LLM. Instruction: {instruction}")
         response = await model.generate_content_async(prompt)
@@ -98,7 +128,6 @@ JSONオブジェクトのみ出力してください。
             response, 'text') and response.text else ""
         if not llm_response_text and response.candidates and response.candidates[0].content.parts:
             llm_response_text = response.candidates[0].content.parts[0].text
-        logger.info(f"LLM agenda response: {llm_response_text}")
         if not llm_response_text:
             # Return data in the new expected format
             return {"currentAgenda": {"mainTopic": current_main_topic, "details": []}, "suggestedNextTopics": suggested_next_topics_list}, "LLM returned empty agenda update."
@@ -125,14 +154,15 @@ JSONオブジェクトのみ出力してください。
         new_details_texts_list = agenda_update.get(
             "current_agenda_details", [])
         formatted_details_list = []  # Firebase用にリスト形式に変換
+        used_ids = set()
         if isinstance(new_details_texts_list, list):
             for idx, text_detail in enumerate(new_details_texts_list):
                 if isinstance(text_detail, str):
                     formatted_details_list.append(
-                        {"id": f"detail_{idx}_{uuid.uuid4().hex[:6]}", "text": text_detail})
+                        {"id": _content_id("detail", text_detail, used_ids), "text": text_detail})
                 elif isinstance(text_detail, dict) and "text" in text_detail:  # LLMが既にオブジェクトで返した場合
                     formatted_details_list.append({
-                        "id": text_detail.get("id", f"detail_{idx}_{uuid.uuid4().hex[:6]}"),
+                        "id": _content_id("detail", str(text_detail.get("text")), used_ids),
                         "text": text_detail.get("text"),
                         "timestamp": text_detail.get("timestamp")
                     })
@@ -144,15 +174,16 @@ JSONオブジェクトのみ出力してください。
         if isinstance(new_suggested_topics_list, list):
             for idx, topic_text in enumerate(new_suggested_topics_list):
                 if isinstance(topic_text, str):
-                    # ユニークID生成
-                    topic_id = f"nexttopic_{idx}_{uuid.uuid4().hex[:6]}"
+                    # 内容から決まるIDにして、同じ推奨議題なら実行ごとに同じキーになるようにする
+                    topic_id = _content_id("nexttopic", topic_text, used_ids)
                     formatted_suggested_topics_obj[topic_id] = {
                         "title": topic_text}  # Firebaseではオブジェクトで格納
         elif isinstance(new_suggested_topics_list, str):  # 単一文字列で来た場合
-            topic_id = f"nexttopic_0_{uuid.uuid4().hex[:6]}"
+            topic_id = _content_id("nexttopic", new_suggested_topics_list, used_ids)
             formatted_suggested_topics_obj[topic_id] = {
                 "title": new_suggested_topics_list}
 
+        mark_agent_succeeded()
         return {
             "currentAgenda": {"mainTopic": new_main_topic, "details": formatted_details_list},
             "suggestedNextTopics": formatted_suggested_topics_obj
@@ -10,10 +10,40 @@ except ImportError:
     pass
 
 from models import Message  # Assuming Message model is in a shared models.py
-from config import logger, VERTEX_AI_AVAILABLE, VERTEX_MODEL_NAME
+from config import logger, LLM_AVAILABLE, VERTEX_MODEL_NAME
+from response_cache import mark_agent_succeeded
+from prompt_templates import (PromptTemplate, ANALYZE_INPUTS_JA, TRANSCRIPT_ERROR_NOTE,
+                              SESSION_DATA_SECTION, HISTORY_SECTION, INSTRUCTION_SECTION)
 import os  # osモジュールをインポート
 
 
+NOTES_PROMPT = PromptTemplate(
+    "NotesGeneratorAgent",
+    static_sections=[
+        ("role", f"""あなたは会議のノート作成アシスタントです。
+{ANALYZE_INPUTS_JA}
+その上で、セッションデータ内の `notes` リストを更新または項目追加し、更新後の `notes` リスト全体をJSON配列で返してください。"""),
+        ("rules", """重要な指示:
+- **既存ノートのレビューと統合:** 新しい指示に対応する際、既存の `notes` リストを注意深く確認してください。新しい情報が既存のノートと関連する場合、単に新しいノートを追加するのではなく、既存のノートを更新・拡張するか、関連する複数のノートを1つに統合・要約することを優先してください。情報の重複を避け、ノートを簡潔かつ網羅的に保つことが重要です。
+- **議題変更時:** 議題が変わったと判断した場合、既存のメモはある程度`決定事項`としてまとめてください。
+- **更新か新規作成かの判断:** 既存のノートを更新する方が適切か、全く新しいノートとして追加する方が適切かを文脈から判断してください。各項目について、6項目以上など、リストが多くなりすぎた場合には、適宜まとめても良いです。必要であればそれ以上でもよいです。"""),
+        ("schema", f"""各ノート項目は `{{ "id": "note_ユニークID", "type": "memo" | "decision" | "issue", "text": "ノート内容" }}` の形式です。タイムスタンプは不要です。
+- `id`: 既存のノートを更新する場合はそのIDを維持し、新規作成の場合は `note_` から始まるユニークなIDを割り振ってください。
+- `type`: ユーザーの指示内容や文脈から、ノートの種別を "memo"（一般的なメモ・会話の流れ）、"decision"（決定事項）、"issue"（課題・検討事項）のいずれかに分類してください。
+- `text`: ノートの具体的な内容を記述してください。関連情報をまとめる場合は、要点を整理して記述してください。
+
+{TRANSCRIPT_ERROR_NOTE}
+もし指示内容がノートの変更を意図していない場合は、現在の `notes` リストをそのまま返してください。
+JSON配列のみ出力してください。"""),
+    ],
+    dynamic_sections=[
+        ("session_data", SESSION_DATA_SECTION),
+        ("history", HISTORY_SECTION),
+        ("instruction", INSTRUCTION_SECTION + "\n更新後のノート項目リスト (JSON配列):"),
+    ],
+)
+
+
 class NotesGeneratorAgent:
     def __init__(self, config_path: str):
         self.config_path = config_path
@@ -25,7 +55,8 @@ class NotesGeneratorAgent:
             instruction=instruction,
             conversation_history=conversation_history,
             current_data=current_data,
-            llm_model=llm_model
+            llm_model=llm_model,
+            history_str=kwargs.get("history_str")
         )
 
 
@@ -33,7 +64,8 @@ async def handle_notes_generation_request(
     instruction: str,
     conversation_history: List[Message],
     current_data: Dict[str, Any],
-    llm_model: GenerativeModel
+    llm_model: GenerativeModel,
+    history_str: Optional[str] = None
 ) -> Tuple[Dict[str, Any], str]:
     session_data = current_data
     # Firebaseでは notes はオブジェクトになる想定
@@ -47,7 +79,7 @@ async def handle_notes_generation_request(
         else:
             current_notes_dict = {}
 
-    if not VERTEX_AI_AVAILABLE or llm_model is None:
+    if not LLM_AVAILABLE or llm_model is None:
         new_note_id = f"note_{uuid.uuid4()}"
         new_note = {
             "id": new_note_id,  # idはオブジェクトのキーにもなるが、内部にも保持
@@ -61,42 +93,19 @@ async def handle_notes_generation_request(
     try:
         model = llm_model  # 引数で受け取ったllm_modelを使用
 
-        history_str = "\n".join(
-            [f"{msg.role.capitalize()}: {msg.parts[0]['text']}" for msg in conversation_history if msg.parts and msg.parts[0].get('text')]
-        )
+        if history_str is None:
+            history_str = "\n".join(
+                [f"{msg.role.capitalize()}: {msg.parts[0]['text']}" for msg in conversation_history if msg.parts and msg.parts[0].get('text')])
         # Ensure session_data for the prompt does not become excessively large.
         # Consider sending only relevant parts if performance is an issue.
         # For now, sending the whole current_data as per previous structure.
         session_data_json_str = json.dumps(
             session_data, ensure_ascii=False, indent=2)
 
-        prompt = f"""あなたは会議のノート作成アシスタントです。
-以下の現在の完全なセッションデータ（JSON形式）、過去の会話履歴（参考情報）、そして今回対応すべき新しい指示「{instruction}」を総合的に分析してください。
-その上で、セッションデータ内の `notes` リストを更新または項目追加し、更新後の `notes` リスト全体をJSON配列で返してください。
-
-重要な指示:
-- **既存ノートのレビューと統合:** 新しい指示に対応する際、既存の `notes` リストを注意深く確認してください。新しい情報が既存のノートと関連する場合、単に新しいノートを追加するのではなく、既存のノートを更新・拡張するか、関連する複数のノートを1つに統合・要約することを優先してください。情報の重複を避け、ノートを簡潔かつ網羅的に保つことが重要です。
-- **議題変更時:** 議題が変わったと判断した場合、既存のメモはある程度`決定事項`としてまとめてください。
-- **更新か新規作成かの判断:** 既存のノートを更新する方が適切か、全く新しいノートとして追加する方が適切かを文脈から判断してください。各項目について、6項目以上など、リストが多くなりすぎた場合には、適宜まとめても良いです。必要であればそれ以上でもよいです。
-
-各ノート項目は `{{ "id": "note_ユニークID", "type": "memo" | "decision" | "issue", "text": "ノート内容" }}` の形式です。タイムスタンプは不要です。
-- `id`: 既存のノートを更新する場合はそのIDを維持し、新規作成の場合は `note_` から始まるユニークなIDを割り振ってください。
-- `type`: ユーザーの指示内容や文脈から、ノートの種別を "memo"（一般的なメモ・会話の流れ）、"decision"（決定事項）、"issue"（課題・検討事項）のいずれかに分類してください。
-- `text`: ノートの具体的な内容を記述してください。関連情報をまとめる場合は、要点を整理して記述してください。
-
-トランスクリプトのため、文字起こしに誤りがある場合があります。推測して補ってください。
-もし指示内容がノートの変更を意図していない場合は、現在の `notes` リストをそのまま返してください。
-JSON配列のみ出力してください。
-
-現在のセッションデータ:
-```json
-{session_data_json_str}
-```
-
-過去の会話履歴 (参考情報):
-{history_str}
-今回対応すべき新しい指示: {instruction}
-更新後のノート項目リスト (JSON配列):"""
+        prompt = NOTES_PROMPT.render(
+            session_data_json=session_data_json_str,
+            history=history_str,
+            instruction=instruction)
         logger.info(
             f"Sending notes update prompt to LLM. Instruction: {instruction}")
         response = await model.generate_content_async(prompt)
@@ -104,7 +113,6 @@ JSON配列のみ出力してください。
             response, 'text') and response.text else ""
         if not llm_response_text and response.candidates and response.candidates[0].content.parts:
             llm_response_text = response.candidates[0].content.parts[0].text
-        logger.info(f"LLM notes response: {llm_response_text}")
 
         if not llm_response_text:
             return {"notes": current_notes_dict}, "LLM returned empty notes update."
@@ -154,6 +162,7 @@ JSON配列のみ出力してください。
                 return {"notes": current_notes_dict}, f"LLM response was not valid JSON, created a fallback memo. Original response: {llm_response_text}"
             return {"notes": current_notes_dict}, f"LLM response was not valid JSON: {e}. Original: {llm_response_text}"
 
+        mark_agent_succeeded()
         return {"notes": updated_notes_dict}, f"Notes updated by LLM. Total: {len(updated_notes_dict)}."
     except Exception as e:
         logger.error(
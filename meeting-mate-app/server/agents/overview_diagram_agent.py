@@ -9,70 +9,26 @@ except ImportError:
     pass
 
 from models import Message  # Assuming Message model is in a shared models.py
-from config import logger, VERTEX_AI_AVAILABLE, VERTEX_MODEL_NAME
+from config import logger, LLM_AVAILABLE, VERTEX_MODEL_NAME, MERMAID_MAX_REPAIR_ATTEMPTS
+from mermaid_validator import validate_mermaid, auto_fix_mermaid, strip_code_fences, format_issues
+from response_cache import mark_agent_succeeded
+from prompt_templates import PromptTemplate, SESSION_DATA_SECTION, HISTORY_SECTION, INSTRUCTION_SECTION
 import os  # osモジュールをインポート
 
 
-class OverviewDiagramAgent:
-    def __init__(self, config_path: str):
-        self.config_path = config_path
-        logger.info(
-            f"OverviewDiagramAgent initialized with config: {config_path}")
-
-    async def execute(self, instruction: str, conversation_history: List[Message], current_data: Dict[str, Any], llm_model: GenerativeModel, **kwargs) -> Tuple[Dict[str, Any], str]:
-        return await handle_overview_diagram_request(
-            instruction=instruction,
-            conversation_history=conversation_history,
-            current_data=current_data,
-            llm_model=llm_model
-        )
-
-
-async def handle_overview_diagram_request(
-    instruction: str,
-    conversation_history: List[Message],
-    current_data: Dict[str, Any],
-    llm_model: GenerativeModel
-) -> Tuple[Dict[str, Any], str]:
-    logger.info(f"Overview diagram management for instruction: {instruction}")
-    session_data = current_data
-    # Extract existing diagram data if available, default to a simple initial diagram
-    overview_diagram_obj = session_data.get("overviewDiagram", {
-                                            "mermaidDefinition": "graph TD;\n    A[会議開始];", "title": "概要図"})
-    if not isinstance(overview_diagram_obj, dict):  # 念のため型チェック
-        overview_diagram_obj = {
-            "mermaidDefinition": "graph TD;\n    A[会議開始];", "title": "概要図"}
-
-    existing_mermaid_definition = overview_diagram_obj.get(
-        "mermaidDefinition", "graph TD;\n    A[会議開始];")
-    existing_title = overview_diagram_obj.get("title", "概要図")
-
-    if not VERTEX_AI_AVAILABLE or llm_model is None:
-        logger.warning(
-            "Vertex AI not available for overview diagram management or LLM model not provided.")
-        return {"overviewDiagram": {"mermaidDefinition": existing_mermaid_definition, "title": existing_title}}, "概要図は更新されませんでした (Vertex AI利用不可またはLLMモデルが提供されていません)。"
-
-    try:
-        model = llm_model  # 引数で受け取ったllm_modelを使用
-
-        history_str = "\n".join(
-            [f"{msg.role.capitalize()}: {msg.parts[0]['text']}" for msg in conversation_history if msg.parts and msg.parts[0].get('text')])
-
-        session_data_json_str = json.dumps(
-            session_data, ensure_ascii=False, indent=2)
-
-        prompt = f"""You are a meeting overview diagram creation assistant.
-Analyze the current complete session data (JSON format), past conversation history (reference information), and the new instruction "{instruction}" that should be addressed this time.
-Based on this analysis, generate or update a Mermaid.js **`graph TD` or `graph LR`** diagram definition that visually represents the meeting content and project structure.
-
-**CRITICAL OUTPUT REQUIREMENTS:**
+OVERVIEW_DIAGRAM_PROMPT = PromptTemplate(
+    "OverviewDiagramAgent",
+    static_sections=[
+        ("role", """You are a meeting overview diagram creation assistant.
+Analyze the current complete session data (JSON format), past conversation history (reference information), and the new instruction that should be addressed this time, all of which follow after these guidelines.
+Based on this analysis, generate or update a Mermaid.js **`graph TD` or `graph LR`** diagram definition that visually represents the meeting content and project structure."""),
+        ("output_requirements", """**CRITICAL OUTPUT REQUIREMENTS:**
 - Output ONLY the raw Mermaid diagram code
 - Do NOT include any JSON formatting, markdown code blocks, or explanations
 - Do NOT add any comments or additional text outside the Mermaid syntax
 - Start directly with "graph TD" or "graph LR"
-- End with the last class assignment or node definition
-
-**Design Principles (Flat Design):**
+- End with the last class assignment or node definition"""),
+        ("design_guide", """**Design Principles (Flat Design):**
 1. **Modern flat design**: Use color surfaces instead of borders to organize information
 2. **Consistent color palette**: Use unified colors to express information hierarchy
 3. **High readability**: Ensure text visibility with clear contrast
@@ -95,7 +51,7 @@ Based on this analysis, generate or update a Mermaid.js **`graph TD` or `graph L
    - **Shape selection**:
      - Main themes/agenda: `["Text"]` (rectangle)
      - Tasks/actions: `("Text")` (rounded)
-     - Decisions: `{{"Text"}}` (diamond)
+     - Decisions: `{"Text"}` (diamond)
      - Participants: `(("Text"))` (circle)
      - Information/notes: `["Text"]` (rectangle, light color)
 
@@ -150,59 +106,129 @@ classDef decision fill:#D1FAE5,stroke:#D1FAE5,stroke-width:2px,color:#047857,fon
      - **FORBIDDEN Example (causes syntax errors):**
        ```
        subgraph 既存環境 (現行クラウド)
-       ```
-
-**SYNTAX RULES:**
+       ```"""),
+        ("syntax_rules", """**SYNTAX RULES:**
 - Use `%%` for comments, never single `%`
 - Avoid Unicode characters in comments
 - Keep node text simple and ASCII-compatible when possible
 - Use double quotes only when required by Mermaid syntax
 
-**REMEMBER: Output ONLY the raw Mermaid code. No JSON, no markdown blocks, no explanations.**
+**REMEMBER: Output ONLY the raw Mermaid code. No JSON, no markdown blocks, no explanations.**"""),
+    ],
+    dynamic_sections=[
+        ("session_data", SESSION_DATA_SECTION),
+        ("history", HISTORY_SECTION),
+        ("existing_definition", """既存のMermaid定義 (更新のベースとしてください。なければ新規作成):
+```mermaid
+{existing_mermaid_definition}
+```"""),
+        ("instruction", INSTRUCTION_SECTION + "\n\n更新された概要図のMermaid.js定義:"),
+    ],
+)
 
-現在のセッションデータ:
-```json
-{session_data_json_str}
-```
 
-過去の会話履歴 (参考情報):
-{history_str}
 
-既存のMermaid定義 (更新のベースとしてください。なければ新規作成):
-```mermaid
-{existing_mermaid_definition}
-```
+class OverviewDiagramAgent:
+    def __init__(self, config_path: str):
+        self.config_path = config_path
+        logger.info(
+            f"OverviewDiagramAgent initialized with config: {config_path}")
+
+    async def execute(self, instruction: str, conversation_history: List[Message], current_data: Dict[str, Any], llm_model: GenerativeModel, **kwargs) -> Tuple[Dict[str, Any], str]:
+        return await handle_overview_diagram_request(
+            instruction=instruction,
+            conversation_history=conversation_history,
+            current_data=current_data,
+            llm_model=llm_model,
+            history_str=kwargs.get("history_str")
+        )
+
+
+def _extract_response_text(response) -> str:
+    if response.candidates and response.candidates[0].content.parts:
+        return response.candidates[0].content.parts[0].text
+    return ""
+
+
+async def _repair_mermaid_definition(model: GenerativeModel, definition: str, issues) -> str:
+    """ローカルで修復できなかった構文エラーだけを指摘し、LLMに最小限の修正を依頼する。"""
+    repair_prompt = f"""The following Mermaid.js `graph TD/LR` definition has syntax errors.
+Fix ONLY the listed errors and keep every other line unchanged.
+
+Errors:
+{format_issues(issues)}
+
+Rules:
+- Assign classes with `class NODE_ID className` lines, never `:::`.
+- Subgraph titles must be written as `subgraph "Title"` without parentheses.
+- Quote node labels that contain brackets or parentheses, e.g. `A["Text (note)"]`.
+- Output ONLY the raw Mermaid code starting with "graph TD" or "graph LR".
+
+Definition:
+{definition}"""
+    logger.info(
+        f"Requesting targeted Mermaid repair for {len(issues)} issue(s).")
+    response = await model.generate_content_async(repair_prompt)
+    return strip_code_fences(_extract_response_text(response))
+
+
+async def handle_overview_diagram_request(
+    instruction: str,
+    conversation_history: List[Message],
+    current_data: Dict[str, Any],
+    llm_model: GenerativeModel,
+    history_str: Optional[str] = None
+) -> Tuple[Dict[str, Any], str]:
+    logger.info(f"Overview diagram management for instruction: {instruction}")
+    session_data = current_data
+    # Extract existing diagram data if available, default to a simple initial diagram
+    overview_diagram_obj = session_data.get("overviewDiagram", {
+                                            "mermaidDefinition": "graph TD;\n    A[会議開始];", "title": "概要図"})
+    if not isinstance(overview_diagram_obj, dict):  # 念のため型チェック
+        overview_diagram_obj = {
+            "mermaidDefinition": "graph TD;\n    A[会議開始];", "title": "概要図"}
+
+    existing_mermaid_definition = overview_diagram_obj.get(
+        "mermaidDefinition", "graph TD;\n    A[会議開始];")
+    existing_title = overview_diagram_obj.get("title", "概要図")
+
+    if not LLM_AVAILABLE or llm_model is None:
+        logger.warning(
+            "Vertex AI not available for overview diagram management or LLM model not provided.")
+        return {"overviewDiagram": {"mermaidDefinition": existing_mermaid_definition, "title": existing_title}}, "概要図は更新されませんでした (Vertex AI利用不可またはLLMモデルが提供されていません)。"
 
-今回対応すべき新しい指示: {instruction}
+    try:
+        model = llm_model  # 引数で受け取ったllm_modelを使用
 
-更新された概要図のMermaid.js定義 (JSONオブジェクト):"""
+        if history_str is None:
+            history_str = "\n".join(
+                [f"{msg.role.capitalize()}: {msg.parts[0]['text']}" for msg in conversation_history if msg.parts and msg.parts[0].get('text')])
+
+        session_data_json_str = json.dumps(
+            session_data, ensure_ascii=False, indent=2)
+
+        prompt = OVERVIEW_DIAGRAM_PROMPT.render(
+            session_data_json=session_data_json_str,
+            history=history_str,
+            existing_mermaid_definition=existing_mermaid_definition,
+            instruction=instruction)
 
         logger.info(
             f"Sending overview diagram prompt to LLM. Instruction: {instruction}")
         response = await model.generate_content_async(prompt)
 
-        llm_response_text = ""
-        if response.candidates and response.candidates[0].content.parts:
-            llm_response_text = response.candidates[0].content.parts[0].text
-
-        logger.info(f"LLM overview diagram response: {llm_response_text}")
+        llm_response_text = _extract_response_text(response)
 
         if not llm_response_text:
             return {"overviewDiagram": {"mermaidDefinition": existing_mermaid_definition, "title": existing_title}}, "LLM returned empty overview diagram update."
 
         # Clean the response - remove any markdown code blocks if present
-        cleaned_response_text = llm_response_text.strip()
-        if cleaned_response_text.startswith("```mermaid"):
-            cleaned_response_text = cleaned_response_text[10:-3].strip()
-        elif cleaned_response_text.startswith("```"):
-            cleaned_response_text = cleaned_response_text[3:-3].strip()
-        elif cleaned_response_text.startswith("`") and cleaned_response_text.endswith("`"):
-            cleaned_response_text = cleaned_response_text[1:-1].strip()
-
-        # Validate that the response looks like Mermaid syntax
-        if not (cleaned_response_text.startswith("graph TD") or cleaned_response_text.startswith("graph LR")):
+        cleaned_response_text = strip_code_fences(llm_response_text)
+
+        # Mermaid syntax itself is checked by the validator below; only JSON needs unwrapping here
+        if cleaned_response_text.startswith("{"):
             logger.warning(
-                f"LLM response doesn't start with 'graph TD' or 'graph LR': {cleaned_response_text[:50]}...")
+                f"LLM response looks like JSON instead of raw Mermaid: {cleaned_response_text[:50]}...")
             # Try to extract from JSON if it's still in JSON format (fallback)
             try:
                 diagram_update = json.loads(cleaned_response_text)
@@ -219,35 +245,32 @@ classDef decision fill:#D1FAE5,stroke:#D1FAE5,stroke-width:2px,color:#047857,fon
                     "Response is neither valid Mermaid nor JSON, using existing definition")
                 return {"overviewDiagram": {"mermaidDefinition": existing_mermaid_definition, "title": existing_title}}, "LLM response was not in the expected Mermaid format."
 
-        # The cleaned response should now be raw Mermaid code
-        new_mermaid_definition = cleaned_response_text
-
-        # Post-process to clean and fix common Mermaid syntax issues
-        if isinstance(new_mermaid_definition, str):
-            lines = new_mermaid_definition.splitlines()
-            corrected_lines = []
-            for line in lines:
-                stripped_line = line.lstrip()
-                # Fix single '%' comments to use '%%'
-                if stripped_line.startswith("%") and not stripped_line.startswith("%%"):
-                    corrected_lines.append(line.replace(
-                        stripped_line, "%%" + stripped_line[1:], 1))
-                # Remove any problematic Unicode characters in comments
-                elif stripped_line.startswith("%%"):
-                    # Keep only ASCII characters in comments to avoid parsing errors
-                    comment_text = stripped_line[2:].strip()
-                    # Replace common problematic characters
-                    comment_text = comment_text.encode(
-                        'ascii', 'ignore').decode('ascii')
-                    if comment_text:
-                        corrected_lines.append(line.split(
-                            "%%")[0] + "%% " + comment_text)
-                    else:
-                        corrected_lines.append(
-                            line.split("%%")[0] + "%% Comment")
-                else:
-                    corrected_lines.append(line)
-            new_mermaid_definition = "\n".join(corrected_lines)
+        # The cleaned response should now be raw Mermaid code.
+        # Validate locally, auto-fix known failure patterns, and only escalate
+        # to a targeted repair prompt when local fixes are not enough.
+        new_mermaid_definition, applied_fixes = auto_fix_mermaid(
+            cleaned_response_text)
+        if applied_fixes:
+            logger.info(
+                f"Applied local Mermaid fixes: {', '.join(applied_fixes)}")
+        remaining_issues = validate_mermaid(new_mermaid_definition)
+
+        repair_attempts = 0
+        while remaining_issues and repair_attempts < MERMAID_MAX_REPAIR_ATTEMPTS:
+            repair_attempts += 1
+            logger.warning(
+                f"Mermaid definition still invalid after local fixes:\n{format_issues(remaining_issues)}")
+            repaired_definition = await _repair_mermaid_definition(
+                model, new_mermaid_definition, remaining_issues)
+            if not repaired_definition:
+                break
+            new_mermaid_definition, _ = auto_fix_mermaid(repaired_definition)
+            remaining_issues = validate_mermaid(new_mermaid_definition)
+
+        if remaining_issues:
+            logger.error(
+                f"Mermaid definition invalid after {repair_attempts} repair attempt(s), keeping existing definition:\n{format_issues(remaining_issues)}")
+            return {"overviewDiagram": {"mermaidDefinition": existing_mermaid_definition, "title": existing_title}}, "生成された概要図に構文エラーがあったため、既存の概要図を維持しました。"
 
         # Generate a title based on the instruction or use existing
         new_title = existing_title
@@ -258,8 +281,7 @@ classDef decision fill:#D1FAE5,stroke:#D1FAE5,stroke-width:2px,color:#047857,fon
                 title_words += "..."
             new_title = f"概要図: {title_words}"
 
-        user_message = f"""概要図がLLMによって更新されました。
-以下は生成されたMermaid定義です。お手数ですが、この定義をコピーして Mermaid Live Editor (https://mermaid.live) などで直接貼り付けて、構文エラーが発生するかどうかご確認ください。
+        user_message = f"""概要図がLLMによって更新されました（構文チェック済み）。
 
 ```mermaid
 {new_mermaid_definition}
@@ -275,6 +297,7 @@ classDef decision fill:#D1FAE5,stroke:#D1FAE5,stroke-width:2px,color:#047857,fon
         logger.info(
             f"Saving overview diagram with mermaidDefinition length: {len(new_mermaid_definition) if new_mermaid_definition else 0}")
 
+        mark_agent_succeeded()
         return {
             "overviewDiagram": overview_diagram_data
         }, user_message
@@ -9,9 +9,130 @@ except ImportError:
     pass
 
 from models import Message
-from config import logger, VERTEX_AI_AVAILABLE, VERTEX_MODEL_NAME
+from config import logger, LLM_AVAILABLE, VERTEX_MODEL_NAME
+from response_cache import mark_agent_succeeded
+from prompt_templates import PromptTemplate, ANALYZE_INPUTS_JA, SESSION_DATA_SECTION, HISTORY_SECTION
 import uuid  # uuidがfallbackで使用されているためインポート
 import os  # osモジュールをインポート
+import re
+
+PARTICIPANT_REPRESENTATIVE_MODE_CONTEXT = """**重要: 代表参加者モードが有効です:**
+- この会議では参加者は代表者として発言しており、個々の発言者の特定はできません。
+- 新しい参加者を追加する際は、役割を「代表者」として設定してください。
+- 発言者の身元が特定できないことを前提に参加者管理を行ってください。"""
+
+PARTICIPANT_PROMPT = PromptTemplate(
+    "ParticipantManagementAgent",
+    static_sections=[
+        ("role", f"""あなたは会議の参加者管理アシスタントです。
+{ANALYZE_INPUTS_JA}
+その上で、セッションデータ内の `participants` オブジェクトを更新し、更新後の `participants` オブジェクト全体をJSON形式で返してください。
+指示を出した操作者の名前は、末尾の指示と一緒に示します。"""),
+        ("schema", """**参加者データ (`participants`) のスキーマ:**
+`participants` は、キーが参加者ID (例: "participant_tanaka")、値が参加者情報オブジェクトとなるJSONオブジェクトです。
+各参加者情報オブジェクトは、以下のキーを持ちます:
+- `name` (string, 必須): 参加者の名前。
+- `role` (string, 必須): 参加者の役割。不明な場合は「参加者」としてください。代表参加者モードの場合は「代表者」を使用してください。
+- `joinedAt` (string, オプショナル): 参加日時 (ISO 8601形式)。"""),
+        ("rules", """**指示の解釈と処理:**
+- 新しい参加者を追加する場合: 操作者が指示した名前で新しい参加者エントリを作成してください。IDは `participant_` + 名前（英小文字など） + `_` + 短いユニーク文字列などで生成してください。
+- 既存の参加者の情報を変更する場合: 指示内容に基づいて、該当する参加者の `name` や `role` を更新してください。IDは変更しないでください。
+- 操作者自身の情報を変更する場合: `participants` オブジェクト内で操作者に該当するエントリ（もしあれば）の情報を更新してください。もし操作者がまだリストにいない場合は、新しいエントリとして追加してください。その際、IDは `participant_{操作者の名前}_id` のように生成し、名前は操作者の名前としてください。
+- 重複は避けてください（同じ `name` の参加者が複数存在しないように、IDで区別します）。
+- もし指示内容が参加者情報の変更を意図していない場合は、現在の `participants` オブジェクトをそのまま返してください。
+
+結果はJSONオブジェクトのみ出力してください。"""),
+        ("example", """更新後の参加者オブジェクトの例 (上記スキーマのJSONオブジェクト):
+```json
+{
+  "participant_tanaka_123": {
+    "name": "田中一郎",
+    "role": "プロジェクトマネージャー",
+    "joinedAt": "2024-05-20T10:00:00Z"
+  },
+  "participant_suzuki_456": {
+    "name": "鈴木花子",
+    "role": "開発リーダー",
+    "joinedAt": "2024-05-20T10:01:00Z"
+  }
+}
+```"""),
+    ],
+    dynamic_sections=[
+        ("representative_mode", "{representative_mode_context}"),
+        ("session_data", SESSION_DATA_SECTION),
+        ("history", HISTORY_SECTION),
+        ("instruction", "今回対応すべき新しい指示 (操作者: {speaker_name}): {instruction}\n\n更新後の参加者オブジェクト (JSON):"),
+    ],
+)
+
+
+# 自分自身の役割を明示する発言パターン (例: 「私はフロントエンド担当です」)
+_SELF_SUBJECT = r"(?:私|わたし|僕|ぼく|俺|自分)"
+SELF_ROLE_PATTERNS = [
+    re.compile(_SELF_SUBJECT +
+               r"(?:は|が)(?P<role>[^、。,.！？!?\s]{1,20}?担当)(?:です|になります|をします|します)"),
+    re.compile(_SELF_SUBJECT +
+               r"の役割は(?P<role>[^、。,.！？!?\s]{1,20}?)(?:です|になります)"),
+    re.compile(_SELF_SUBJECT +
+               r"(?:は|が)?(?P<role>[^、。,.！？!?\s]{1,20}?)として(?:参加|出席)(?:します|しています|しております)"),
+]
+# 名前は発言の先頭か区切り文字の直後から始まるものだけを対象にする
+# （「来週は田中さんは…」の「来週は田中」のように前の語句まで名前に含めないため）
+_NAME_START = r"(?:^|(?<=[、。,.！？!?\s]))"
+# 他の参加者の役割を明示する発言パターン (例: 「田中さんはPM担当です」)
+OTHER_ROLE_PATTERNS = [
+    re.compile(_NAME_START +
+               r"(?P<name>[^、。,.！？!?\s]{1,15}?)さん(?:は|が)(?P<role>[^、。,.！？!?\s]{1,20}?担当)(?:です|になります|をお願いします)"),
+    re.compile(_NAME_START +
+               r"(?P<name>[^、。,.！？!?\s]{1,15}?)さんの役割を(?P<role>[^、。,.！？!?\s]{1,20}?)に(?:変更|設定)"),
+]
+
+
+def _find_participant_ids_by_name(participants: Dict[str, Any], name: str) -> List[str]:
+    return [p_id for p_id, p_info in participants.items()
+            if isinstance(p_info, dict) and name and p_info.get("name") and
+            (p_info["name"] == name or p_info["name"].startswith(name))]
+
+
+def extract_role_updates(text: str, speaker_id: Optional[str], participants: Optional[Dict[str, Any]]) -> Tuple[Dict[str, str], bool]:
+    """
+    発言や指示から明示的な役割の宣言をパターンで抽出する。
+    戻り値は ({参加者ID: 新しい役割}, 曖昧な宣言が含まれていたか)。
+    名前で指定された参加者が一意に特定できない場合は曖昧と判定する。
+    """
+    updates: Dict[str, str] = {}
+    ambiguous = False
+    if not text:
+        return updates, ambiguous
+    participants = participants or {}
+
+    for pattern in OTHER_ROLE_PATTERNS:
+        for match in pattern.finditer(text):
+            matched_ids = _find_participant_ids_by_name(
+                participants, match.group("name"))
+            if len(matched_ids) == 1:
+                updates[matched_ids[0]] = match.group("role")
+            else:
+                ambiguous = True
+
+    if speaker_id and speaker_id != "ai":
+        for pattern in SELF_ROLE_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                updates.setdefault(speaker_id, match.group("role"))
+                break
+    return updates, ambiguous
+
+
+def apply_role_updates(participants: Dict[str, Any], updates: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """役割の更新を適用し、変更があった参加者エントリだけを返す。"""
+    changed = {}
+    for p_id, role in updates.items():
+        current = participants.get(p_id)
+        if isinstance(current, dict) and current.get("role") != role:
+            changed[p_id] = {**current, "role": role}
+    return changed
 
 
 class ParticipantManagementAgent:
@@ -21,12 +142,27 @@ class ParticipantManagementAgent:
             f"ParticipantManagementAgent initialized with config: {config_path}")
 
     async def execute(self, instruction: str, conversation_history: List[Message], current_data: Dict[str, Any], speaker_name: str, llm_model: GenerativeModel, **kwargs) -> Tuple[Dict[str, Any], str]:
+        # 定型パターンで解決できる指示はLLMを呼ばずに処理する
+        # 指示はオーケストレーターの文章で、発言者本人の言葉とは限らないため、名前で指定された宣言だけを扱う
+        # （「私は〇〇担当です」のような自分の役割宣言は、発言を受け取った時点で発言者に反映済み）
+        participants = current_data.get("participants") or {}
+        if isinstance(participants, dict):
+            updates, ambiguous = extract_role_updates(
+                instruction, None, participants)
+            if updates and not ambiguous:
+                changed = apply_role_updates(participants, updates)
+                logger.info(
+                    f"Participant instruction resolved without LLM: {updates}")
+                mark_agent_succeeded()
+                return {"participants": {**participants, **changed}}, f"Participants updated by pattern match. Changed: {len(changed)}."
+
         return await handle_participant_management_request(
             instruction=instruction,
             conversation_history=conversation_history,
             current_data=current_data,
             speaker_name=speaker_name,
-            llm_model=llm_model
+            llm_model=llm_model,
+            history_str=kwargs.get("history_str")
         )
 
 
@@ -35,7 +171,8 @@ async def handle_participant_management_request(
     conversation_history: List[Message],
     current_data: Dict[str, Any],
     speaker_name: str,
-    llm_model: GenerativeModel
+    llm_model: GenerativeModel,
+    history_str: Optional[str] = None
 ) -> Tuple[Dict[str, Any], str]:
     session_data = current_data
     # Participants are now an object, not a list
@@ -54,7 +191,7 @@ async def handle_participant_management_request(
         else:
             current_participants_obj = {}
 
-    if not VERTEX_AI_AVAILABLE or llm_model is None:
+    if not LLM_AVAILABLE or llm_model is None:
         logger.warning(
             "ParticipantAgent: Fallback logic not fully adapted for new object structure. LLM recommended.")
         if speaker_name and not any(p.get("name") == speaker_name for p in current_participants_obj.values()):
@@ -67,69 +204,22 @@ async def handle_participant_management_request(
     try:
         model = llm_model  # 引数で受け取ったllm_modelを使用
 
-        history_str = "\n".join(
-            [f"{msg.role.capitalize()}: {msg.parts[0]['text']}" for msg in conversation_history if msg.parts and msg.parts[0].get('text')])
+        if history_str is None:
+            history_str = "\n".join(
+                [f"{msg.role.capitalize()}: {msg.parts[0]['text']}" for msg in conversation_history if msg.parts and msg.parts[0].get('text')])
 
         session_data_json_str = json.dumps(
             session_data, ensure_ascii=False, indent=2)
 
         # Check if representative mode is enabled
         representative_mode = session_data.get("representativeMode", False)
-        representative_mode_context = ""
-        if representative_mode:
-            representative_mode_context = """
-**重要: 代表参加者モードが有効です:**
-- この会議では参加者は代表者として発言しており、個々の発言者の特定はできません。
-- 新しい参加者を追加する際は、役割を「代表者」として設定してください。
-- 発言者の身元が特定できないことを前提に参加者管理を行ってください。
-"""
-
-        prompt = f"""あなたは会議の参加者管理アシスタントです。
-現在の操作者は「{speaker_name}」さんです。
-以下の現在の完全なセッションデータ（JSON形式）、過去の会話履歴（参考情報）、そして今回対応すべき新しい指示「{instruction}」を分析してください。
-その上で、セッションデータ内の `participants` オブジェクトを更新し、更新後の `participants` オブジェクト全体をJSON形式で返してください。
-{representative_mode_context}
-**参加者データ (`participants`) のスキーマ:**
-`participants` は、キーが参加者ID (例: "participant_tanaka")、値が参加者情報オブジェクトとなるJSONオブジェクトです。
-各参加者情報オブジェクトは、以下のキーを持ちます:
-- `name` (string, 必須): 参加者の名前。
-- `role` (string, 必須): 参加者の役割。不明な場合は「参加者」としてください。代表参加者モードの場合は「代表者」を使用してください。
-- `joinedAt` (string, オプショナル): 参加日時 (ISO 8601形式)。
-
-**指示の解釈と処理:**
-- 新しい参加者を追加する場合: `speaker_name` さんが指示した名前で新しい参加者エントリを作成してください。IDは `participant_` + 名前（英小文字など） + `_` + 短いユニーク文字列などで生成してください。
-- 既存の参加者の情報を変更する場合: 指示内容に基づいて、該当する参加者の `name` や `role` を更新してください。IDは変更しないでください。
-- `speaker_name` さん自身の情報を変更する場合: `participants` オブジェクト内で `speaker_name` さんに該当するエントリ（もしあれば）の情報を更新してください。もし `speaker_name` さんがまだリストにいない場合は、新しいエントリとして追加してください。その際、IDは `participant_{speaker_name}_id` のように生成し、名前は `{speaker_name}` としてください。
-- 重複は避けてください（同じ `name` の参加者が複数存在しないように、IDで区別します）。
-- もし指示内容が参加者情報の変更を意図していない場合は、現在の `participants` オブジェクトをそのまま返してください。
 
-結果はJSONオブジェクトのみ出力してください。
-
-現在のセッションデータ:
-```json
-{session_data_json_str}
-```
-
-過去の会話履歴 (参考情報):\n{history_str}
-今回対応すべき新しい指示 (操作者: {speaker_name}): {instruction}
-
-更新後の参加者オブジェクト (上記スキーマのJSONオブジェクト):
-例:
-```json
-{{
-  "participant_tanaka_123": {{
-    "name": "田中一郎",
-    "role": "プロジェクトマネージャー",
-    "joinedAt": "2024-05-20T10:00:00Z"
-  }},
-  "participant_suzuki_456": {{
-    "name": "鈴木花子",
-    "role": "開発リーダー",
-    "joinedAt": "2024-05-20T10:01:00Z"
-  }}
-}}
-```
-更新後の参加者オブジェクト (JSON):"""
+        prompt = PARTICIPANT_PROMPT.render(
+            representative_mode_context=PARTICIPANT_REPRESENTATIVE_MODE_CONTEXT if representative_mode else "",
+            speaker_name=speaker_name,
+            session_data_json=session_data_json_str,
+            history=history_str,
+            instruction=instruction)
         logger.info(
             f"Sending participant update prompt to LLM. Instruction: {instruction}, Speaker: {speaker_name}")
         response = await model.generate_content_async(prompt)
@@ -140,7 +230,6 @@ async def handle_participant_management_request(
         elif hasattr(response, 'text') and response.text:
             llm_response_text = response.text
 
-        logger.info(f"LLM participant response: {llm_response_text}")
         if not llm_response_text:
             return {"participants": current_participants_obj}, "LLM returned empty participant update."
 
@@ -157,8 +246,9 @@ async def handle_participant_management_request(
             raise ValueError(
                 "LLM participant response not an object.")
 
-        # Validate schema of each participant object within the main object
-        valid_participants_obj = {}
+        # Validate schema of each participant object within the main object.
+        # 既存の参加者（UIDキー）はアクセス制御に使われるため、LLMの応答で削除させない
+        valid_participants_obj = dict(current_participants_obj)
         for p_id, p_info in updated_participants_obj.items():
             if isinstance(p_info, dict) and "name" in p_info and "role" in p_info:
                 valid_participants_obj[p_id] = p_info
@@ -166,6 +256,7 @@ async def handle_participant_management_request(
                 logger.warning(
                     f"LLM returned participant entry with invalid schema, skipping: ID={p_id}, Data={p_info}")
 
+        mark_agent_succeeded()
         return {"participants": valid_participants_obj}, f"Participants updated by LLM. Total entries: {len(valid_participants_obj)}."
     except Exception as e:
         logger.error(
@@ -16,13 +16,70 @@ if TYPE_CHECKING:
 else:
     # For runtime, we'll use a duck-typed approach
     LLMMessage = object
-from config import logger, VERTEX_AI_AVAILABLE, VERTEX_MODEL_NAME
+from config import logger, LLM_AVAILABLE, VERTEX_MODEL_NAME
+from response_cache import mark_agent_succeeded
+from prompt_templates import (PromptTemplate, ANALYZE_INPUTS_JA, TRANSCRIPT_ERROR_NOTE,
+                              SESSION_DATA_SECTION, HISTORY_SECTION, INSTRUCTION_SECTION)
 import os  # osモジュールをインポート
 # file_utils (load_session_data, save_session_data) are typically used by the orchestrator,
 # not directly by individual agents, so they are not imported here.
 # Agents receive necessary data as arguments and return updated data.
 
 
+TASK_PROMPT = PromptTemplate(
+    "TaskManagementAgent",
+    static_sections=[
+        ("role", f"""あなたは会議のタスク管理アシスタントです。
+{ANALYZE_INPUTS_JA}
+その上で、セッションデータ内の `tasks` リストを更新し、更新後の `tasks` リスト全体をJSON配列で返してください。"""),
+        ("schema", """**タスクオブジェクトのスキーマ:**
+各タスクオブジェクトは、以下のキーを持つJSONオブジェクトとしてください。
+- `id` (string, 必須): タスクの一意な識別子。`task_` から始まるIDを推奨します。既存のタスクを更新する場合はそのIDを維持し、新規タスクの場合は既存と重複しない新しいIDを割り振ってください。
+- `title` (string, 必須): タスクの簡潔なタイトル。
+- `status` (string, 必須): タスクの進捗状況。「todo」（未着手）、「doing」（進行中）、「done」（完了）のいずれかの値を設定してください。
+- `assignee` (string, オプショナル): タスクの担当者名。該当がない場合はキー自体を省略するか、`null` 値を設定してください。
+- `dueDate` (string, オプショナル): タスクの期限。YYYY-MM-DD形式を推奨します。該当がない場合はキー自体を省略するか、`null` 値を設定してください。
+- `detail` (string, オプショナル): タスクに関する追加の詳細情報。指示内容から詳細が読み取れる場合はそれを記述してください。該当がない場合はキー自体を省略するか、空文字列 `""` または `null` 値を設定してください。
+
+**重要: 上記スキーマに定義されていないキーはタスクオブジェクトに含めないでください。**"""),
+        ("rules", f"""**指示の解釈:**
+- 指示内容がタスクの追加、更新、削除、ステータス変更など、**タスクリストの内容を変更する操作**を意図している場合は、その変更を反映した新しい `tasks` リストを生成してください。
+- 指示内容が「現在のタスク一覧を教えて」「課題は何がある？」のように、**現在のタスクリストを参照・表示する操作**を意図している場合は、変更を加えず、現在の `tasks` リストをそのまま返してください。
+- 指示内容がタスク管理と全く関係ない場合は、現在の `tasks` リストをそのまま返してください。
+{TRANSCRIPT_ERROR_NOTE}
+
+結果はJSON配列のみ出力してください。"""),
+        ("example", """更新後のタスクリストの例 (JSON配列、上記のスキーマを厳守):
+```json
+[
+  {
+    "id": "task_abc123",
+    "title": "新機能Aの設計",
+    "status": "doing",
+    "assignee": "田中",
+    "dueDate": "2024-06-15",
+    "detail": "API仕様とデータベーススキーマを含む。"
+  },
+  {
+    "id": "task_def456",
+    "title": "ユーザードキュメント作成",
+    "status": "todo",
+    "assignee": null,
+    "dueDate": "2024-06-30",
+    "detail": "リリースノートとFAQページを作成する。"
+  }
+]
+```"""),
+    ],
+    dynamic_sections=[
+        ("session_data", SESSION_DATA_SECTION +
+         "\n上記のセッションデータの中の `tasks` リスト（現在は `{current_tasks}` となっています）を参照してください。"),
+        ("history", HISTORY_SECTION),
+        ("instruction", INSTRUCTION_SECTION + "\n\n更新後のタスクリスト (JSON配列):"),
+    ],
+)
+
+
 class TaskManagementAgent:
     def __init__(self, config_path: str):
         self.config_path = config_path
@@ -34,7 +91,8 @@ class TaskManagementAgent:
             instruction=instruction,
             conversation_history=conversation_history,
             current_data=current_data,
-            llm_model=llm_model
+            llm_model=llm_model,
+            history_str=kwargs.get("history_str")
         )
 
 
@@ -42,7 +100,8 @@ async def handle_task_management_request(
     instruction: str,
     conversation_history: List[Any],
     current_data: Dict[str, Any],
-    llm_model: GenerativeModel
+    llm_model: GenerativeModel,
+    history_str: Optional[str] = None
 ) -> Tuple[Dict[str, Any], str]:
     """
     Manages tasks based on user instruction using Vertex AI.
@@ -60,7 +119,7 @@ async def handle_task_management_request(
         else:
             current_tasks_dict = {}
 
-    if not VERTEX_AI_AVAILABLE or llm_model is None:
+    if not LLM_AVAILABLE or llm_model is None:
         # Fallback: create a simple 'todo' task
         new_task_id = f"task_{uuid.uuid4()}"
         new_task = {
@@ -77,67 +136,18 @@ async def handle_task_management_request(
     try:
         model = llm_model  # 引数で受け取ったllm_modelを使用
 
-        history_str = "\n".join(
-            [f"{msg.role.capitalize()}: {msg.parts[0]['text']}" for msg in conversation_history if msg.parts and msg.parts[0].get('text')])
+        if history_str is None:
+            history_str = "\n".join(
+                [f"{msg.role.capitalize()}: {msg.parts[0]['text']}" for msg in conversation_history if msg.parts and msg.parts[0].get('text')])
 
         session_data_json_str = json.dumps(
             session_data, ensure_ascii=False, indent=2)
 
-        prompt = f"""あなたは会議のタスク管理アシスタントです。
-以下の現在の完全なセッションデータ（JSON形式）、過去の会話履歴（参考情報）、そして今回対応すべき新しい指示「{instruction}」を分析してください。
-その上で、セッションデータ内の `tasks` リストを更新し、更新後の `tasks` リスト全体をJSON配列で返してください。
-
-**タスクオブジェクトのスキーマ:**
-各タスクオブジェクトは、以下のキーを持つJSONオブジェクトとしてください。
-- `id` (string, 必須): タスクの一意な識別子。`task_` から始まるIDを推奨します。既存のタスクを更新する場合はそのIDを維持し、新規タスクの場合は既存と重複しない新しいIDを割り振ってください。
-- `title` (string, 必須): タスクの簡潔なタイトル。
-- `status` (string, 必須): タスクの進捗状況。「todo」（未着手）、「doing」（進行中）、「done」（完了）のいずれかの値を設定してください。
-- `assignee` (string, オプショナル): タスクの担当者名。該当がない場合はキー自体を省略するか、`null` 値を設定してください。
-- `dueDate` (string, オプショナル): タスクの期限。YYYY-MM-DD形式を推奨します。該当がない場合はキー自体を省略するか、`null` 値を設定してください。
-- `detail` (string, オプショナル): タスクに関する追加の詳細情報。指示内容から詳細が読み取れる場合はそれを記述してください。該当がない場合はキー自体を省略するか、空文字列 `""` または `null` 値を設定してください。
-
-**重要: 上記スキーマに定義されていないキーはタスクオブジェクトに含めないでください。**
-
-**指示の解釈:**
-- 指示内容がタスクの追加、更新、削除、ステータス変更など、**タスクリストの内容を変更する操作**を意図している場合は、その変更を反映した新しい `tasks` リストを生成してください。
-- 指示内容が「現在のタスク一覧を教えて」「課題は何がある？」のように、**現在のタスクリストを参照・表示する操作**を意図している場合は、変更を加えず、現在の `tasks` リストをそのまま返してください。
-- 指示内容がタスク管理と全く関係ない場合は、現在の `tasks` リストをそのまま返してください。
-トランスクリプトのため、文字起こしに誤りがある場合があります。推測して補ってください。
-
-結果はJSON配列のみ出力してください。
-
-現在のセッションデータ:
-```json
-{session_data_json_str}
-```
-上記のセッションデータの中の `tasks` リスト（現在は `{session_data.get("tasks", [])}` となっています）を参照してください。
-
-過去の会話履歴 (参考情報):\n{history_str}
-今回対応すべき新しい指示: {instruction}
-
-更新後のタスクリスト (JSON配列、上記のスキーマを厳守):
-例:
-```json
-[
-  {{
-    "id": "task_abc123",
-    "title": "新機能Aの設計",
-    "status": "doing",
-    "assignee": "田中",
-    "dueDate": "2024-06-15",
-    "detail": "API仕様とデータベーススキーマを含む。"
-  }},
-  {{
-    "id": "task_def456",
-    "title": "ユーザードキュメント作成",
-    "status": "todo",
-    "assignee": null,
-    "dueDate": "2024-06-30",
-    "detail": "リリースノートとFAQページを作成する。"
-  }}
-]
-```
-更新後のタスクリスト (JSON配列):"""
+        prompt = TASK_PROMPT.render(
+            session_data_json=session_data_json_str,
+            current_tasks=session_data.get("tasks", []),
+            history=history_str,
+            instruction=instruction)
         logger.info(
             f"Sending task update prompt to LLM. Instruction: {instruction}")
         response = await model.generate_content_async(prompt)
@@ -146,7 +156,6 @@ async def handle_task_management_request(
         if response.candidates and response.candidates[0].content.parts:
             llm_response_text = response.candidates[0].content.parts[0].text
 
-        logger.info(f"LLM task response: {llm_response_text}")
         if not llm_response_text:
             return {"tasks": current_tasks_dict}, "LLM returned empty task update."
 
@@ -188,6 +197,7 @@ async def handle_task_management_request(
                 logger.warning(
                     f"Invalid task item from LLM (missing id or not a dict): {task}")
 
+        mark_agent_succeeded()
         return {"tasks": updated_tasks_dict}, f"Tasks updated by LLM. Total: {len(updated_tasks_dict)}."
     except Exception as e:
         logger.error(
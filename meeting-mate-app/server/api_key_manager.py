@@ -1,5 +1,5 @@
 from cryptography.fernet import Fernet
-import firebase_admin
+from rtdb import db
 from datetime import datetime, timedelta
 import os
 import logging
@@ -9,7 +9,7 @@ logger = logging.getLogger(__name__)
 
 class FirebaseAPIKeyManager:
     def __init__(self):
-        self.db = firebase_admin.db
+        self.db = db
         # 将来的にはSecret Managerから取得
         self.encryption_key = os.environ.get('ENCRYPTION_KEY')
         if not self.encryption_key:
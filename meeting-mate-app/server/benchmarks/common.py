@@ -0,0 +1,159 @@
+"""
+ベンチマーク共通の処理。
+
+サーバーのモジュールは設定（環境変数）を import 時に読むため、
+configure_offline_backends() でインメモリRTDBとフェイクLLMを選んでから import_app() でアプリを読み込む。
+結果はコミットごとに比較できるよう、コミットIDと実行条件を付けてJSONで保存する。
+"""
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+from typing import Any, Dict, Iterable, List, Optional
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# 合成する発言の材料
+TOPICS = ["API設計", "認証方式", "リリース計画", "テスト計画", "データベース移行", "UI改善", "監視設定", "予算", "採用", "顧客要望"]
+STATEMENT_TEMPLATES = [
+    "{topic}について、現状の課題を整理しましょう",
+    "{topic}は来週までに方針を決めたいです",
+    "{name}さん、{topic}の資料を金曜までにお願いします",
+    "{topic}については前回の結論どおりで問題ないと思います",
+    "{topic}の進め方で懸念があるので共有します",
+    "{topic}は{other}と合わせて検討した方がよさそうです",
+    "では{topic}はこの方針で決定にしましょう",
+    "次の議題は{topic}です",
+    "{topic}の担当は{name}さんでお願いします",
+    "{topic}について、もう少し詳しく説明してもらえますか",
+]
+SPEAKER_NAMES = ["田中", "鈴木", "佐藤", "高橋", "伊藤", "渡辺", "山本", "中村", "小林", "加藤"]
+
+
+def synthesize_statement(rng: random.Random) -> str:
+    topic, other = rng.sample(TOPICS, 2)
+    return rng.choice(STATEMENT_TEMPLATES).format(topic=topic, other=other, name=rng.choice(SPEAKER_NAMES))
+
+
+def use_server_modules(extra_env: Optional[Dict[str, str]] = None):
+    """サーバーのモジュールを import できるようにし、設定を環境変数で上書きする（import する前に呼ぶ）。"""
+    for key, value in (extra_env or {}).items():
+        os.environ[key] = str(value)
+    if SERVER_DIR not in sys.path:
+        sys.path.insert(0, SERVER_DIR)
+
+
+def configure_offline_backends(llm_profile: str = "flash", rtdb_latency_ms: float = 0.0,
+                               extra_env: Optional[Dict[str, str]] = None):
+    """インメモリRTDBとフェイクLLMを選ぶ（サーバーのモジュールを import する前に呼ぶ）。"""
+    os.environ["RTDB_BACKEND"] = "memory"
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_PROFILE"] = llm_profile
+    os.environ["RTDB_MEMORY_LATENCY_MS"] = str(rtdb_latency_ms)
+    use_server_modules(extra_env)
+
+
+def parse_env_overrides(values: Iterable[str]) -> Dict[str, str]:
+    """--env KEY=VALUE の指定を辞書にする。"""
+    overrides = {}
+    for item in values or []:
+        key, separator, value = item.partition("=")
+        if not separator:
+            raise ValueError(f"Invalid --env value (expected KEY=VALUE): {item}")
+        overrides[key.strip()] = value
+    return overrides
+
+
+def import_app(log_level: str = "WARNING"):
+    """main モジュール（FastAPIアプリ）を読み込み、ログを抑える（プロンプト全文のログ出力は計測に影響するため）。"""
+    import main
+    logging.getLogger().setLevel(getattr(logging, log_level.upper(), logging.WARNING))
+    return main
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """線形補間による分位点（sorted_values は昇順）。"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100.0
+    lower, upper = math.floor(position), math.ceil(position)
+    if lower == upper:
+        return sorted_values[int(position)]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def latency_summary(values_ms: List[float]) -> Dict[str, float]:
+    values = sorted(values_ms)
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 2) if values else 0.0,
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(values[-1], 2) if values else 0.0,
+    }
+
+
+def git_revision() -> Dict[str, Any]:
+    def _git(*args):
+        return subprocess.run(["git", *args], cwd=SERVER_DIR, capture_output=True, text=True, timeout=30).stdout.strip()
+    try:
+        return {"commit": _git("rev-parse", "HEAD"), "shortCommit": _git("rev-parse", "--short", "HEAD"),
+                "dirty": bool(_git("status", "--porcelain", "--untracked-files=no"))}
+    except (OSError, subprocess.SubprocessError):
+        return {"commit": None, "shortCommit": None, "dirty": None}
+
+
+def write_results(name: str, parameters: Dict[str, Any], summary: Dict[str, Any], details: Any = None,
+                  output_path: Optional[str] = None) -> str:
+    revision = git_revision()
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    document = {
+        "benchmark": name,
+        "timestamp": started_at.isoformat(),
+        "git": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "summary": summary,
+        "details": details,
+    }
+    if not output_path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output_path = os.path.join(
+            RESULTS_DIR, f"{name}-{revision['shortCommit'] or 'nogit'}-{started_at.strftime('%Y%m%dT%H%M%SZ')}.json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    return output_path
+
+
+def _flatten_numbers(value: Any, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flat.update(_flatten_numbers(item, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        flat[prefix] = float(value)
+    return flat
+
+
+def compare_with_baseline(summary: Dict[str, Any], baseline_path: str) -> List[str]:
+    """保存済みの結果（別のコミットで実行したもの）と summary の数値を比較した行を返す。"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    current_values = _flatten_numbers(summary)
+    baseline_values = _flatten_numbers(baseline.get("summary", {}))
+    lines = [f"Compared with {baseline_path} (commit {baseline.get('git', {}).get('shortCommit')}):"]
+    for key in sorted(current_values):
+        if key not in baseline_values:
+            continue
+        before, after = baseline_values[key], current_values[key]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        lines.append(f"  {key}: {before:g} -> {after:g} ({change})")
+    return lines
@@ -0,0 +1,423 @@
+"""
+会議の長さに対するプロンプトサイズ・処理時間の伸びを測るベンチマーク。
+
+100〜10,000件のトランスクリプトと数百件のタスク・ノートを持つルームを合成してインメモリRTDBに書き込み、
+会議の長さごとに次を計測する（LLMはフェイクの instant プロファイルで、応答待ちは含まない）。
+- RTDBのペイロードサイズ（rooms/{id}・transcripts/{id} のJSONバイト数）
+- シリアライズ時間（セッションデータのJSON化、トランスクリプトのLLM形式への変換）
+- 各エージェントのプロンプト組み立て時間と概算トークン数（セクション別）
+- オーケストレーション全体の処理時間・LLMに送ったトークン数・メモリのピーク（tracemalloc）
+各指標を log-log で直線近似した指数を求め、会議の長さに対して超線形（既定で指数 > 1.15）に伸びる指標を報告する。
+
+使い方（meeting-mate-app/server で実行）:
+    python -m benchmarks.long_meeting_scaling
+    python -m benchmarks.long_meeting_scaling --lengths 100,1000,10000 --max-items 300 --plot /tmp/scaling.png
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from benchmarks.common import (SPEAKER_NAMES, TOPICS, configure_offline_backends, import_app, parse_env_overrides,
+                               synthesize_statement, write_results, compare_with_baseline)
+
+AGENT_ATTRIBUTES = {
+    "TaskManagementAgent": "task_agent",
+    "NotesGeneratorAgent": "notes_agent",
+    "AgendaManagementAgent": "agenda_agent",
+    "OverviewDiagramAgent": "overview_diagram_agent",
+    "ParticipantManagementAgent": "participant_agent",
+}
+AGENT_INSTRUCTIONS = {
+    "TaskManagementAgent": "新しいタスク「API設計の資料作成」を田中さんの担当で登録してください",
+    "NotesGeneratorAgent": "API設計は来週までに方針を決めることを決定事項として記録してください",
+    "AgendaManagementAgent": "現在の議題をAPI設計に更新し、次の議題候補を提案してください",
+    "OverviewDiagramAgent": "API設計と認証方式の関係を概要図に反映してください",
+    "ParticipantManagementAgent": "鈴木さんの役割をレビュー担当に更新してください",
+}
+# オーケストレーションを起動する最新発言（タスク・ノート・議題のエージェントが呼ばれる）
+FINAL_STATEMENT = "では田中さん、API設計の資料を金曜までにお願いします。この方針で決定にしましょう"
+MIN_TIMING_MS = 1.0
+
+
+def synthesize_room(length: int, items: int, participants: int, rng: random.Random) -> Dict[str, Any]:
+    """rooms/{id}・transcripts/{id}・room_meta/{id} に書き込む合成データを作る。"""
+    started = datetime(2025, 1, 1, 9, 0, 0)
+    speakers = [(f"uid_{i}", SPEAKER_NAMES[i % len(SPEAKER_NAMES)] + ("" if i < len(SPEAKER_NAMES) else str(i)))
+                for i in range(participants)]
+    transcript = []
+    for i in range(length):
+        if i % 4 == 3:
+            entry = {"text": f"📝 Notes：{synthesize_statement(rng)}", "userId": "ai", "userName": "AI", "role": "ai"}
+        else:
+            user_id, user_name = rng.choice(speakers)
+            entry = {"text": synthesize_statement(rng), "userId": user_id, "userName": user_name, "role": "user"}
+        entry["timestamp"] = (started + timedelta(seconds=5 * i)).isoformat() + "Z"
+        transcript.append(entry)
+    transcript[-1] = {"text": FINAL_STATEMENT, "userId": speakers[0][0], "userName": speakers[0][1], "role": "user",
+                      "timestamp": (started + timedelta(seconds=5 * length)).isoformat() + "Z"}
+
+    tasks = {}
+    for i in range(items):
+        task_id = f"task_{i:05d}"
+        tasks[task_id] = {"id": task_id, "title": f"{rng.choice(TOPICS)}の対応 {i}", "status": rng.choice(["todo", "doing", "done"]),
+                          "assignee": rng.choice(speakers)[1], "dueDate": (started + timedelta(days=i % 30)).date().isoformat(),
+                          "detail": synthesize_statement(rng)}
+    notes = {}
+    for i in range(items):
+        note_id = f"note_{i:05d}"
+        notes[note_id] = {"id": note_id, "type": rng.choice(["memo", "decision", "issue"]), "text": synthesize_statement(rng)}
+    diagram_nodes = [f"N{i}[{topic}]" for i, topic in enumerate(TOPICS)]
+    diagram_edges = [f"N{i} --> N{(i * 3 + 1) % len(TOPICS)}" for i in range(len(TOPICS))]
+    room = {
+        "sessionId": "", "sessionTitle": f"Scaling benchmark ({length} entries)", "startTime": started.isoformat() + "Z",
+        "participants": {user_id: {"name": user_name, "role": "参加者", "joinedAt": started.isoformat() + "Z"}
+                         for user_id, user_name in speakers},
+        "tasks": tasks,
+        "notes": notes,
+        "currentAgenda": {"mainTopic": "API設計", "details": [f"{topic}の検討" for topic in TOPICS[:5]]},
+        "suggestedNextTopics": {str(i): topic for i, topic in enumerate(TOPICS[5:])},
+        "overviewDiagram": {"title": "概要図", "mermaidDefinition": "graph TD;\n" + "\n".join(diagram_nodes + diagram_edges)},
+    }
+    user_count = sum(1 for entry in transcript if entry["role"] != "ai")
+    meta = {"user_message_count": user_count, "last_llm_processed_message_count": max(0, user_count - 3),
+            "is_llm_processing": False}
+    return {"room": room, "transcript": transcript, "meta": meta}
+
+
+def items_for_length(length: int, args: argparse.Namespace) -> int:
+    return max(args.min_items, min(args.max_items, length // args.entries_per_item))
+
+
+def median_ms(samples: List[float]) -> float:
+    return round(statistics.median(samples) * 1000.0, 3) if samples else 0.0
+
+
+class PromptCapture:
+    """エージェントが LLM を呼んだ時点のプロンプトと時刻を記録し、フェイクモデルに委譲する。"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.model_name = getattr(inner, "model_name", "fake")
+        self.prompts: List[Any] = []
+        self.called_at: Optional[float] = None
+
+    async def generate_content_async(self, contents, **kwargs):
+        if self.called_at is None:
+            self.called_at = time.perf_counter()
+        self.prompts.append(contents)
+        text = contents if isinstance(contents, str) else getattr(contents, "text", str(contents))
+        return await self.inner.generate_content_async(text, **kwargs)
+
+
+class ScalingRun:
+    def __init__(self, args: argparse.Namespace, app_module):
+        self.args = args
+        self.main = app_module
+        from rtdb import db
+        from fake_llm import FakeGenerativeModel, fake_llm_stats
+        from prompt_templates import estimate_tokens
+        from response_cache import agent_response_cache
+        from transcript_index import select_history_positions
+        self.db = db
+        self.fake_model_class = FakeGenerativeModel
+        self.fake_llm_stats = fake_llm_stats
+        self.estimate_tokens = estimate_tokens
+        self.agent_response_cache = agent_response_cache
+        self.select_history_positions = select_history_positions
+
+    def seed(self, room_id: str, data: Dict[str, Any]):
+        main = self.main
+        self.db.reference(main.room_path(room_id)).set(data["room"])
+        self.db.reference(main.transcript_path(room_id)).set(data["transcript"])
+        self.db.reference(main.room_meta_path(room_id)).set(data["meta"])
+
+    def measure_serialization(self, data: Dict[str, Any]) -> Dict[str, float]:
+        main = self.main
+        session_samples, convert_samples, history_samples = [], [], []
+        for _ in range(self.args.repeats):
+            started = time.perf_counter()
+            json.dumps(data["room"], ensure_ascii=False, indent=2)
+            session_samples.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            messages = [main.convert_transcript_entry(entry) for entry in data["transcript"]]
+            convert_samples.append(time.perf_counter() - started)
+            # 絞り込み前の全履歴を文字列にした場合（履歴の選択が無効な場合のプロンプトに相当）
+            started = time.perf_counter()
+            "\n".join(f"{msg.role.capitalize()}: {msg.parts[0]['text']}" for msg in messages)
+            history_samples.append(time.perf_counter() - started)
+        return {"sessionJsonMs": median_ms(session_samples), "transcriptConvertMs": median_ms(convert_samples),
+                "fullHistoryJoinMs": median_ms(history_samples)}
+
+    async def measure_agent(self, room_id: str, agent_name: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """process_single_agent と同じ入力（履歴の選択・current_data）でエージェントのプロンプト組み立てを計測する。"""
+        main = self.main
+        agent = getattr(main, AGENT_ATTRIBUTES[agent_name])
+        instruction = AGENT_INSTRUCTIONS[agent_name]
+        messages = [main.convert_transcript_entry(entry) for entry in data["transcript"]]
+        texts = [msg.parts[0].get("text", "") for msg in messages]
+        room_snapshot = main.room_state_cache.get(room_id) or {}
+        build_samples, history_samples, prompt = [], [], None
+        for _ in range(self.args.repeats):
+            started = time.perf_counter()
+            positions = self.select_history_positions(room_id, texts, instruction)
+            history_str = "\n".join(f"{messages[i].role.capitalize()}: {texts[i]}" for i in positions)
+            history_samples.append(time.perf_counter() - started)
+            current_data = {
+                "participants": room_snapshot.get("participants"), "tasks": room_snapshot.get("tasks"),
+                "notes": room_snapshot.get("notes"), "agenda": room_snapshot.get("currentAgenda"),
+                "overviewDiagram": room_snapshot.get("overviewDiagram"),
+                "suggestedNextTopics": room_snapshot.get("suggestedNextTopics"), "full_room_data": room_snapshot,
+            }
+            capture = PromptCapture(self.fake_model_class(main.VERTEX_MODEL_NAME))
+            started = time.perf_counter()
+            await agent.execute(instruction=instruction, conversation_history=[messages[i] for i in positions],
+                                history_str=history_str, current_data=current_data, room_id=room_id,
+                                speaker_id="uid_0", speaker_name=SPEAKER_NAMES[0], llm_model=capture)
+            if capture.called_at is not None:
+                build_samples.append(capture.called_at - started)
+            if capture.prompts:
+                prompt = capture.prompts[0]
+        result = {"historySelectMs": median_ms(history_samples), "promptBuildMs": median_ms(build_samples),
+                  "historyEntries": len(positions)}
+        if prompt is None:
+            result["error"] = "agent did not call the LLM"
+            return result
+        prompt_text = prompt if isinstance(prompt, str) else prompt.text
+        result["promptTokens"] = self.estimate_tokens(prompt_text)
+        result["promptBytes"] = len(prompt_text.encode("utf-8"))
+        if hasattr(prompt, "section_token_counts"):
+            counts = prompt.section_token_counts()
+            result["sessionDataTokens"] = counts.get("session_data", 0)
+            result["historyTokens"] = counts.get("history", 0)
+        return result
+
+    async def run_orchestration(self, room_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        main = self.main
+        from fastapi import BackgroundTasks
+        self.agent_response_cache.clear()
+        last = data["transcript"][-1]
+        payload = main.TaskPayload(taskId=f"{room_id}-final", roomId=room_id, speakerId=last["userId"],
+                                   speakerName=last["userName"],
+                                   messages=[{"role": "user", "parts": [{"text": last["text"]}]}])
+        before = self.fake_llm_stats.stats()
+        started = time.perf_counter()
+        result = await main.orchestrate_agents(payload, BackgroundTasks(), data["transcript"])
+        elapsed = time.perf_counter() - started
+        after = self.fake_llm_stats.stats()
+        by_prompt_before = before["promptTokensByPrompt"]
+        return {
+            "elapsedMs": round(elapsed * 1000.0, 3),
+            "invokedAgents": result.invokedAgents,
+            "llmCalls": after["calls"] - before["calls"],
+            "promptTokens": after["promptTokens"] - before["promptTokens"],
+            "dispatchPromptTokens": after["promptTokensByPrompt"].get("Orchestrator", 0) - by_prompt_before.get("Orchestrator", 0),
+        }
+
+    async def measure_length(self, length: int) -> Dict[str, Any]:
+        args = self.args
+        items = items_for_length(length, args)
+        data = synthesize_room(length, items, args.participants, random.Random(f"{args.seed}:{length}"))
+        room_id = f"scaling_{length}"
+        self.seed(room_id, data)
+        point = {
+            "length": length, "items": items,
+            "rtdbBytes": {
+                "room": len(json.dumps(data["room"], ensure_ascii=False).encode("utf-8")),
+                "transcript": len(json.dumps(data["transcript"], ensure_ascii=False).encode("utf-8")),
+            },
+            "serialization": self.measure_serialization(data),
+            "agents": {},
+        }
+        for agent_name in AGENT_ATTRIBUTES:
+            point["agents"][agent_name] = await self.measure_agent(room_id, agent_name, data)
+
+        # 初回（履歴の変換・索引がない状態）と2回目（キャッシュ済み）のオーケストレーション
+        orchestration_room = f"scaling_{length}_orchestrate"
+        self.seed(orchestration_room, data)
+        cold = await self.run_orchestration(orchestration_room, data)
+        self.seed(orchestration_room, data)
+        warm = await self.run_orchestration(orchestration_room, data)
+        # メモリは別のルームで計測する（tracemalloc は処理時間に影響するため）
+        memory_room = f"scaling_{length}_memory"
+        self.seed(memory_room, data)
+        tracemalloc.start()
+        await self.run_orchestration(memory_room, data)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        point["orchestration"] = {"cold": cold, "warm": warm, "peakMemoryBytes": peak}
+        for room in (room_id, orchestration_room, memory_room):
+            self.main.room_state_cache.invalidate(room)
+        return point
+
+    async def measure_all(self, lengths: List[int]) -> List[Dict[str, Any]]:
+        points = []
+        for length in lengths:
+            started = time.perf_counter()
+            points.append(await self.measure_length(length))
+            print(f"Measured {length} entries in {time.perf_counter() - started:.1f} s")
+        return points
+
+
+def scaling_metrics(point: Dict[str, Any]) -> Dict[str, float]:
+    """超線形の判定に使う指標（会議の長さの点ごと）。"""
+    metrics = {
+        "rtdbBytes.room": point["rtdbBytes"]["room"],
+        "rtdbBytes.transcript": point["rtdbBytes"]["transcript"],
+        "serialization.sessionJsonMs": point["serialization"]["sessionJsonMs"],
+        "serialization.transcriptConvertMs": point["serialization"]["transcriptConvertMs"],
+        "orchestration.cold.elapsedMs": point["orchestration"]["cold"]["elapsedMs"],
+        "orchestration.warm.elapsedMs": point["orchestration"]["warm"]["elapsedMs"],
+        "orchestration.promptTokens": point["orchestration"]["cold"]["promptTokens"],
+        "orchestration.dispatchPromptTokens": point["orchestration"]["cold"]["dispatchPromptTokens"],
+        "orchestration.peakMemoryBytes": point["orchestration"]["peakMemoryBytes"],
+    }
+    for agent_name, agent in point["agents"].items():
+        for key in ("promptTokens", "sessionDataTokens", "historyTokens", "promptBuildMs", "historySelectMs"):
+            if key in agent:
+                metrics[f"agents.{agent_name}.{key}"] = agent[key]
+    return metrics
+
+
+def growth_exponent(lengths: List[int], values: List[float]) -> Optional[float]:
+    """log(value) = a + k·log(length) の最小二乗近似の k（値が0の点は除く）。"""
+    points = [(math.log(length), math.log(value)) for length, value in zip(lengths, values) if value > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    denominator = sum((x - mean_x) ** 2 for x, _ in points)
+    if denominator == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / denominator
+
+
+def summarize(points: List[Dict[str, Any]], threshold: float) -> Dict[str, Any]:
+    lengths = [point["length"] for point in points]
+    per_point = [scaling_metrics(point) for point in points]
+    growth = {}
+    superlinear = []
+    for key in per_point[0]:
+        values = [float(metrics.get(key, 0)) for metrics in per_point]
+        exponent = growth_exponent(lengths, values)
+        # 1 ms 未満の時間は計測の揺らぎが大きいため判定しない
+        measurable = not key.endswith("Ms") or max(values) >= MIN_TIMING_MS
+        growth[key] = {"exponent": round(exponent, 3) if exponent is not None else None,
+                       "first": values[0], "last": values[-1]}
+        if exponent is not None and measurable and exponent > threshold:
+            superlinear.append(key)
+    return {"lengths": lengths, "growth": growth, "superlinear": superlinear, "superlinearThreshold": threshold}
+
+
+def print_report(points: List[Dict[str, Any]], summary: Dict[str, Any]):
+    header = f"{'entries':>8} {'items':>6} {'room KB':>9} {'transcript KB':>14} {'json ms':>8} {'convert ms':>11} " \
+             f"{'dispatch tok':>13} {'orch tok':>9} {'cold ms':>9} {'warm ms':>9} {'peak MB':>8}"
+    print(header)
+    for point in points:
+        orchestration = point["orchestration"]
+        print(f"{point['length']:>8} {point['items']:>6} {point['rtdbBytes']['room'] / 1024:>9.1f} "
+              f"{point['rtdbBytes']['transcript'] / 1024:>14.1f} {point['serialization']['sessionJsonMs']:>8.2f} "
+              f"{point['serialization']['transcriptConvertMs']:>11.2f} {orchestration['cold']['dispatchPromptTokens']:>13} "
+              f"{orchestration['cold']['promptTokens']:>9} {orchestration['cold']['elapsedMs']:>9.1f} "
+              f"{orchestration['warm']['elapsedMs']:>9.1f} {orchestration['peakMemoryBytes'] / 1024 / 1024:>8.1f}")
+    print()
+    print(f"{'agent':<28} " + " ".join(f"{point['length']:>10}" for point in points) + "  (prompt tokens / build ms)")
+    for agent_name in AGENT_ATTRIBUTES:
+        cells = []
+        for point in points:
+            agent = point["agents"][agent_name]
+            cells.append(f"{agent.get('promptTokens', '-'):>5}/{agent['promptBuildMs']:<4.1f}")
+        print(f"{agent_name:<28} " + " ".join(f"{cell:>10}" for cell in cells))
+    print()
+    if summary["superlinear"]:
+        print(f"Superlinear growth (exponent > {summary['superlinearThreshold']}):")
+        for key in summary["superlinear"]:
+            print(f"  {key}: exponent {summary['growth'][key]['exponent']}")
+    else:
+        print(f"No metric grows faster than length^{summary['superlinearThreshold']}.")
+
+
+def write_plot(points: List[Dict[str, Any]], summary: Dict[str, Any], path: str):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed; skipping --plot.")
+        return
+    lengths = summary["lengths"]
+    per_point = [scaling_metrics(point) for point in points]
+    panels = [
+        ("Prompt tokens", [key for key in per_point[0] if key.endswith("promptTokens") or key.endswith("PromptTokens")]),
+        ("Time (ms)", [key for key in per_point[0] if key.endswith("Ms")]),
+        ("Bytes", [key for key in per_point[0] if "Bytes" in key]),
+    ]
+    fig, axes = plt.subplots(1, len(panels), figsize=(6 * len(panels), 5))
+    for axis, (title, keys) in zip(axes, panels):
+        for key in keys:
+            values = [metrics.get(key, 0) for metrics in per_point]
+            style = "--" if key in summary["superlinear"] else "-"
+            axis.plot(lengths, values, style, marker="o", label=f"{key} (k={summary['growth'][key]['exponent']})")
+        axis.set_xscale("log")
+        axis.set_yscale("log")
+        axis.set_xlabel("transcript entries")
+        axis.set_title(title)
+        axis.legend(fontsize=6)
+    fig.tight_layout()
+    fig.savefig(path)
+    print(f"Plot written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt size, serialization time and memory vs. meeting length.")
+    parser.add_argument("--lengths", default="100,300,1000,3000,10000", help="comma-separated transcript lengths")
+    parser.add_argument("--entries-per-item", type=int, default=20,
+                        help="transcript entries per task/note (tasks and notes grow with the meeting)")
+    parser.add_argument("--min-items", type=int, default=5)
+    parser.add_argument("--max-items", type=int, default=500, help="cap on the number of tasks and of notes")
+    parser.add_argument("--participants", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3, help="repeats for the timing measurements (median)")
+    parser.add_argument("--superlinear-threshold", type=float, default=1.15,
+                        help="flag metrics whose log-log growth exponent exceeds this")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra server setting, e.g. --env HISTORY_RETRIEVAL_TOP_K=40 (repeatable)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="ERROR")
+    parser.add_argument("--plot", help="write a log-log PNG plot (requires matplotlib)")
+    parser.add_argument("--output", help="result JSON path (default: benchmarks/results/long_meeting_scaling-<commit>-<time>.json)")
+    parser.add_argument("--baseline", help="previous result JSON to compare against")
+    args = parser.parse_args()
+    lengths = sorted({int(value) for value in args.lengths.split(",") if value.strip()})
+
+    env_overrides = parse_env_overrides(args.env)
+    configure_offline_backends("instant", 0.0, env_overrides)
+    app_module = import_app(args.log_level)
+
+    points = asyncio.run(ScalingRun(args, app_module).measure_all(lengths))
+    for cache in (app_module.room_state_cache, app_module.transcript_cache, app_module.room_meta_cache):
+        cache.close_all()
+
+    summary = summarize(points, args.superlinear_threshold)
+    parameters = {key: value for key, value in vars(args).items()
+                  if key not in ("output", "baseline", "log_level", "plot")}
+    parameters["lengths"] = lengths
+    parameters["env"] = env_overrides
+    output_path = write_results("long_meeting_scaling", parameters, summary, details=points, output_path=args.output)
+
+    print()
+    print_report(points, summary)
+    if args.plot:
+        write_plot(points, summary, args.plot)
+    print(f"Results written to {output_path}")
+    if args.baseline:
+        print("\n".join(compare_with_baseline(summary, args.baseline)))
+
+
+if __name__ == "__main__":
+    main()
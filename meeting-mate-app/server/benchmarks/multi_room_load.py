@@ -0,0 +1,176 @@
+"""
+複数ルームの同時会議を模した負荷試験。
+
+FastAPIアプリをプロセス内で起動し（インメモリRTDB・フェイクLLM）、
+N ルーム × M 人の発言者がそれぞれ指数分布の間隔で /invoke（一部は /invoke_batch）に発言を送る。
+エンドポイントごとのレイテンシ（p50/p95/p99）、スループット、発言あたりのLLM呼び出し回数と
+RTDBの読み書きバイト数を集計し、JSONで保存する。
+
+使い方（meeting-mate-app/server で実行）:
+    python -m benchmarks.multi_room_load --rooms 20 --speakers 4 --messages-per-room 40
+    python -m benchmarks.multi_room_load --time-scale 20 --baseline benchmarks/results/<前回の結果>.json
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from benchmarks.common import (SPEAKER_NAMES, configure_offline_backends, import_app, latency_summary,
+                               parse_env_overrides, synthesize_statement, write_results, compare_with_baseline)
+
+
+class LoadRun:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.records: List[Dict[str, Any]] = []
+        self.messages_sent = 0
+
+    async def _post(self, client, endpoint: str, body: Dict[str, Any], message_count: int):
+        started = time.perf_counter()
+        ok = False
+        invoked_agents = 0
+        try:
+            response = await client.post(endpoint, json=body)
+            payload = response.json()
+            ok = response.status_code == 200 and not payload.get("error")
+            invoked_agents = len((payload.get("result") or {}).get("invokedAgents") or [])
+        except Exception as e:
+            print(f"Request to {endpoint} failed: {e}")
+        self.records.append({"endpoint": endpoint, "latencyMs": (time.perf_counter() - started) * 1000.0,
+                             "ok": ok, "invokedAgents": invoked_agents, "messages": message_count})
+        self.messages_sent += message_count
+
+    async def _speaker(self, client, room_id: str, speaker_index: int, message_count: int, rng: random.Random):
+        args = self.args
+        speaker_id = f"uid_{room_id}_{speaker_index}"
+        speaker_name = SPEAKER_NAMES[speaker_index % len(SPEAKER_NAMES)]
+        # ルーム全体で平均 mean_interval 秒に1発言になるよう、発言者ごとの間隔は M 倍にする
+        speaker_interval = args.mean_interval * args.speakers / args.time_scale
+        sent = 0
+        while sent < message_count:
+            await asyncio.sleep(rng.expovariate(1.0 / speaker_interval) if speaker_interval > 0 else 0)
+            task_id = f"{room_id}-{speaker_index}-{sent}"
+            if rng.random() < args.batch_ratio:
+                burst = min(rng.randint(2, 4), message_count - sent)
+                body = {"taskId": task_id, "roomId": room_id, "messages": [
+                    {"text": synthesize_statement(rng), "userId": speaker_id, "userName": speaker_name,
+                     "timestamp": datetime.utcnow().isoformat() + "Z", "role": "user"} for _ in range(burst)]}
+                await self._post(client, "/invoke_batch", body, burst)
+                sent += burst
+            else:
+                body = {"jsonrpc": "2.0", "method": "ExecuteTask", "id": task_id, "params": {"task": {
+                    "taskId": task_id, "roomId": room_id, "speakerId": speaker_id, "speakerName": speaker_name,
+                    "messages": [{"role": "user", "parts": [{"text": synthesize_statement(rng)}]}]}}}
+                await self._post(client, "/invoke", body, 1)
+                sent += 1
+
+    async def run(self, app) -> float:
+        import httpx
+        args = self.args
+        tasks = []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                     timeout=None) as client:
+            for room_index in range(args.rooms):
+                room_id = f"bench_room_{room_index}"
+                per_speaker = [args.messages_per_room // args.speakers +
+                               (1 if i < args.messages_per_room % args.speakers else 0) for i in range(args.speakers)]
+                for speaker_index, message_count in enumerate(per_speaker):
+                    rng = random.Random(f"{args.seed}:{room_id}:{speaker_index}")
+                    tasks.append(self._speaker(client, room_id, speaker_index, message_count, rng))
+            started = time.perf_counter()
+            await asyncio.gather(*tasks)
+            return time.perf_counter() - started
+
+
+def summarize(run: LoadRun, wall_seconds: float, llm_stats: Dict[str, Any], rtdb_before: Dict[str, Any],
+              rtdb_after: Dict[str, Any]) -> Dict[str, Any]:
+    messages = max(run.messages_sent, 1)
+    endpoints = {}
+    for endpoint in sorted({record["endpoint"] for record in run.records}):
+        records = [record for record in run.records if record["endpoint"] == endpoint]
+        endpoints[endpoint] = {
+            "requests": len(records),
+            "errors": sum(1 for record in records if not record["ok"]),
+            "triggered": sum(1 for record in records if record["invokedAgents"]),
+            "latencyMs": latency_summary([record["latencyMs"] for record in records]),
+            "triggeredLatencyMs": latency_summary([record["latencyMs"] for record in records if record["invokedAgents"]]),
+        }
+    bytes_read = rtdb_after["bytesRead"] - rtdb_before["bytesRead"]
+    bytes_written = rtdb_after["bytesWritten"] - rtdb_before["bytesWritten"]
+    operations = sum(rtdb_after["operations"].values()) - sum(rtdb_before["operations"].values())
+    return {
+        "messages": run.messages_sent,
+        "requests": len(run.records),
+        "wallSeconds": round(wall_seconds, 3),
+        "throughputMessagesPerSecond": round(run.messages_sent / wall_seconds, 2) if wall_seconds else 0.0,
+        "throughputRequestsPerSecond": round(len(run.records) / wall_seconds, 2) if wall_seconds else 0.0,
+        "endpoints": endpoints,
+        "llmCallsPerMessage": round(llm_stats["calls"] / messages, 3),
+        "llmCallsByPrompt": llm_stats["callsByPrompt"],
+        "promptTokensPerMessage": round(llm_stats["promptTokens"] / messages, 1),
+        "outputTokensPerMessage": round(llm_stats["outputTokens"] / messages, 1),
+        "rtdbBytesPerMessage": {
+            "read": round(bytes_read / messages, 1),
+            "written": round(bytes_written / messages, 1),
+            "total": round((bytes_read + bytes_written) / messages, 1),
+        },
+        "rtdbOperationsPerMessage": round(operations / messages, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-room /invoke load benchmark against in-memory RTDB and fake LLM backends.")
+    parser.add_argument("--rooms", type=int, default=10, help="number of concurrent rooms (N)")
+    parser.add_argument("--speakers", type=int, default=4, help="speakers per room (M)")
+    parser.add_argument("--messages-per-room", type=int, default=30)
+    parser.add_argument("--mean-interval", type=float, default=5.0,
+                        help="mean seconds between utterances in one room (real-time cadence)")
+    parser.add_argument("--time-scale", type=float, default=10.0,
+                        help="speed-up factor applied to the cadence (1 = real time)")
+    parser.add_argument("--batch-ratio", type=float, default=0.1,
+                        help="fraction of posts sent to /invoke_batch as 2-4 message bursts")
+    parser.add_argument("--llm-profile", default="flash", help="fake LLM latency profile (instant/flash/pro)")
+    parser.add_argument("--rtdb-latency-ms", type=float, default=5.0, help="in-memory RTDB latency per operation")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra server setting, e.g. --env LLM_TRIGGER_MESSAGE_COUNT=5 (repeatable)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="result JSON path (default: benchmarks/results/multi_room_load-<commit>-<time>.json)")
+    parser.add_argument("--baseline", help="previous result JSON to compare against")
+    args = parser.parse_args()
+
+    env_overrides = parse_env_overrides(args.env)
+    configure_offline_backends(args.llm_profile, args.rtdb_latency_ms, env_overrides)
+    app_module = import_app(args.log_level)
+    from fake_llm import fake_llm_stats
+    from rtdb import db
+
+    fake_llm_stats.reset()
+    rtdb_before = db.stats()
+    run = LoadRun(args)
+    wall_seconds = asyncio.run(run.run(app_module.app))
+    summary = summarize(run, wall_seconds, fake_llm_stats.stats(), rtdb_before, db.stats())
+    for cache in (app_module.room_state_cache, app_module.transcript_cache, app_module.room_meta_cache):
+        cache.close_all()
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "log_level")}
+    parameters["env"] = env_overrides
+    output_path = write_results("multi_room_load", parameters, summary, output_path=args.output)
+
+    print(f"{summary['messages']} messages from {args.rooms} rooms x {args.speakers} speakers in {summary['wallSeconds']} s "
+          f"({summary['throughputMessagesPerSecond']} msg/s)")
+    for endpoint, stats in summary["endpoints"].items():
+        latency = stats["latencyMs"]
+        print(f"  {endpoint}: {stats['requests']} requests, {stats['errors']} errors, {stats['triggered']} triggered, "
+              f"p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms")
+    print(f"  LLM calls/message: {summary['llmCallsPerMessage']}, "
+          f"RTDB bytes/message: {summary['rtdbBytesPerMessage']['total']}")
+    print(f"Results written to {output_path}")
+    if args.baseline:
+        print("\n".join(compare_with_baseline(summary, args.baseline)))
+
+
+if __name__ == "__main__":
+    main()
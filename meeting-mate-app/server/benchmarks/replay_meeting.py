@@ -0,0 +1,431 @@
+"""
+記録済みの会議を /invoke に再生するハーネス。
+
+エクスポートしたルーム（発言者とタイムスタンプ付きのトランスクリプト）のユーザー発言を、
+実時間・早送り・待ち時間なし（1件ずつ応答を待つ）のいずれかで /invoke に送り直す。
+同じ会議に対してトリガーポリシー・モデルの選択・プロンプトの変更を比較するためのもので、
+オーケストレーションごとにディスパッチの判断・エージェントの処理時間・トークン数・処理後のルーム状態を記録する。
+
+バックエンド:
+- fake（既定）: アプリをプロセス内で起動し、インメモリRTDBとフェイクLLMを使う
+- real: アプリをプロセス内で起動し、.env / 環境変数の設定どおり Firebase と Vertex AI を使う
+- --url を指定した場合: 起動中のサーバーに HTTP で送る（記録できるのは /invoke の応答の内容のみ）
+
+入力には Firebase コンソールでエクスポートしたJSON（DB全体なら --source-room でルームを選ぶ）、
+旧レイアウトのルーム（rooms/{id} に transcript を含む）、またはトランスクリプトだけのJSONを使える。
+
+使い方（meeting-mate-app/server で実行）:
+    python -m benchmarks.replay_meeting export.json --source-room team_weekly --mode accelerated --speedup 20
+    python -m benchmarks.replay_meeting export.json --source-room team_weekly --mode asap --env LLM_TRIGGER_MESSAGE_COUNT=5
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.common import (configure_offline_backends, use_server_modules, import_app, latency_summary,
+                               parse_env_overrides, write_results, compare_with_baseline)
+
+DEMO_ROOM_ID = "demo_zenn"
+
+# 実行中のオーケストレーションの記録（エージェントのタスクにもコンテキストごと引き継がれる）
+_current_orchestration: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "replay_current_orchestration", default=None)
+
+
+def _parse_timestamp(value: Any) -> Optional[float]:
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def load_recorded_room(path: str, source_room: Optional[str]) -> Tuple[Any, Dict[str, Any], str]:
+    """エクスポートしたJSONから (トランスクリプトの値, トランスクリプト以外のルーム状態, 元のルームID) を取り出す。"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    fallback_id = os.path.splitext(os.path.basename(path))[0]
+    if isinstance(data, list):
+        return data, {}, source_room or fallback_id
+    if not isinstance(data, dict):
+        raise ValueError(f"Unsupported export format in {path}.")
+    if "rooms" in data or "transcripts" in data:
+        rooms = data.get("rooms") or {}
+        transcripts = data.get("transcripts") or {}
+        candidates = sorted(set(rooms) | set(transcripts))
+        if source_room is None:
+            if len(candidates) != 1:
+                raise ValueError(f"The export contains {len(candidates)} rooms. Choose one with --source-room: {', '.join(candidates)}")
+            source_room = candidates[0]
+        if source_room not in candidates:
+            raise ValueError(f"Room '{source_room}' is not in the export.")
+        room = dict(rooms.get(source_room) or {})
+        transcript = transcripts.get(source_room, room.get("transcript"))
+    elif "transcript" in data:
+        room = dict(data)
+        transcript = room.get("transcript")
+    else:
+        room, transcript = {}, data
+    room.pop("transcript", None)
+    return transcript, room, source_room or fallback_id
+
+
+def build_schedule(entries: List[Dict[str, Any]], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """ユーザー発言を時系列に並べ、会議開始からの送信時刻（秒、早送り前）を付ける。AIの発言は再生成されるため送らない。"""
+    utterances = [entry for entry in entries
+                  if isinstance(entry, dict) and entry.get("role") != "ai" and entry.get("text")]
+    utterances = utterances[args.start:]
+    if args.limit:
+        utterances = utterances[:args.limit]
+    schedule = []
+    offset = 0.0
+    previous_timestamp = None
+    for index, entry in enumerate(utterances):
+        timestamp = _parse_timestamp(entry.get("timestamp"))
+        if index > 0:
+            gap = args.default_gap if timestamp is None or previous_timestamp is None else max(0.0, timestamp - previous_timestamp)
+            if args.max_gap is not None:
+                gap = min(gap, args.max_gap)
+            offset += gap
+        if timestamp is not None:
+            previous_timestamp = timestamp
+        schedule.append({"index": index, "offset": offset, "text": entry["text"],
+                         "speakerId": entry.get("userId") or f"replay_speaker_{entry.get('userName') or 'unknown'}",
+                         "speakerName": entry.get("userName") or entry.get("userId") or "Unknown Speaker"})
+    return schedule
+
+
+def summarize_state(room: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    room = room or {}
+
+    def _count(key):
+        value = room.get(key)
+        return len(value) if isinstance(value, (dict, list)) else 0
+
+    agenda = room.get("currentAgenda") or {}
+    diagram = room.get("overviewDiagram") or {}
+    return {
+        "participants": _count("participants"),
+        "tasks": _count("tasks"),
+        "notes": _count("notes"),
+        "mainTopic": agenda.get("mainTopic") if isinstance(agenda, dict) else None,
+        "suggestedNextTopics": _count("suggestedNextTopics"),
+        "diagramLength": len(diagram.get("mermaidDefinition") or "") if isinstance(diagram, dict) else 0,
+    }
+
+
+def _response_text(response) -> str:
+    try:
+        text = getattr(response, "text", "")
+    except Exception:
+        text = ""
+    if not text and getattr(response, "candidates", None):
+        try:
+            text = response.candidates[0].content.parts[0].text
+        except (AttributeError, IndexError):
+            text = ""
+    return text or ""
+
+
+def _parse_dispatch(text: str) -> Any:
+    cleaned = text.strip()
+    if cleaned.startswith("```json"):
+        cleaned = cleaned[7:-3].strip()
+    elif cleaned.startswith("```"):
+        cleaned = cleaned[3:-3].strip()
+    try:
+        return json.loads(cleaned) if cleaned else []
+    except json.JSONDecodeError:
+        return {"unparsed": text}
+
+
+class ReplayRecorder:
+    """プロセス内のアプリのオーケストレーション・エージェント・LLM呼び出しを包み、オーケストレーションごとに記録する。"""
+
+    def __init__(self, app_module, replay: "MeetingReplay"):
+        self.main = app_module
+        self.replay = replay
+        self.orchestrations: List[Dict[str, Any]] = []
+
+    def install(self):
+        from llm_client import LLMClient
+        from prompt_templates import RenderedPrompt, estimate_tokens
+        main = self.main
+        recorder = self
+        original_orchestrate = main.orchestrate_agents
+        original_process = main.process_single_agent
+        original_generate = LLMClient.generate_content_async
+
+        async def orchestrate_agents(task_payload, *args, **kwargs):
+            record = {"taskId": task_payload.taskId, "startedAt": round(time.perf_counter() - recorder.replay.clock_start, 3),
+                      "speakerName": task_payload.speakerName, "dispatch": None, "agents": {}, "llmCalls": []}
+            recorder.orchestrations.append(record)
+            token = _current_orchestration.set(record)
+            started = time.perf_counter()
+            try:
+                result = await original_orchestrate(task_payload, *args, **kwargs)
+                record["invokedAgents"] = result.invokedAgents
+                return result
+            except Exception as e:
+                record["error"] = str(e)
+                raise
+            finally:
+                record["elapsedMs"] = round((time.perf_counter() - started) * 1000.0, 2)
+                record["state"] = summarize_state(main.room_state_cache.get(task_payload.roomId))
+                _current_orchestration.reset(token)
+
+        async def process_single_agent(agent, task_payload, agent_name, instruction_text, results_dict, *args, **kwargs):
+            started = time.perf_counter()
+            await original_process(agent, task_payload, agent_name, instruction_text, results_dict, *args, **kwargs)
+            record = _current_orchestration.get()
+            if record is not None:
+                result = results_dict.get(agent_name) or {}
+                record["agents"][agent_name] = {
+                    "instruction": instruction_text,
+                    "latencyMs": round((time.perf_counter() - started) * 1000.0, 2),
+                    "message": result.get("message"),
+                    "error": result.get("error"),
+                    "unchangedSections": result.get("unchangedSections", []),
+                }
+
+        async def generate_content_async(client, prompt, **kwargs):
+            started = time.perf_counter()
+            response = await original_generate(client, prompt, **kwargs)
+            record = _current_orchestration.get()
+            if record is not None and not kwargs.get("stream"):
+                prompt_name = prompt.name if isinstance(prompt, RenderedPrompt) else "text"
+                prompt_text = prompt.text if isinstance(prompt, RenderedPrompt) else str(prompt)
+                response_text = _response_text(response)
+                usage = getattr(response, "usage_metadata", None)
+                record["llmCalls"].append({
+                    "prompt": prompt_name,
+                    "model": client.model_name,
+                    "latencyMs": round((time.perf_counter() - started) * 1000.0, 2),
+                    "estimatedPromptTokens": estimate_tokens(prompt_text),
+                    "promptTokens": getattr(usage, "prompt_token_count", None),
+                    "cachedTokens": getattr(usage, "cached_content_token_count", None),
+                    "outputTokens": getattr(usage, "candidates_token_count", None),
+                })
+                if prompt_name == "Orchestrator":
+                    record["dispatch"] = _parse_dispatch(response_text)
+            return response
+
+        main.orchestrate_agents = orchestrate_agents
+        main.process_single_agent = process_single_agent
+        LLMClient.generate_content_async = generate_content_async
+
+
+class MeetingReplay:
+    def __init__(self, args: argparse.Namespace, schedule: List[Dict[str, Any]], room_id: str):
+        self.args = args
+        self.schedule = schedule
+        self.room_id = room_id
+        self.requests: List[Dict[str, Any]] = []
+        self.clock_start = time.perf_counter()
+
+    def _body(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        task_id = f"replay-{self.room_id}-{item['index']}"
+        return {"jsonrpc": "2.0", "method": "ExecuteTask", "id": task_id, "params": {"task": {
+            "taskId": task_id, "roomId": self.room_id, "speakerId": item["speakerId"],
+            "speakerName": item["speakerName"], "messages": [{"role": "user", "parts": [{"text": item["text"]}]}]}}}
+
+    async def _send(self, client, item: Dict[str, Any], scheduled_at: float):
+        sent_at = time.perf_counter() - self.clock_start
+        record = {"index": item["index"], "speakerName": item["speakerName"], "scheduledAt": round(scheduled_at, 3),
+                  "sentAt": round(sent_at, 3), "invokedAgents": [], "error": None}
+        try:
+            response = await client.post("/invoke", json=self._body(item))
+            payload = response.json()
+            record["status"] = response.status_code
+            record["error"] = payload.get("error")
+            result = payload.get("result") or {}
+            record["invokedAgents"] = result.get("invokedAgents") or []
+            if record["invokedAgents"]:
+                record["state"] = summarize_state({
+                    "tasks": result.get("updatedTasks"), "notes": result.get("updatedNotes"),
+                    "participants": result.get("updatedParticipants"), "currentAgenda": result.get("updatedAgenda"),
+                    "overviewDiagram": result.get("updatedOverviewDiagram")})
+        except Exception as e:
+            record["error"] = str(e)
+        record["latencyMs"] = round((time.perf_counter() - self.clock_start - sent_at) * 1000.0, 2)
+        self.requests.append(record)
+
+    async def run(self, client) -> float:
+        args = self.args
+        self.clock_start = time.perf_counter()
+        if args.mode == "asap":
+            for item in self.schedule:
+                await self._send(client, item, time.perf_counter() - self.clock_start)
+        else:
+            speedup = 1.0 if args.mode == "realtime" else args.speedup
+            pending = []
+            for item in self.schedule:
+                scheduled_at = item["offset"] / speedup
+                delay = scheduled_at - (time.perf_counter() - self.clock_start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                pending.append(asyncio.create_task(self._send(client, item, scheduled_at)))
+            await asyncio.gather(*pending)
+        return time.perf_counter() - self.clock_start
+
+
+def summarize(replay: MeetingReplay, orchestrations: List[Dict[str, Any]], wall_seconds: float,
+              final_state: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    requests = replay.requests
+    summary = {
+        "messages": len(requests),
+        "errors": sum(1 for record in requests if record["error"]),
+        "wallSeconds": round(wall_seconds, 3),
+        "requestLatencyMs": latency_summary([record["latencyMs"] for record in requests]),
+        "triggeredRequests": sum(1 for record in requests if record["invokedAgents"]),
+    }
+    if final_state is not None:
+        summary["finalState"] = summarize_state(final_state)
+    if not orchestrations:
+        invoked = {}
+        for record in requests:
+            for agent_name in record["invokedAgents"]:
+                invoked[agent_name] = invoked.get(agent_name, 0) + 1
+        summary["invokedAgents"] = invoked
+        return summary
+
+    invoked, agent_latencies, calls_by_prompt = {}, {}, {}
+    estimated_tokens = prompt_tokens = output_tokens = llm_calls = 0
+    for record in orchestrations:
+        for agent_name, agent in record["agents"].items():
+            invoked[agent_name] = invoked.get(agent_name, 0) + 1
+            agent_latencies.setdefault(agent_name, []).append(agent["latencyMs"])
+        for call in record["llmCalls"]:
+            llm_calls += 1
+            calls_by_prompt[call["prompt"]] = calls_by_prompt.get(call["prompt"], 0) + 1
+            estimated_tokens += call["estimatedPromptTokens"]
+            prompt_tokens += call["promptTokens"] or 0
+            output_tokens += call["outputTokens"] or 0
+    summary.update({
+        "orchestrations": len(orchestrations),
+        "orchestrationErrors": sum(1 for record in orchestrations if record.get("error")),
+        "orchestrationLatencyMs": latency_summary([record["elapsedMs"] for record in orchestrations]),
+        "invokedAgents": invoked,
+        "agentLatencyMs": {agent_name: latency_summary(values) for agent_name, values in sorted(agent_latencies.items())},
+        "llmCalls": llm_calls,
+        "llmCallsByPrompt": calls_by_prompt,
+        "llmCallsPerMessage": round(llm_calls / max(len(requests), 1), 3),
+        "estimatedPromptTokens": estimated_tokens,
+        "promptTokens": prompt_tokens,
+        "outputTokens": output_tokens,
+    })
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded meeting through /invoke.")
+    parser.add_argument("export", help="exported RTDB JSON (whole database, a room, or a transcript)")
+    parser.add_argument("--source-room", help="room to replay when the export contains several rooms")
+    parser.add_argument("--room-id", help="room id to replay into (default: replay_<source>_<time>)")
+    parser.add_argument("--initial-state", action="store_true",
+                        help="start from the exported room state (participants, tasks, ...) instead of an empty room")
+    parser.add_argument("--mode", choices=["realtime", "accelerated", "asap"], default="accelerated",
+                        help="asap sends the next utterance after the previous response")
+    parser.add_argument("--speedup", type=float, default=10.0, help="speed-up factor for --mode accelerated")
+    parser.add_argument("--max-gap", type=float, help="cap silences between utterances (seconds, before speed-up)")
+    parser.add_argument("--default-gap", type=float, default=5.0, help="gap used when timestamps are missing")
+    parser.add_argument("--start", type=int, default=0, help="skip the first N user utterances")
+    parser.add_argument("--limit", type=int, help="replay at most N user utterances")
+    parser.add_argument("--backend", choices=["fake", "real"], default="fake",
+                        help="fake: in-memory RTDB and fake LLM; real: the server's configured Firebase and Vertex AI")
+    parser.add_argument("--url", help="replay against a running server instead of the in-process app")
+    parser.add_argument("--llm-profile", default="flash", help="fake LLM latency profile (instant/flash/pro)")
+    parser.add_argument("--rtdb-latency-ms", type=float, default=5.0, help="in-memory RTDB latency per operation")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="server setting for the in-process app, e.g. --env LLM_TRIGGER_MESSAGE_COUNT=5 (repeatable)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="result JSON path (default: benchmarks/results/replay_meeting-<commit>-<time>.json)")
+    parser.add_argument("--baseline", help="previous replay result JSON to compare against")
+    args = parser.parse_args()
+
+    env_overrides = parse_env_overrides(args.env)
+    if args.url:
+        use_server_modules()
+        if env_overrides:
+            print("--env is ignored with --url; configure the running server instead.")
+    elif args.backend == "fake":
+        configure_offline_backends(args.llm_profile, args.rtdb_latency_ms, env_overrides)
+    else:
+        use_server_modules(env_overrides)
+
+    transcript, initial_room, source_room = load_recorded_room(args.export, args.source_room)
+    room_id = args.room_id or f"replay_{source_room}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    if room_id == DEMO_ROOM_ID:
+        parser.error(f"'{DEMO_ROOM_ID}' skips AI processing and cannot be used as the replay room.")
+
+    app_module = None
+    recorder = None
+    if not args.url:
+        app_module = import_app(args.log_level)
+        from file_utils import transcript_as_list
+        entries = transcript_as_list(transcript)
+        if args.initial_state and initial_room:
+            app_module.db.reference(app_module.room_path(room_id)).set(initial_room)
+    else:
+        entries = [entry for entry in (transcript.values() if isinstance(transcript, dict) else transcript or [])
+                   if entry is not None]
+    schedule = build_schedule(entries, args)
+    if not schedule:
+        parser.error("No user utterances to replay.")
+    duration = schedule[-1]["offset"] / (1.0 if args.mode == "realtime" else args.speedup)
+    print(f"Replaying {len(schedule)} utterances from '{source_room}' into '{room_id}' "
+          f"({args.mode}{'' if args.mode == 'asap' else f', about {duration:.0f} s'}).")
+
+    replay = MeetingReplay(args, schedule, room_id)
+
+    async def _run():
+        import httpx
+        if args.url:
+            async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+                return await replay.run(client)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://replay",
+                                     timeout=None) as client:
+            return await replay.run(client)
+
+    if app_module is not None:
+        recorder = ReplayRecorder(app_module, replay)
+        recorder.install()
+    wall_seconds = asyncio.run(_run())
+
+    final_state = None
+    if app_module is not None:
+        final_state = app_module.room_state_cache.get(room_id)
+        for cache in (app_module.room_state_cache, app_module.transcript_cache, app_module.room_meta_cache):
+            cache.close_all()
+    orchestrations = recorder.orchestrations if recorder is not None else []
+    summary = summarize(replay, orchestrations, wall_seconds, final_state)
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "log_level")}
+    parameters.update({"env": env_overrides, "roomId": room_id, "sourceRoom": source_room})
+    details = {"requests": sorted(replay.requests, key=lambda record: record["index"]),
+               "orchestrations": orchestrations, "finalState": final_state}
+    output_path = write_results("replay_meeting", parameters, summary, details=details, output_path=args.output)
+
+    print(f"{summary['messages']} utterances in {summary['wallSeconds']} s, {summary['errors']} errors, "
+          f"{summary.get('orchestrations', summary['triggeredRequests'])} orchestrations")
+    for agent_name, count in sorted(summary["invokedAgents"].items()):
+        latency = summary.get("agentLatencyMs", {}).get(agent_name)
+        print(f"  {agent_name}: {count} invocations" + (f", p50 {latency['p50']} ms, p95 {latency['p95']} ms" if latency else ""))
+    if "llmCalls" in summary:
+        print(f"  LLM calls: {summary['llmCalls']} ({summary['llmCallsPerMessage']} per utterance), "
+              f"estimated prompt tokens: {summary['estimatedPromptTokens']}")
+    if "finalState" in summary:
+        print(f"  Final state: {summary['finalState']}")
+    print(f"Results written to {output_path}")
+    if args.baseline:
+        print("\n".join(compare_with_baseline(summary, args.baseline)))
+
+
+if __name__ == "__main__":
+    main()
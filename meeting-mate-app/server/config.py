@@ -1,12 +1,18 @@
 import logging
 import os
 from dotenv import load_dotenv
+from log_pipeline import configure_logging
 
 # Load environment variables
 load_dotenv()
 
-# Logging setup
-logging.basicConfig(level=logging.INFO)
+# Logging setup: records are queued on the request path and formatted/written by a background thread
+# LOG_FORMAT: "text" (default) or "json" (one object per line with severity and structured fields, for Cloud Logging)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+# Records beyond this many waiting in the queue are dropped instead of blocking
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, os.environ.get("PROJECT_ID"))
 logger = logging.getLogger("meeting_mate_server")
 
 # Vertex AI Configuration
@@ -41,13 +47,38 @@ except Exception as e:
         f"Vertex AI module import or initial check failed in config: {e}")
 
 
+# LLM backend: "vertex" (default) or "fake" (deterministic in-process model for offline benchmarks, see fake_llm.py)
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "vertex").lower()
+# Agents and the orchestrator can call a model (Vertex AI configured, or the fake backend)
+LLM_AVAILABLE = VERTEX_AI_AVAILABLE or LLM_BACKEND == "fake"
+# Fake model latency profile: "instant", "flash" (default) or "pro"; the values below override the profile
+FAKE_LLM_PROFILE = os.environ.get("FAKE_LLM_PROFILE", "flash").lower()
+FAKE_LLM_TTFT_MS = os.environ.get("FAKE_LLM_TTFT_MS")
+FAKE_LLM_PER_TOKEN_MS = os.environ.get("FAKE_LLM_PER_TOKEN_MS")
+FAKE_LLM_PREFILL_MS_PER_1K_TOKENS = os.environ.get(
+    "FAKE_LLM_PREFILL_MS_PER_1K_TOKENS")
+# Relative latency jitter (e.g. 0.2 = +/-20%), derived from FAKE_LLM_SEED and the prompt so runs are reproducible
+FAKE_LLM_JITTER = float(os.environ.get("FAKE_LLM_JITTER", 0))
+FAKE_LLM_SEED = int(os.environ.get("FAKE_LLM_SEED", 0))
+# Optional JSON file of scripted responses per prompt ("Orchestrator", "TaskManagementAgent", ...)
+FAKE_LLM_SCRIPT_PATH = os.environ.get("FAKE_LLM_SCRIPT_PATH")
+
 # Firebase Configuration
 FIREBASE_DATABASE_URL = os.environ.get("FIREBASE_DATABASE_URL")
 FIREBASE_CREDENTIALS_PATH = os.environ.get(
     # Keep this as it was in my version
     "FIREBASE_CREDENTIALS_PATH", "./sa-vertex-functions.json")
 
-if not FIREBASE_DATABASE_URL:
+# RTDB backend: "firebase" (default) or "memory" (in-process implementation for offline/CI runs and benchmarks)
+RTDB_BACKEND = os.environ.get("RTDB_BACKEND", "firebase").lower()
+# Simulated latency of each in-memory RTDB operation; overrides per operation as "get=5,transaction=40"
+RTDB_MEMORY_LATENCY_MS = float(os.environ.get("RTDB_MEMORY_LATENCY_MS", 0))
+RTDB_MEMORY_LATENCY_OVERRIDES = os.environ.get(
+    "RTDB_MEMORY_LATENCY_OVERRIDES", "")
+# Optional JSON export (e.g. containing rooms/template) loaded into the in-memory RTDB at startup
+RTDB_MEMORY_SEED_PATH = os.environ.get("RTDB_MEMORY_SEED_PATH")
+
+if not FIREBASE_DATABASE_URL and RTDB_BACKEND != "memory":
     logger.warning(
         "FIREBASE_DATABASE_URL environment variable is not set. Database operations will fail.")
 
@@ -90,6 +121,115 @@ if not os.path.exists(AGENT_CONFIG_DIR):
 MAX_ITERATIONS = int(os.environ.get("MAX_ITERATIONS", 5))
 MAX_RETRY_ATTEMPTS = int(os.environ.get("MAX_RETRY_ATTEMPTS", 3))
 
+# Number of targeted LLM repair prompts for Mermaid definitions that fail local validation
+MERMAID_MAX_REPAIR_ATTEMPTS = int(
+    os.environ.get("MERMAID_MAX_REPAIR_ATTEMPTS", 1))
+
+# Near-duplicate detection for notes/tasks (character n-gram MinHash + Jaccard)
+# NEAR_DUPLICATE_ACTION: "flag" (default, marks duplicateOf), "merge" or "off"; items whose numbers differ never match
+NEAR_DUPLICATE_THRESHOLD = float(
+    os.environ.get("NEAR_DUPLICATE_THRESHOLD", 0.85))
+NEAR_DUPLICATE_ACTION = os.environ.get("NEAR_DUPLICATE_ACTION", "flag")
+
+# Conversation history passed to the orchestrator/agents:
+# the most recent HISTORY_RECENT_WINDOW utterances plus the HISTORY_RETRIEVAL_TOP_K
+# older utterances most relevant (BM25) to the instruction
+HISTORY_RECENT_WINDOW = int(os.environ.get("HISTORY_RECENT_WINDOW", 20))
+HISTORY_RETRIEVAL_TOP_K = int(os.environ.get("HISTORY_RETRIEVAL_TOP_K", 10))
+
+# WebSocket transcript streaming: finalized utterances are appended in micro-batches,
+# flushed after TRANSCRIPT_STREAM_FLUSH_INTERVAL_MS or once TRANSCRIPT_STREAM_MAX_BATCH are ready
+TRANSCRIPT_STREAM_FLUSH_INTERVAL_MS = int(
+    os.environ.get("TRANSCRIPT_STREAM_FLUSH_INTERVAL_MS", 1500))
+TRANSCRIPT_STREAM_MAX_BATCH = int(
+    os.environ.get("TRANSCRIPT_STREAM_MAX_BATCH", 5))
+
+# In-process room state cache kept current by RTDB streaming listeners
+ROOM_CACHE_ENABLED = os.environ.get(
+    "ROOM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ROOM_CACHE_MAX_ROOMS = int(os.environ.get("ROOM_CACHE_MAX_ROOMS", 64))
+ROOM_CACHE_MAX_BYTES = int(os.environ.get(
+    "ROOM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Seconds a worker thread waits for a new listener's initial snapshot before falling back to a direct read
+# (reads on the event loop never wait; they read directly until the snapshot arrives)
+ROOM_CACHE_WARMUP_TIMEOUT = float(
+    os.environ.get("ROOM_CACHE_WARMUP_TIMEOUT", 5))
+
+# Provider-side context caching of each prompt's static prefix
+# LLM_CONTEXT_CACHE_BACKEND: "vertex" (default), "fake" (in-process, for offline testing; default with LLM_BACKEND=fake) or "off"
+LLM_CONTEXT_CACHE_BACKEND = os.environ.get(
+    "LLM_CONTEXT_CACHE_BACKEND", "fake" if LLM_BACKEND == "fake" else "vertex").lower()
+LLM_CONTEXT_CACHE_TTL_SECONDS = int(
+    os.environ.get("LLM_CONTEXT_CACHE_TTL_SECONDS", 3600))
+# Extend the TTL when a cache is used within this many seconds of expiring
+LLM_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS = int(
+    os.environ.get("LLM_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS", 300))
+# Prefixes estimated below this size are sent inline (providers reject small caches)
+LLM_CONTEXT_CACHE_MIN_TOKENS = int(
+    os.environ.get("LLM_CONTEXT_CACHE_MIN_TOKENS", 1024))
+
+# Memoized agent results keyed by (agent, model, normalized instruction, room state + history)
+AGENT_RESPONSE_CACHE_ENABLED = os.environ.get(
+    "AGENT_RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+AGENT_RESPONSE_CACHE_MAX_ENTRIES = int(
+    os.environ.get("AGENT_RESPONSE_CACHE_MAX_ENTRIES", 512))
+AGENT_RESPONSE_CACHE_TTL_SECONDS = float(
+    os.environ.get("AGENT_RESPONSE_CACHE_TTL_SECONDS", 600))
+
+# /invoke and /invoke_batch retries with the same taskId share the in-flight or completed response
+INVOKE_IDEMPOTENCY_TTL_SECONDS = float(
+    os.environ.get("INVOKE_IDEMPOTENCY_TTL_SECONDS", 300))
+INVOKE_IDEMPOTENCY_MAX_ENTRIES = int(
+    os.environ.get("INVOKE_IDEMPOTENCY_MAX_ENTRIES", 2048))
+
+# Prometheus metrics on /metrics (requires prometheus_client)
+METRICS_ENABLED = os.environ.get(
+    "METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Room id prefix -> room class label used instead of the room id ("prefix=class,..."); other rooms are "standard"
+METRICS_ROOM_CLASSES = os.environ.get(
+    "METRICS_ROOM_CLASSES", "demo_zenn=demo,template=template,bench_=benchmark,scaling_=benchmark,replay_=replay")
+# Fraction of RTDB operations whose payload is serialized to estimate bytes (scaled up by 1/rate; 0 = no byte counting)
+METRICS_RTDB_BYTES_SAMPLE_RATE = float(
+    os.environ.get("METRICS_RTDB_BYTES_SAMPLE_RATE", 0.01))
+
+# OpenTelemetry tracing of /invoke and /invoke_batch (requires opentelemetry-sdk)
+# TRACING_EXPORTER: "none" (default, tracing off), "otlp" (OTEL_EXPORTER_OTLP_ENDPOINT), "console" or "file"
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "none").lower()
+TRACING_SERVICE_NAME = os.environ.get("TRACING_SERVICE_NAME", "aimeebo-server")
+# JSON lines written by the "file" exporter
+TRACING_FILE_PATH = os.environ.get("TRACING_FILE_PATH", "traces.jsonl")
+# Fraction of new traces that are recorded (requests with a sampled traceparent are always recorded)
+TRACING_SAMPLE_RATIO = float(
+    os.environ.get("TRACING_SAMPLE_RATIO", 1.0))
+
+# Token usage per room/agent/model, accumulated in memory and added to room_usage/{room_id} in batches
+TOKEN_USAGE_FLUSH_INTERVAL_SECONDS = float(
+    os.environ.get("TOKEN_USAGE_FLUSH_INTERVAL_SECONDS", 60))
+# USD per 1M tokens as "model=input/output/cached,..." (longest model-name prefix wins; thinking tokens bill as output)
+LLM_TOKEN_PRICES = os.environ.get(
+    "LLM_TOKEN_PRICES", "gemini-2.5-flash-lite=0.10/0.40/0.025,gemini-2.5-flash=0.30/2.50/0.075,gemini-2.5-pro=1.25/10.00/0.31")
+
+# Per-room token budget (0 = unlimited); a room can override it in room_secrets/{room_id}/token_budget
+ROOM_TOKEN_BUDGET_PER_HOUR = int(
+    os.environ.get("ROOM_TOKEN_BUDGET_PER_HOUR", 0))
+ROOM_TOKEN_BUDGET_PER_MEETING = int(
+    os.environ.get("ROOM_TOKEN_BUDGET_PER_MEETING", 0))
+# Budget fractions at which degradation tiers start: drop the diagram agent, use the fallback model, trigger less often
+ROOM_BUDGET_TIER_THRESHOLDS = os.environ.get(
+    "ROOM_BUDGET_TIER_THRESHOLDS", "0.5,0.75,0.9")
+ROOM_BUDGET_FALLBACK_MODEL = os.environ.get(
+    "ROOM_BUDGET_FALLBACK_MODEL", "gemini-2.5-flash-lite")
+# In the last tier the trigger needs this many times LLM_TRIGGER_MESSAGE_COUNT new messages
+ROOM_BUDGET_TRIGGER_MULTIPLIER = int(
+    os.environ.get("ROOM_BUDGET_TRIGGER_MULTIPLIER", 3))
+
+# Fraction of orchestrations whose prompts and LLM responses are logged (every call still logs a one-line summary)
+LLM_LOG_SAMPLE_RATE = float(
+    os.environ.get("LLM_LOG_SAMPLE_RATE", 0.05))
+# Prompt/response text in those logs is cut to this many characters
+LLM_LOG_MAX_CHARS = int(
+    os.environ.get("LLM_LOG_MAX_CHARS", 2000))
+
 
 # This check replaces the stricter one that caused the ValueError
 if not all([PROJECT_ID, REGION, FIREBASE_DATABASE_URL]):
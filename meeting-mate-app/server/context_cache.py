@@ -0,0 +1,266 @@
+"""
+プロンプトの静的プレフィックスをプロバイダ側のコンテキストキャッシュに置いて再利用する。
+
+PromptTemplate の静的プレフィックスをシステム指示としたキャッシュを
+（認証情報, モデル, テンプレート）ごとに1つ作成し、以降の呼び出しでは動的サフィックスだけを送る。
+- TTLが残り少なくなったキャッシュは使用時に延長する
+- テンプレートの静的プレフィックスが変わった（version が変わった）場合は作り直す
+- 作成に失敗した場合は一定時間キャッシュなし（プロンプト全文の送信）にフォールバックする
+
+バックエンドは Vertex AI の CachedContent と、オフライン検証用のプロセス内実装（fake）がある。
+Vertex AI の CachedContent の作成・延長は vertexai.init で設定したプロセス全体の認証情報で行われ、
+呼び出しごとに認証情報を渡せない。そのため、2つ目の認証情報（ルームごとのAPIキー）が使われた時点で
+別のルームのキーでキャッシュを作成・延長しないよう、キャッシュを無効にする。
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from config import (logger, LLM_CONTEXT_CACHE_BACKEND, LLM_CONTEXT_CACHE_TTL_SECONDS,
+                    LLM_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS, LLM_CONTEXT_CACHE_MIN_TOKENS)
+from prompt_templates import PromptTemplate, SECTION_SEPARATOR
+
+# 作成に失敗したキャッシュを再作成するまでの秒数
+FAILURE_BACKOFF_SECONDS = 600
+
+
+class VertexContextCacheBackend:
+    """Vertex AI の CachedContent を使うバックエンド（呼び出しはブロッキングなので別スレッドで実行される）。"""
+
+    name = "vertex"
+    # 作成・延長はプロセス全体の vertexai.init の認証情報で行われる
+    per_call_credentials = False
+
+    def create(self, model_name: str, system_instruction: str, ttl_seconds: int, display_name: str) -> Tuple[Any, float]:
+        import datetime
+        from vertexai.preview import caching
+        cached_content = caching.CachedContent.create(
+            model_name=model_name,
+            system_instruction=system_instruction,
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+            display_name=display_name,
+        )
+        return cached_content, time.time() + ttl_seconds
+
+    def extend(self, handle: Any, ttl_seconds: int) -> float:
+        import datetime
+        handle.update(ttl=datetime.timedelta(seconds=ttl_seconds))
+        return time.time() + ttl_seconds
+
+    def delete(self, handle: Any):
+        handle.delete()
+
+    def bind(self, handle: Any, base_model: Any) -> Any:
+        from vertexai.preview.generative_models import GenerativeModel as PreviewGenerativeModel
+        return PreviewGenerativeModel.from_cached_content(cached_content=handle)
+
+
+class _FakeCachedModel:
+    """fake バックエンドのキャッシュに結び付いたモデル。送信時にシステム指示を前に付けて元のモデルを呼ぶ。"""
+
+    def __init__(self, backend: "FakeContextCacheBackend", handle: str, base_model: Any):
+        self._backend = backend
+        self._handle = handle
+        self._base_model = base_model
+
+    async def generate_content_async(self, contents, **kwargs):
+        entry = self._backend.entries.get(self._handle)
+        if entry is None or entry["expire_at"] <= time.time():
+            raise LookupError(f"Cached content {self._handle} not found or expired.")
+        self._backend.hits += 1
+        return await self._base_model.generate_content_async(
+            entry["system_instruction"] + SECTION_SEPARATOR + contents, **kwargs)
+
+
+class FakeContextCacheBackend:
+    """プロセス内でキャッシュを模倣するバックエンド。プロバイダを呼ばずに作成・延長・削除・利用を記録する。"""
+
+    name = "fake"
+    per_call_credentials = True
+
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.creates = 0
+        self.extends = 0
+        self.deletes = 0
+        self.hits = 0
+
+    def create(self, model_name: str, system_instruction: str, ttl_seconds: int, display_name: str) -> Tuple[Any, float]:
+        self.creates += 1
+        handle = f"cachedContents/fake-{self.creates}"
+        expire_at = time.time() + ttl_seconds
+        self.entries[handle] = {"model_name": model_name, "display_name": display_name,
+                                "system_instruction": system_instruction, "expire_at": expire_at}
+        return handle, expire_at
+
+    def extend(self, handle: Any, ttl_seconds: int) -> float:
+        if handle not in self.entries:
+            raise LookupError(f"Cached content {handle} not found.")
+        self.extends += 1
+        expire_at = time.time() + ttl_seconds
+        self.entries[handle]["expire_at"] = expire_at
+        return expire_at
+
+    def delete(self, handle: Any):
+        self.deletes += 1
+        self.entries.pop(handle, None)
+
+    def bind(self, handle: Any, base_model: Any) -> Any:
+        return _FakeCachedModel(self, handle, base_model)
+
+
+class _CacheEntry:
+    def __init__(self, handle: Any, version: str, expire_at: float):
+        self.handle = handle
+        self.version = version
+        self.expire_at = expire_at
+
+
+class ContextCacheManager:
+    """（スコープ, モデル, テンプレート名）ごとのキャッシュを作成・延長・破棄する。"""
+
+    def __init__(self, backend: Optional[Any], ttl_seconds: int = LLM_CONTEXT_CACHE_TTL_SECONDS,
+                 refresh_margin_seconds: int = LLM_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS,
+                 min_tokens: int = LLM_CONTEXT_CACHE_MIN_TOKENS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = min(refresh_margin_seconds, ttl_seconds // 2)
+        self.min_tokens = min_tokens
+        self._entries: Dict[Tuple[str, str, str], _CacheEntry] = {}
+        self._failed_until: Dict[Tuple[str, str, str, str], float] = {}
+        self._locks: Dict[Tuple[str, str, str], asyncio.Lock] = {}
+        self._created = 0
+        self._refreshed = 0
+        self._invalidated = 0
+        self._failures = 0
+        self._skipped_small = 0
+        # per_call_credentials でないバックエンドで使われた認証情報のスコープ（2つ目が来たら無効にする）
+        self._credential_scopes = set()
+        self._disabled_reason: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None and self._disabled_reason is None
+
+    def _check_credentials(self, scope: str) -> bool:
+        """プロセス全体の認証情報で動くバックエンドでは、認証情報が1つの間だけキャッシュを使う。"""
+        if getattr(self.backend, "per_call_credentials", True):
+            return True
+        self._credential_scopes.add(scope)
+        if len(self._credential_scopes) == 1:
+            return True
+        self._disabled_reason = "multiple API keys in use"
+        logger.warning(
+            f"Context caching disabled: the {self.backend.name} backend uses process-wide credentials and "
+            f"rooms with different API keys are in use.")
+        for key in list(self._entries):
+            self._drop(key)
+        return False
+
+    async def model_for(self, base_model: Any, model_name: str, scope: str, template: PromptTemplate) -> Optional[Any]:
+        """template の静的プレフィックスをキャッシュしたモデルを返す。キャッシュを使えない場合は None。"""
+        if not self.enabled or not model_name or not self._check_credentials(scope):
+            return None
+        if template.static_tokens < self.min_tokens:
+            self._skipped_small += 1
+            return None
+        key = (scope, model_name, template.name)
+        if self._failed_until.get(key + (template.version,), 0) > time.time():
+            return None
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = await self._ensure_entry(key, template)
+        if entry is None:
+            return None
+        return self.backend.bind(entry.handle, base_model)
+
+    async def _ensure_entry(self, key: Tuple[str, str, str], template: PromptTemplate) -> Optional[_CacheEntry]:
+        scope, model_name, template_name = key
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None and entry.version != template.version:
+            logger.info(
+                f"Prompt '{template_name}' changed ({entry.version} -> {template.version}). Recreating context cache.")
+            self._drop(key)
+            entry = None
+        if entry is not None and entry.expire_at - now <= self.refresh_margin_seconds:
+            try:
+                if entry.expire_at <= now:
+                    raise LookupError("expired")
+                entry.expire_at = await asyncio.to_thread(self.backend.extend, entry.handle, self.ttl_seconds)
+                self._refreshed += 1
+            except Exception as e:
+                logger.info(
+                    f"Context cache for '{template_name}' could not be extended ({e}). Recreating.")
+                self._drop(key)
+                entry = None
+        if entry is not None:
+            return entry
+        try:
+            handle, expire_at = await asyncio.to_thread(
+                self.backend.create, model_name, template.static_prefix, self.ttl_seconds,
+                f"aimeebo-{template_name}-{template.version}")
+        except Exception as e:
+            self._failures += 1
+            self._failed_until[key + (template.version,)] = now + FAILURE_BACKOFF_SECONDS
+            logger.warning(
+                f"Failed to create context cache for '{template_name}' on {model_name}: {e}. "
+                f"Sending full prompts for {FAILURE_BACKOFF_SECONDS}s.")
+            return None
+        self._created += 1
+        entry = _CacheEntry(handle, template.version, expire_at)
+        self._entries[key] = entry
+        if not self.enabled:
+            # 作成中に別の認証情報が使われた（別のキーで作成された可能性がある）
+            self._drop(key)
+            return None
+        logger.info(
+            f"Context cache created for '{template_name}' on {model_name} (~{template.static_tokens} tokens, ttl {self.ttl_seconds}s).")
+        return entry
+
+    def invalidate(self, scope: str, model_name: str, template: PromptTemplate):
+        """キャッシュを使った呼び出しが失敗した場合などに、次回作り直すよう破棄する。"""
+        self._drop((scope, model_name, template.name))
+
+    def _drop(self, key: Tuple[str, str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._invalidated += 1
+        # 削除はプロバイダへのブロッキング呼び出しになるため、別スレッドで行う
+        threading.Thread(target=self._delete_handle, args=(entry.handle,), daemon=True).start()
+
+    def _delete_handle(self, handle: Any):
+        try:
+            self.backend.delete(handle)
+        except Exception as e:
+            logger.warning(f"Failed to delete context cache {handle}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.name if self.backend is not None else "off",
+            "disabledReason": self._disabled_reason,
+            "entries": len(self._entries),
+            "ttlSeconds": self.ttl_seconds,
+            "minTokens": self.min_tokens,
+            "created": self._created,
+            "refreshed": self._refreshed,
+            "invalidated": self._invalidated,
+            "failures": self._failures,
+            "skippedSmallPrompts": self._skipped_small,
+        }
+
+
+def _create_backend(name: str) -> Optional[Any]:
+    if name == "vertex":
+        return VertexContextCacheBackend()
+    if name == "fake":
+        return FakeContextCacheBackend()
+    if name not in ("off", "none", ""):
+        logger.warning(
+            f"Unknown LLM_CONTEXT_CACHE_BACKEND '{name}'. Context caching disabled.")
+    return None
+
+
+context_cache_manager = ContextCacheManager(_create_backend(LLM_CONTEXT_CACHE_BACKEND))
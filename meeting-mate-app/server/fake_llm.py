@@ -0,0 +1,411 @@
+"""
+Vertex AI の GenerativeModel の代わりに使う決定的なフェイクモデル（LLM_BACKEND=fake）。
+
+オーケストレーターと各エージェントのプロンプトを役割の記述から判別し、
+スクリプト（FAKE_LLM_SCRIPT_PATH）に用意した応答を順に返すか、なければプロンプトの内容から規則で応答を生成する。
+同じプロンプトには常に同じ応答を返す。
+応答までの時間は TTFT（入力トークン数に比例するプレフィル時間を含む）と出力トークンごとの遅延で模倣し、
+stream=True ではチャンクごとに遅延を入れながら返す。トークン数は prompt_templates.estimate_tokens で見積もる。
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from config import (logger, FAKE_LLM_PROFILE, FAKE_LLM_TTFT_MS, FAKE_LLM_PER_TOKEN_MS, FAKE_LLM_PREFILL_MS_PER_1K_TOKENS,
+                    FAKE_LLM_JITTER, FAKE_LLM_SEED, FAKE_LLM_SCRIPT_PATH)
+from prompt_templates import estimate_tokens
+
+# 遅延のプロファイル（ミリ秒）
+LATENCY_PROFILES = {
+    "instant": {"ttft_ms": 0.0, "per_token_ms": 0.0, "prefill_ms_per_1k_tokens": 0.0},
+    "flash": {"ttft_ms": 350.0, "per_token_ms": 4.0, "prefill_ms_per_1k_tokens": 25.0},
+    "pro": {"ttft_ms": 1200.0, "per_token_ms": 15.0, "prefill_ms_per_1k_tokens": 80.0},
+}
+
+# ストリーミング時の1チャンクあたりのおおよそのトークン数
+STREAM_CHUNK_TOKENS = 8
+
+# プロンプトの種類（テンプレート名）と、それを判別する役割の記述
+PROMPT_KIND_MARKERS = [
+    ("Orchestrator", "AIオーケストレーター"),
+    ("TaskManagementAgent", "タスク管理アシスタント"),
+    ("NotesGeneratorAgent", "ノート作成アシスタント"),
+    ("AgendaManagementAgent", "アジェンダ管理アシスタント"),
+    ("ParticipantManagementAgent", "参加者管理アシスタント"),
+    ("OverviewDiagramAgent", "overview diagram creation assistant"),
+    ("MermaidRepair", "definition has syntax errors"),
+]
+
+# オーケストレーターが毎回呼び出すエージェントと、発言のキーワードで追加するエージェント
+DEFAULT_DISPATCH_AGENTS = ["NotesGeneratorAgent", "AgendaManagementAgent", "OverviewDiagramAgent"]
+KEYWORD_DISPATCH_AGENTS = [
+    ("TaskManagementAgent", re.compile(r"タスク|TODO|todo|担当|期限|締め切り|までに|お願いします")),
+    ("ParticipantManagementAgent", re.compile(r"参加者|役割")),
+]
+# エージェントへの指示（発言は「」で囲み、エージェント側の応答生成で取り出す）
+DISPATCH_INSTRUCTIONS = {
+    "TaskManagementAgent": "タスク「{statement}」を登録してください",
+    "NotesGeneratorAgent": "発言「{statement}」をノートに記録してください",
+    "AgendaManagementAgent": "発言「{statement}」を現在の議題の詳細に反映してください",
+    "OverviewDiagramAgent": "発言「{statement}」を踏まえて概要図を更新してください",
+    "ParticipantManagementAgent": "発言「{statement}」に基づいて参加者情報を更新してください",
+}
+
+_SESSION_DATA_RE = re.compile(r"現在のセッションデータ:\n```json\n(.*?)\n```", re.DOTALL)
+_LATEST_UTTERANCE_RE = re.compile(r"^最新発言: (.*)$", re.MULTILINE)
+_INSTRUCTION_RE = re.compile(r"^今回対応すべき新しい指示(?: \(操作者: [^)]*\))?: (.*)$", re.MULTILINE)
+_QUOTED_RE = re.compile(r"「(.+)」")
+_MERMAID_UNSAFE_RE = re.compile(r"[\"'`\[\](){}<>|#;:]")
+
+
+def classify_prompt(text: str) -> str:
+    for kind, marker in PROMPT_KIND_MARKERS:
+        if marker in text:
+            return kind
+    return "Unknown"
+
+
+def _short_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:10]
+
+
+def _session_data(text: str) -> Dict[str, Any]:
+    match = _SESSION_DATA_RE.search(text)
+    if not match:
+        return {}
+    try:
+        data = json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _instruction(text: str) -> str:
+    """指示のうち「」で囲まれた部分（なければ指示全体）。"""
+    match = _INSTRUCTION_RE.search(text)
+    instruction = match.group(1).strip() if match else ""
+    quoted = _QUOTED_RE.search(instruction)
+    return quoted.group(1).strip() if quoted else instruction
+
+
+def _room_value(session_data: Dict[str, Any], key: str, agent_key: Optional[str] = None) -> Any:
+    """セッションデータの値。エージェントには一部のキーが別名（agenda など）と full_room_data で渡される。"""
+    for candidate in (key, agent_key):
+        if candidate and session_data.get(candidate) is not None:
+            return session_data[candidate]
+    full_room_data = session_data.get("full_room_data")
+    return full_room_data.get(key) if isinstance(full_room_data, dict) else None
+
+
+def _collection_values(value: Any) -> List[Dict[str, Any]]:
+    if isinstance(value, dict):
+        value = list(value.values())
+    return [item for item in (value or []) if isinstance(item, dict)]
+
+
+def _mermaid_label(text: str, limit: int = 30) -> str:
+    return _MERMAID_UNSAFE_RE.sub(" ", str(text or "")).strip()[:limit] or "-"
+
+
+class LatencyProfile:
+    """TTFT・プレフィル・出力トークンごとの遅延（ミリ秒）。"""
+
+    def __init__(self, ttft_ms: float, per_token_ms: float, prefill_ms_per_1k_tokens: float,
+                 jitter: float = 0.0, seed: int = 0):
+        self.ttft_ms = ttft_ms
+        self.per_token_ms = per_token_ms
+        self.prefill_ms_per_1k_tokens = prefill_ms_per_1k_tokens
+        self.jitter = jitter
+        self.seed = seed
+
+    @classmethod
+    def from_config(cls) -> "LatencyProfile":
+        profile = LATENCY_PROFILES.get(FAKE_LLM_PROFILE)
+        if profile is None:
+            logger.warning(f"Unknown FAKE_LLM_PROFILE '{FAKE_LLM_PROFILE}'. Using 'flash'.")
+            profile = LATENCY_PROFILES["flash"]
+        overrides = {"ttft_ms": FAKE_LLM_TTFT_MS, "per_token_ms": FAKE_LLM_PER_TOKEN_MS,
+                     "prefill_ms_per_1k_tokens": FAKE_LLM_PREFILL_MS_PER_1K_TOKENS}
+        values = {key: float(overrides[key]) if overrides[key] is not None else value
+                  for key, value in profile.items()}
+        return cls(jitter=FAKE_LLM_JITTER, seed=FAKE_LLM_SEED, **values)
+
+    def factor(self, prompt_text: str) -> float:
+        """プロンプトとシードから決まる揺らぎの係数（同じプロンプトなら毎回同じ）。"""
+        if not self.jitter:
+            return 1.0
+        rng = random.Random(f"{self.seed}:{_short_hash(prompt_text)}")
+        return max(0.0, 1.0 + rng.uniform(-self.jitter, self.jitter))
+
+    def time_to_first_token_ms(self, prompt_tokens: int, factor: float = 1.0) -> float:
+        return (self.ttft_ms + self.prefill_ms_per_1k_tokens * prompt_tokens / 1000.0) * factor
+
+    def generation_ms(self, output_tokens: int, factor: float = 1.0) -> float:
+        return self.per_token_ms * output_tokens * factor
+
+
+class FakeUsageMetadata:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+        self.cached_content_token_count = 0
+
+
+class FakePart:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeContent:
+    def __init__(self, text: str):
+        self.role = "model"
+        self.parts = [FakePart(text)]
+
+
+class FakeCandidate:
+    def __init__(self, text: str, finish_reason: Optional[str] = "STOP"):
+        self.content = FakeContent(text)
+        self.finish_reason = finish_reason
+
+
+class FakeResponse:
+    """GenerationResponse と同じ text / candidates / usage_metadata を持つ応答（ストリーミングではチャンク）。"""
+
+    def __init__(self, text: str, usage_metadata: FakeUsageMetadata, finish_reason: Optional[str] = "STOP"):
+        self.text = text
+        self.candidates = [FakeCandidate(text, finish_reason)]
+        self.usage_metadata = usage_metadata
+
+
+class FakeLLMStats:
+    """プロンプトの種類ごとの呼び出し回数とトークン数（全インスタンスで共有）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._calls: Dict[str, int] = {}
+            self._prompt_tokens: Dict[str, int] = {}
+            self._output_tokens: Dict[str, int] = {}
+            self._scripted = 0
+            self._streamed = 0
+            self._simulated_ms = 0.0
+
+    def record(self, kind: str, prompt_tokens: int, output_tokens: int, simulated_ms: float, scripted: bool, streamed: bool):
+        with self._lock:
+            self._calls[kind] = self._calls.get(kind, 0) + 1
+            self._prompt_tokens[kind] = self._prompt_tokens.get(kind, 0) + prompt_tokens
+            self._output_tokens[kind] = self._output_tokens.get(kind, 0) + output_tokens
+            self._scripted += int(scripted)
+            self._streamed += int(streamed)
+            self._simulated_ms += simulated_ms
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": sum(self._calls.values()),
+                "callsByPrompt": dict(self._calls),
+                "promptTokens": sum(self._prompt_tokens.values()),
+                "outputTokens": sum(self._output_tokens.values()),
+                "promptTokensByPrompt": dict(self._prompt_tokens),
+                "outputTokensByPrompt": dict(self._output_tokens),
+                "scripted": self._scripted,
+                "streamed": self._streamed,
+                "simulatedLatencyMs": round(self._simulated_ms, 1),
+            }
+
+
+fake_llm_stats = FakeLLMStats()
+
+
+class ResponseScript:
+    """プロンプトの種類ごとに用意した応答を順に返す。使い切った種類は規則による生成に戻る。"""
+
+    def __init__(self, responses: Optional[Dict[str, Any]] = None):
+        self._responses: Dict[str, List[str]] = {}
+        for kind, values in (responses or {}).items():
+            values = values if isinstance(values, list) else [values]
+            self._responses[kind] = [value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+                                     for value in values]
+        self._positions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_json_file(cls, path: str) -> "ResponseScript":
+        with open(path, "r", encoding="utf-8") as f:
+            responses = json.load(f)
+        logger.info(f"Fake LLM script loaded from {path}: {', '.join(responses)}")
+        return cls(responses)
+
+    def next(self, kind: str) -> Optional[str]:
+        with self._lock:
+            responses = self._responses.get(kind)
+            position = self._positions.get(kind, 0)
+            if not responses or position >= len(responses):
+                return None
+            self._positions[kind] = position + 1
+            return responses[position]
+
+
+class RuleBasedResponder:
+    """プロンプトに含まれるセッションデータと指示から、各エージェントが受け付ける形式の応答を作る。"""
+
+    def __init__(self):
+        self._handlers = {
+            "Orchestrator": self._dispatch,
+            "TaskManagementAgent": self._tasks,
+            "NotesGeneratorAgent": self._notes,
+            "AgendaManagementAgent": self._agenda,
+            "ParticipantManagementAgent": self._participants,
+            "OverviewDiagramAgent": self._overview_diagram,
+            "MermaidRepair": lambda text: self._overview_diagram(""),
+        }
+
+    def respond(self, kind: str, text: str) -> str:
+        handler = self._handlers.get(kind)
+        return handler(text) if handler else ""
+
+    def _dispatch(self, text: str) -> str:
+        matches = _LATEST_UTTERANCE_RE.findall(text)
+        utterance = matches[-1] if matches else ""
+        # "話者: 発言"（発言側にも "話者: " が付いている場合がある）の発言部分
+        speaker, _, statement = utterance.partition(": ")
+        if statement.startswith(f"{speaker}: "):
+            statement = statement[len(speaker) + 2:]
+        statement = statement.strip()[:60]
+        if not statement:
+            return "[]"
+        agents = list(DEFAULT_DISPATCH_AGENTS)
+        for agent_name, pattern in KEYWORD_DISPATCH_AGENTS:
+            if pattern.search(statement):
+                agents.insert(0, agent_name)
+        return json.dumps([{"agent_name": agent_name, "instruction": DISPATCH_INSTRUCTIONS[agent_name].format(statement=statement)}
+                           for agent_name in agents], ensure_ascii=False)
+
+    def _tasks(self, text: str) -> str:
+        tasks = _collection_values(_room_value(_session_data(text), "tasks"))
+        instruction = _instruction(text)
+        if instruction:
+            task_id = f"task_{_short_hash(instruction)}"
+            if not any(task.get("id") == task_id for task in tasks):
+                tasks.append({"id": task_id, "title": instruction[:40], "status": "todo",
+                              "detail": instruction})
+        return json.dumps(tasks, ensure_ascii=False)
+
+    def _notes(self, text: str) -> str:
+        notes = _collection_values(_room_value(_session_data(text), "notes"))
+        instruction = _instruction(text)
+        if instruction:
+            note_id = f"note_{_short_hash(instruction)}"
+            if not any(note.get("id") == note_id for note in notes):
+                notes.append({"id": note_id, "type": "decision" if "決定" in instruction else "memo",
+                              "text": instruction})
+        return json.dumps(notes, ensure_ascii=False)
+
+    def _agenda(self, text: str) -> str:
+        session_data = _session_data(text)
+        agenda = _room_value(session_data, "currentAgenda", "agenda") or {}
+        main_topic = agenda.get("mainTopic") or "会議開始"
+        details = [detail.get("text") for detail in _collection_values(agenda.get("details")) if detail.get("text")]
+        instruction = _instruction(text)
+        if instruction and instruction not in details:
+            details.append(instruction)
+        next_topics = [topic.get("title") for topic in _collection_values(_room_value(session_data, "suggestedNextTopics"))
+                       if topic.get("title")]
+        return json.dumps({
+            "current_agenda_main_topic": main_topic,
+            "current_agenda_details": details[-5:],
+            "suggested_next_topics_list": next_topics[:3] or [f"{main_topic}の次のステップ"],
+        }, ensure_ascii=False)
+
+    def _participants(self, text: str) -> str:
+        participants = _room_value(_session_data(text), "participants")
+        return json.dumps(participants if isinstance(participants, dict) else {}, ensure_ascii=False)
+
+    def _overview_diagram(self, text: str) -> str:
+        session_data = _session_data(text)
+        main_topic = (_room_value(session_data, "currentAgenda", "agenda") or {}).get("mainTopic") or "会議"
+        lines = ["graph TD", f'    TOPIC_MAIN["{_mermaid_label(main_topic)}"]']
+        class_lines = ["    class TOPIC_MAIN primary"]
+        for index, task in enumerate(_collection_values(_room_value(session_data, "tasks"))[:5], start=1):
+            lines.append(f'    TASK_{index}("{_mermaid_label(task.get("title"))}")')
+            lines.append(f"    TOPIC_MAIN --> TASK_{index}")
+            class_lines.append(f"    class TASK_{index} accent")
+        for index, note in enumerate(_collection_values(_room_value(session_data, "notes"))[:5], start=1):
+            lines.append(f'    NOTE_{index}["{_mermaid_label(note.get("text"))}"]')
+            lines.append(f"    TOPIC_MAIN -.-> NOTE_{index}")
+            class_lines.append(f"    class NOTE_{index} secondary")
+        return "\n".join(lines + [
+            "    classDef primary fill:#EFF6FF,stroke:#EFF6FF,stroke-width:2px,color:#1E40AF,font-weight:bold",
+            "    classDef secondary fill:#F3F4F6,stroke:#F3F4F6,stroke-width:1.5px,color:#374151",
+            "    classDef accent fill:#FFFBEB,stroke:#FFFBEB,stroke-width:2px,color:#D97706,font-weight:500",
+        ] + class_lines)
+
+
+class FakeGenerativeModel:
+    """GenerativeModel.generate_content_async と同じ呼び出し方ができるフェイクモデル。"""
+
+    def __init__(self, model_name: str = "fake-model", latency: Optional[LatencyProfile] = None,
+                 script: Optional[ResponseScript] = None, stats: FakeLLMStats = fake_llm_stats):
+        self.model_name = model_name
+        self.latency = latency or default_latency_profile
+        self.script = script if script is not None else default_script
+        self.stats = stats
+        self._responder = RuleBasedResponder()
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        prompt_text = contents if isinstance(contents, str) else getattr(contents, "text", str(contents))
+        kind = classify_prompt(prompt_text)
+        scripted_text = self.script.next(kind) if self.script is not None else None
+        response_text = scripted_text if scripted_text is not None else self._responder.respond(kind, prompt_text)
+
+        prompt_tokens = estimate_tokens(prompt_text)
+        output_tokens = estimate_tokens(response_text)
+        factor = self.latency.factor(prompt_text)
+        ttft_ms = self.latency.time_to_first_token_ms(prompt_tokens, factor)
+        generation_ms = self.latency.generation_ms(output_tokens, factor)
+        self.stats.record(kind, prompt_tokens, output_tokens, ttft_ms + generation_ms,
+                          scripted=scripted_text is not None, streamed=stream)
+
+        if stream:
+            return self._stream(response_text, prompt_tokens, ttft_ms, factor)
+        await asyncio.sleep((ttft_ms + generation_ms) / 1000.0)
+        return FakeResponse(response_text, FakeUsageMetadata(prompt_tokens, output_tokens))
+
+    async def _stream(self, response_text: str, prompt_tokens: int, ttft_ms: float, factor: float) -> AsyncIterator[FakeResponse]:
+        await asyncio.sleep(ttft_ms / 1000.0)
+        chunks = _split_chunks(response_text, STREAM_CHUNK_TOKENS) or [""]
+        emitted_tokens = 0
+        for index, chunk in enumerate(chunks):
+            chunk_tokens = estimate_tokens(chunk)
+            if index > 0:
+                await asyncio.sleep(self.latency.generation_ms(chunk_tokens, factor) / 1000.0)
+            emitted_tokens += chunk_tokens
+            last = index == len(chunks) - 1
+            yield FakeResponse(chunk, FakeUsageMetadata(prompt_tokens, emitted_tokens),
+                               finish_reason="STOP" if last else None)
+
+
+def _split_chunks(text: str, chunk_tokens: int) -> List[str]:
+    """見積もりでおよそ chunk_tokens トークンずつに分ける。"""
+    chunks, current, current_tokens = [], [], 0.0
+    for ch in text:
+        current.append(ch)
+        current_tokens += 1.0 if ord(ch) > 0x7f else 0.25
+        if current_tokens >= chunk_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0.0
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+default_latency_profile = LatencyProfile.from_config()
+default_script = ResponseScript.from_json_file(FAKE_LLM_SCRIPT_PATH) if FAKE_LLM_SCRIPT_PATH else ResponseScript()
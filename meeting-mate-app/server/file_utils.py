@@ -1,8 +1,9 @@
 import firebase_admin
-from firebase_admin import credentials, db
+from firebase_admin import credentials
 import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from config import logger
+from rtdb import db, USE_MEMORY_RTDB, rtdb_initialized
 import json  # jsonをインポート
 
 # 汎用的なJSON操作関数を追加
@@ -43,34 +44,82 @@ def save_json(data: Dict[str, Any], file_path: str):
 # Firebase Admin SDKの初期化
 # GOOGLE_APPLICATION_CREDENTIALS環境変数が設定されていれば、自動的に認証情報が使用される
 # DATABASE_URLは環境変数から取得するか、直接指定する
-try:
-    FIREBASE_DATABASE_URL = os.getenv("FIREBASE_DATABASE_URL")
-    if not FIREBASE_DATABASE_URL:
-        logger.warning(
-            "FIREBASE_DATABASE_URL is not set. Firebase Admin SDK might not work correctly.")
-        # ローカル開発用にフォールバックURLを設定することも可能だが、本番では環境変数設定を推奨
-        # FIREBASE_DATABASE_URL = "https://your-project-id.firebaseio.com" # 例
-
-    # credentials.ApplicationDefault() は GOOGLE_APPLICATION_CREDENTIALS を自動で探す
-    cred = credentials.ApplicationDefault()
-    firebase_admin.initialize_app(cred, {
-        'databaseURL': FIREBASE_DATABASE_URL
-    })
-    logger.info("Firebase Admin SDK initialized successfully.")
-except Exception as e:
-    logger.error(f"Error initializing Firebase Admin SDK: {e}", exc_info=True)
-    # SDK初期化失敗時は、以降のDB操作が失敗する可能性があることを警告
+# インメモリRTDB（RTDB_BACKEND=memory）を使う場合は初期化しない
+if not USE_MEMORY_RTDB:
+    try:
+        FIREBASE_DATABASE_URL = os.getenv("FIREBASE_DATABASE_URL")
+        if not FIREBASE_DATABASE_URL:
+            logger.warning(
+                "FIREBASE_DATABASE_URL is not set. Firebase Admin SDK might not work correctly.")
+            # ローカル開発用にフォールバックURLを設定することも可能だが、本番では環境変数設定を推奨
+            # FIREBASE_DATABASE_URL = "https://your-project-id.firebaseio.com" # 例
+
+        # credentials.ApplicationDefault() は GOOGLE_APPLICATION_CREDENTIALS を自動で探す
+        cred = credentials.ApplicationDefault()
+        firebase_admin.initialize_app(cred, {
+            'databaseURL': FIREBASE_DATABASE_URL
+        })
+        logger.info("Firebase Admin SDK initialized successfully.")
+    except Exception as e:
+        logger.error(f"Error initializing Firebase Admin SDK: {e}", exc_info=True)
+        # SDK初期化失敗時は、以降のDB操作が失敗する可能性があることを警告
+
+
+# RTDBのレイアウト
+# rooms/{id}      : 会議の状態（参加者・タスク・ノート・議題・概要図など、小さく保つ）
+# transcripts/{id}: 発言履歴（増え続けるため、必要なときだけ読む）
+# room_meta/{id}  : LLMトリガー用のカウンターと処理中フラグ
+# room_usage/{id} : LLMのトークン使用量と概算コスト（サーバーのみが読み書きする）
+ROOMS_ROOT = "rooms"
+TRANSCRIPTS_ROOT = "transcripts"
+ROOM_META_ROOT = "room_meta"
+ROOM_USAGE_ROOT = "room_usage"
+# room_meta に移したキー（旧レイアウトでは rooms/{id} 直下にあった）
+ROOM_META_KEYS = ("user_message_count", "last_llm_processed_message_count",
+                  "is_llm_processing", "llm_pending_since")
+
+
+def room_path(room_id: str) -> str:
+    return f"{ROOMS_ROOT}/{room_id}"
+
+
+def transcript_path(room_id: str) -> str:
+    return f"{TRANSCRIPTS_ROOT}/{room_id}"
+
+
+def room_meta_path(room_id: str) -> str:
+    return f"{ROOM_META_ROOT}/{room_id}"
+
+
+def room_usage_path(room_id: str) -> str:
+    return f"{ROOM_USAGE_ROOT}/{room_id}"
+
+
+def transcript_as_list(value: Any) -> List[Dict[str, Any]]:
+    """
+    transcripts/{id} の値をリストに揃える。
+    RTDBは連番キーの一部が欠けた配列をオブジェクトとして返すため、キー順に並べ直して欠番を詰める。
+    """
+    if isinstance(value, list):
+        return [entry for entry in value if entry is not None]
+    if isinstance(value, dict):
+        return [value[key] for key in sorted(value, key=lambda k: int(k) if str(k).isdigit() else -1)
+                if value[key] is not None]
+    return []
+
+
+def count_user_entries(entries: List[Dict[str, Any]]) -> int:
+    """AIの発言を除いたユーザー発言の件数。"""
+    return sum(1 for entry in entries if isinstance(entry, dict) and entry.get("role") != "ai")
 
 
 DEFAULT_ROOM_STRUCTURE = {
     "participants": {},
-    "transcript": {},  # Firebaseではリストよりオブジェクトを推奨
-    "tasks": {},      # 同上
+    "tasks": {},      # Firebaseではリストよりオブジェクトを推奨
     "notes": {},      # 同上
     "overviewDiagram": {"title": "概要図", "mermaidDefinition": "graph TD;\nA[開始];"},
     "currentAgenda": {"mainTopic": "会議開始", "details": {}},  # 同上
     "suggestedNextTopics": {},  # 同上
-    "full_transcript_history": {},  # 同上
     "sessionTitle": "Untitled Session",
     "sessionId": "",  # room_idで代用または別途生成
     "startTime": ""  # ISO 8601形式のタイムスタンプ
@@ -79,14 +128,15 @@ DEFAULT_ROOM_STRUCTURE = {
 
 def load_session_data(room_id: str) -> Optional[Dict[str, Any]]:
     """
-    指定されたroom_idのセッションデータをFirebase Realtime Databaseから読み込む。
+    指定されたroom_idのセッションデータ（rooms/{id}、トランスクリプトは含まない）を
+    Firebase Realtime Databaseから読み込む。
     ルームが存在しない場合は、デフォルト構造で新しいルームを作成して返す。
     """
-    if not firebase_admin._apps:
+    if not rtdb_initialized():
         logger.error("Firebase Admin SDK not initialized. Cannot load data.")
         return None
     try:
-        ref = db.reference(f'/rooms/{room_id}')
+        ref = db.reference(room_path(room_id))
         room_data = ref.get()
 
         if room_data is None:
@@ -125,11 +175,11 @@ def save_session_data(data_to_save: Dict[str, Any], room_id: str):
     """
     指定されたroom_idのセッションデータをFirebase Realtime Databaseに保存する。
     """
-    if not firebase_admin._apps:
+    if not rtdb_initialized():
         logger.error("Firebase Admin SDK not initialized. Cannot save data.")
         return
     try:
-        ref = db.reference(f'/rooms/{room_id}')
+        ref = db.reference(room_path(room_id))
         ref.set(data_to_save)
         logger.info(
             f"Session data for room '{room_id}' saved to Firebase Realtime Database.")
@@ -144,7 +194,7 @@ def save_session_data(data_to_save: Dict[str, Any], room_id: str):
 if __name__ == '__main__':
     # Firebase Admin SDKの初期化をここでも行うか、環境変数経由で確実に行う必要がある
     # このテストを実行する前に、GOOGLE_APPLICATION_CREDENTIALS と FIREBASE_DATABASE_URL を設定してください。
-    if not firebase_admin._apps:
+    if not rtdb_initialized():
         print("Firebase Admin SDK not initialized. Please set GOOGLE_APPLICATION_CREDENTIALS and FIREBASE_DATABASE_URL.")
     else:
         logger.info("Testing file_utils.py with Firebase...")
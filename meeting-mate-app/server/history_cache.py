@@ -0,0 +1,89 @@
+"""
+トランスクリプトをLLM用のメッセージと整形済みの履歴行に変換した結果をルーム単位でキャッシュする。
+
+トランスクリプトは追記のみなので、トリガーごとに変換するのは前回以降に追加されたエントリだけでよい。
+オーケストレーターと各エージェントは同じ整形済みの行を共有し、同じ位置の組み合わせに対する
+履歴文字列は1回だけ組み立てる。
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+MAX_CACHED_ROOMS = 256
+MAX_MEMOIZED_HISTORIES = 8
+
+
+class ConvertedTranscript:
+    """1ルーム分の変換済みトランスクリプト（位置をキーとする）。"""
+
+    def __init__(self):
+        self.messages: List[Any] = []
+        self.texts: List[str] = []
+        self.lines: List[str] = []
+        self._first_entry_key: Tuple[Any, ...] = ()
+        self._histories: "OrderedDict[Tuple[int, ...], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    @staticmethod
+    def _entry_key(entry: Dict[str, Any]) -> Tuple[Any, ...]:
+        return (entry.get("timestamp"), entry.get("userId"), entry.get("text"))
+
+    def sync(self, entries: Sequence[Dict[str, Any]], convert_entry: Callable[[Dict[str, Any]], Any]) -> int:
+        """
+        未変換のエントリだけを変換して追加する。追記以外の変更を検知した場合は作り直す。
+        convert_entry はエントリを role と parts[0]['text'] を持つメッセージに変換する。戻り値は変換件数。
+        """
+        with self._lock:
+            first_key = self._entry_key(entries[0]) if entries else ()
+            if len(entries) < len(self.messages) or (self.messages and first_key != self._first_entry_key):
+                self.messages, self.texts, self.lines = [], [], []
+                self._histories.clear()
+            start = len(self.messages)
+            for entry in entries[start:]:
+                message = convert_entry(entry)
+                text = message.parts[0].get('text', '[content missing]') if message.parts else ''
+                self.messages.append(message)
+                self.texts.append(text)
+                self.lines.append(f"{message.role.capitalize()}: {text}" if text else "")
+            self._first_entry_key = first_key
+            return len(entries) - start
+
+    def history_str(self, positions: Sequence[int]) -> str:
+        """指定した位置の整形済み行を連結した履歴文字列（同じ位置の組み合わせは使い回す）。"""
+        key = tuple(positions)
+        with self._lock:
+            cached = self._histories.get(key)
+            if cached is None:
+                cached = "\n".join(self.lines[i] for i in key if self.lines[i])
+                self._histories[key] = cached
+                while len(self._histories) > MAX_MEMOIZED_HISTORIES:
+                    self._histories.popitem(last=False)
+            else:
+                self._histories.move_to_end(key)
+            return cached
+
+
+class RoomHistoryCache:
+    """ルームごとの変換済みトランスクリプトを保持する（LRUで上限付き）。"""
+
+    def __init__(self, max_rooms: int = MAX_CACHED_ROOMS):
+        self.max_rooms = max_rooms
+        self._rooms: "OrderedDict[str, ConvertedTranscript]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, room_id: str) -> ConvertedTranscript:
+        with self._lock:
+            converted = self._rooms.get(room_id)
+            if converted is None:
+                converted = ConvertedTranscript()
+                self._rooms[room_id] = converted
+            self._rooms.move_to_end(room_id)
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+            return converted
+
+
+room_history_cache = RoomHistoryCache()
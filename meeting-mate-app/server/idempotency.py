@@ -0,0 +1,91 @@
+"""
+taskId によるリクエストの重複排除。
+
+モバイルクライアントはタイムアウト時に同じリクエストを再送するため、同じ taskId のリクエストが
+処理中であればその完了を待って同じ結果を返し、完了済みであれば保存した結果を返す。
+これにより、同じ発言がトランスクリプトに二重に追記されたり、オーケストレーションが二重に走ったりしない。
+結果は短時間（TTL）だけ保持する。保持はインスタンス内のみ。
+エラーの結果（呼び出し側の retain が偽を返す結果）は保持せず、一時的な障害の後の再送ではもう一度処理する。
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from config import INVOKE_IDEMPOTENCY_TTL_SECONDS, INVOKE_IDEMPOTENCY_MAX_ENTRIES
+
+
+class IdempotencyStore:
+    """キーごとに1回だけ処理を実行し、処理中・完了済みの結果を共有する（イベントループ内で使用）。"""
+
+    def __init__(self, ttl_seconds: float = INVOKE_IDEMPOTENCY_TTL_SECONDS, max_entries: int = INVOKE_IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # key -> (expires_at, future)。expires_at は完了時に設定する（処理中は None）
+        self._entries: "OrderedDict[Hashable, Tuple[Any, asyncio.Future]]" = OrderedDict()
+        self._executed = 0
+        self._duplicates_in_flight = 0
+        self._duplicates_completed = 0
+
+    async def run(self, key: Hashable, process: Callable[[], Awaitable[Any]],
+                  retain: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+        """
+        key に対して process を1回だけ実行する。戻り値は (結果, 重複リクエストだったか)。
+        元のリクエストが切断されても処理は継続し、再送されたリクエストに結果を返す。
+        retain が偽を返した結果は、処理中に届いた重複リクエストにだけ返し、完了後は保持しない。
+        """
+        self._purge_expired()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, future = entry
+            if expires_at is None:
+                self._duplicates_in_flight += 1
+            else:
+                self._duplicates_completed += 1
+            return await asyncio.shield(future), True
+
+        future = asyncio.ensure_future(process())
+        self._entries[key] = (None, future)
+        self._executed += 1
+        future.add_done_callback(lambda _: self._mark_done(key, future, retain))
+        return await asyncio.shield(future), False
+
+    def _mark_done(self, key: Hashable, future: asyncio.Future, retain: Optional[Callable[[Any], bool]] = None):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] is not future:
+            return
+        if future.cancelled() or future.exception() is not None or (retain is not None and not retain(future.result())):
+            # 結果を返せなかった処理・エラーになった処理は保持せず、再送時にもう一度実行する
+            del self._entries[key]
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, future)
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._entries.items()
+                   if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def _evict(self):
+        # 処理中のものは残し、完了済みのものを古い順に捨てる
+        for key in list(self._entries.keys()):
+            if len(self._entries) <= self.max_entries:
+                break
+            if self._entries[key][0] is not None:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        in_flight = sum(1 for expires_at, _ in self._entries.values() if expires_at is None)
+        return {
+            "entries": len(self._entries),
+            "inFlight": in_flight,
+            "executed": self._executed,
+            "duplicatesInFlight": self._duplicates_in_flight,
+            "duplicatesCompleted": self._duplicates_completed,
+        }
+
+
+invoke_idempotency = IdempotencyStore()
@@ -0,0 +1,146 @@
+"""
+オーケストレーターとエージェントが使うLLM呼び出しの窓口。
+
+GenerativeModel と同じ generate_content_async を持つラッパーで、
+PromptTemplate から組み立てたプロンプト（RenderedPrompt）を受け取った場合は
+静的プレフィックスをコンテキストキャッシュから使い、動的サフィックスだけを送る。
+文字列のプロンプトはそのまま元のモデルに渡す。
+応答の usage_metadata は、ルーム・エージェント・モデルごとのトークン使用量として token_usage に加算する。
+呼び出しごとに1行の要約（プロンプト名・モデル・所要時間・トークン数）をログに出す。プロンプトと応答の本文は
+サンプリングされたオーケストレーション（LLM_LOG_SAMPLE_RATE）でだけ、LLM_LOG_MAX_CHARS 文字までに切ってログに出す。
+"""
+import contextvars
+import hashlib
+import random
+import time
+from typing import Any, Dict, Optional
+
+from config import logger, LLM_LOG_SAMPLE_RATE, LLM_LOG_MAX_CHARS
+from context_cache import ContextCacheManager, context_cache_manager
+from metrics import record_llm_request, record_llm_tokens
+from prompt_templates import RenderedPrompt
+from token_usage import TokenUsageAccountant, token_usage
+from tracing import span, set_span_attributes, mark_llm_response_received
+
+# プロンプトと応答の本文をログに出すかどうか（オーケストレーションの開始時に決め、エージェントのタスクに引き継ぐ）
+_log_llm_text: contextvars.ContextVar[Optional[bool]] = contextvars.ContextVar("log_llm_text", default=None)
+
+
+def sample_llm_logging() -> bool:
+    """このオーケストレーションでプロンプトと応答の本文をログに出すかを LLM_LOG_SAMPLE_RATE で決める。"""
+    sampled = random.random() < LLM_LOG_SAMPLE_RATE
+    _log_llm_text.set(sampled)
+    return sampled
+
+
+def _should_log_llm_text() -> bool:
+    sampled = _log_llm_text.get()
+    if sampled is None:  # オーケストレーションの外からの呼び出しは1回ごとに決める
+        sampled = random.random() < LLM_LOG_SAMPLE_RATE
+    return sampled
+
+
+def _truncate(text: str) -> str:
+    if len(text) <= LLM_LOG_MAX_CHARS:
+        return text
+    return text[:LLM_LOG_MAX_CHARS] + f"... [truncated {len(text) - LLM_LOG_MAX_CHARS} chars]"
+
+
+def response_text(response: Any) -> str:
+    """応答の本文（ブロックされた応答などで text が取り出せない場合は最初の候補のテキスト、なければ空文字）。"""
+    try:
+        text = getattr(response, "text", "")
+    except (ValueError, AttributeError):
+        text = ""
+    if not text and getattr(response, "candidates", None):
+        try:
+            text = response.candidates[0].content.parts[0].text
+        except (AttributeError, IndexError):
+            text = ""
+    return text or ""
+
+
+def credentials_scope(api_key: Optional[str]) -> str:
+    """キャッシュを認証情報ごとに分けるためのキー（APIキーそのものは保持しない）。"""
+    if not api_key:
+        return "default"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class LLMClient:
+    def __init__(self, model: Any, model_name: str, scope: str = "default",
+                 context_cache: Optional[ContextCacheManager] = context_cache_manager,
+                 room_id: Optional[str] = None, usage: Optional[TokenUsageAccountant] = token_usage):
+        self.model = model
+        self.model_name = model_name
+        self.scope = scope
+        self.context_cache = context_cache
+        # トークン使用量を集計するルーム（None の場合は集計しない）
+        self.room_id = room_id
+        self.usage = usage
+
+    async def generate_content_async(self, prompt, **kwargs):
+        prompt_name = prompt.name if isinstance(prompt, RenderedPrompt) else "text"
+        started = time.perf_counter()
+        with span("llm.generate", prompt=prompt_name, model=self.model_name):
+            try:
+                response = await self._generate(prompt, **kwargs)
+            except Exception:
+                record_llm_request(prompt_name, self.model_name, time.perf_counter() - started, "error")
+                raise
+            usage_metadata = getattr(response, "usage_metadata", None)
+            if usage_metadata is not None:
+                set_span_attributes(
+                    prompt_tokens=getattr(usage_metadata, "prompt_token_count", None),
+                    output_tokens=getattr(usage_metadata, "candidates_token_count", None),
+                    cached_tokens=getattr(usage_metadata, "cached_content_token_count", None))
+        elapsed = time.perf_counter() - started
+        record_llm_request(prompt_name, self.model_name, elapsed, "ok")
+        record_llm_tokens(prompt_name, self.model_name, usage_metadata)
+        if self.usage is not None:
+            self.usage.record(self.room_id, prompt_name, self.model_name, usage_metadata)
+        self._log_call(prompt, prompt_name, response, usage_metadata, elapsed)
+        mark_llm_response_received()
+        return response
+
+    def _log_call(self, prompt, prompt_name: str, response: Any, usage_metadata: Any, elapsed: float):
+        fields: Dict[str, Any] = {
+            "prompt": prompt_name,
+            "model": self.model_name,
+            "roomId": self.room_id,
+            "latencyMs": round(elapsed * 1000),
+            "promptTokens": getattr(usage_metadata, "prompt_token_count", None),
+            "outputTokens": getattr(usage_metadata, "candidates_token_count", None),
+            "cachedTokens": getattr(usage_metadata, "cached_content_token_count", None),
+        }
+        fields = {key: value for key, value in fields.items() if value is not None}
+        logger.info("LLM call completed.", extra={"fields": fields})
+        if not _should_log_llm_text():
+            return
+        prompt_text = prompt.text if isinstance(prompt, RenderedPrompt) else str(prompt)
+        prompt_fields = {"prompt": prompt_name, "roomId": self.room_id, "chars": len(prompt_text)}
+        if isinstance(prompt, RenderedPrompt):
+            prompt_fields["estimatedTokens"] = prompt.section_token_counts()
+        prompt_fields["text"] = _truncate(prompt_text)
+        logger.info("LLM prompt (sampled).", extra={"fields": prompt_fields})
+        text = response_text(response)
+        logger.info("LLM response (sampled).", extra={"fields": {
+            "prompt": prompt_name, "roomId": self.room_id, "chars": len(text), "text": _truncate(text)}})
+
+    async def _generate(self, prompt, **kwargs):
+        if isinstance(prompt, RenderedPrompt):
+            cached_model = None
+            if self.context_cache is not None:
+                cached_model = await self.context_cache.model_for(
+                    self.model, self.model_name, self.scope, prompt.template)
+            if cached_model is not None:
+                try:
+                    return await cached_model.generate_content_async(prompt.dynamic_suffix, **kwargs)
+                except Exception as e:
+                    # キャッシュの期限切れ・削除などが考えられるため、破棄して全文で送り直す
+                    logger.warning(
+                        f"Request with context cache for '{prompt.name}' failed: {e}. Retrying with the full prompt.")
+                    self.context_cache.invalidate(
+                        self.scope, self.model_name, prompt.template)
+            prompt = prompt.text
+        return await self.model.generate_content_async(prompt, **kwargs)
@@ -0,0 +1,137 @@
+"""
+ログの出力経路。
+
+リクエストを処理するスレッドではログレコードをキューに積むだけにし、書式化と出力（標準エラー出力）は
+バックグラウンドのスレッド（QueueListener）で行う。キューがいっぱいのときは待たずに捨て、捨てた件数を数える。
+LOG_FORMAT=json では1行1件のJSON（severity・message・構造化フィールド）で出力し、Cloud Logging に構造化ログとして取り込ませる。
+構造化フィールドは logger.info(..., extra={"fields": {...}}) で渡す。フィールドの "text" は本文の後ろに改行して出力する。
+このモジュールは config から読み込まれるため、config を import しない。
+"""
+import atexit
+import json
+import logging
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 同じプロセス内のキューなので、書式化（例外のトレースバックを含む）はリスナーのスレッドに任せる
+        # メッセージの引数だけはここで確定させる（後から引数のオブジェクトが変わっても出力が変わらないように）
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+def _record_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    fields = dict(getattr(record, "fields", None) or {})
+    trace_id = getattr(record, "trace_id", None)
+    if trace_id:
+        fields["trace_id"] = trace_id
+    return fields
+
+
+class TextFormatter(logging.Formatter):
+    """"LEVEL:logger:message | key=value ..." の1行（text フィールドは次の行以降）。"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _record_fields(record)
+        text = fields.pop("text", None)
+        if fields:
+            line += " | " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if text:
+            line += "\n" + str(text)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Cloud Logging の構造化ログ（severity・message・logging.googleapis.com/trace）の1行。"""
+
+    def __init__(self, cloud_project: Optional[str] = None):
+        super().__init__()
+        self.cloud_project = cloud_project
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        payload = {
+            "severity": record.levelname,
+            "message": message,
+            "logger": record.name,
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+        }
+        fields = _record_fields(record)
+        if fields.get("trace_id") and self.cloud_project:
+            payload["logging.googleapis.com/trace"] = f"projects/{self.cloud_project}/traces/{fields['trace_id']}"
+        payload.update(fields)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+_queue_handler: Optional[_NonBlockingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(level: str = "INFO", log_format: str = "text", queue_size: int = 10000,
+                      cloud_project: Optional[str] = None):
+    """
+    ルートロガーにキュー経由のハンドラーを設定する。
+    すでにハンドラーが設定されている場合（テストや組み込み先が設定済みの場合）はレベルだけ設定する。
+    """
+    global _queue_handler, _listener
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+    if root.handlers:
+        return
+    output_handler = logging.StreamHandler(sys.stderr)
+    output_handler.setFormatter(JsonFormatter(cloud_project) if log_format == "json" else TextFormatter())
+    _queue_handler = _NonBlockingQueueHandler(queue.Queue(maxsize=max(queue_size, 1)))
+    root.addHandler(_queue_handler)
+    _listener = QueueListener(_queue_handler.queue, output_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def add_log_filter(log_filter: logging.Filter):
+    """
+    ログを出したスレッドで実行するフィルターを追加する（トレースIDなどの文脈の取得用）。
+    キュー経由の場合はキューに積む前に、そうでない場合はルートロガーの各ハンドラーで実行する。
+    """
+    handlers = [_queue_handler] if _queue_handler is not None else logging.getLogger().handlers
+    for handler in handlers:
+        handler.addFilter(log_filter)
+
+
+def stop_logging():
+    """キューに残ったログを書き出してリスナーを止める。"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    if _queue_handler is not None and _queue_handler.dropped:
+        sys.stderr.write(f"WARNING:log_pipeline:Dropped {_queue_handler.dropped} log records because the queue was full.\n")
+
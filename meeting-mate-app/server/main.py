@@ -2,22 +2,41 @@
 from __future__ import annotations
 
 # Vertex AI設定をインポート
-from config import VERTEX_AI_AVAILABLE, VERTEX_MODEL_NAME, LLM_TRIGGER_MESSAGE_COUNT
+from config import VERTEX_AI_AVAILABLE, VERTEX_MODEL_NAME, LLM_TRIGGER_MESSAGE_COUNT, LLM_BACKEND
 from agents.task_agent import TaskManagementAgent
-from agents.participant_agent import ParticipantManagementAgent
+from agents.participant_agent import ParticipantManagementAgent, extract_role_updates, apply_role_updates
 from agents.overview_diagram_agent import OverviewDiagramAgent
 from agents.notes_agent import NotesGeneratorAgent
 from agents.agenda_agent import AgendaManagementAgent
-from file_utils import load_json, save_json, ensure_dir_exists
+from file_utils import load_json, save_json, ensure_dir_exists, room_path, transcript_path, room_meta_path, transcript_as_list, count_user_entries, ROOM_META_KEYS
+from prompt_templates import PromptTemplate, SESSION_DATA_SECTION
+from llm_client import LLMClient, credentials_scope, sample_llm_logging
+from fake_llm import FakeGenerativeModel, fake_llm_stats
+from context_cache import context_cache_manager
+from response_cache import agent_response_cache, reset_agent_succeeded, agent_succeeded
+from section_hashes import section_hash, section_write_stats
+from idempotency import invoke_idempotency
+from metrics import (PROMETHEUS_AVAILABLE, render_metrics, stage_timer, agent_stage_timer, record_request,
+                     record_trigger_decision, record_agent_invocation)
+from token_usage import token_usage, usage_agent
+from room_budget import evaluate_room_budget, publish_budget_state, trigger_message_count
+from tracing import (span, request_span, traced, set_span_attributes, current_trace_id, record_span_since_llm_response,
+                     shutdown_tracing)
+from similarity_index import deduplicate_collection
+from transcript_index import select_history_positions
+from transcript_stream import TranscriptStreamBuffer
+from room_state_cache import room_state_cache, transcript_cache, room_meta_cache
+from history_cache import room_history_cache
 from config import AGENT_CONFIG_DIR, MAX_ITERATIONS, MAX_RETRY_ATTEMPTS
-from firebase_admin import credentials, auth as firebase_auth, db
+from firebase_admin import credentials, auth as firebase_auth
 import firebase_admin
+from rtdb import db, USE_MEMORY_RTDB
 import os
 import json
-from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, Response, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field, field_validator, validator
-from typing import List, Dict, Any, Optional, TYPE_CHECKING
+from typing import List, Dict, Any, Optional, Tuple, TYPE_CHECKING
 from dotenv import load_dotenv
 import logging
 from datetime import datetime, timedelta
@@ -40,6 +59,9 @@ if VERTEX_AI_AVAILABLE:
         logger.error(f"Failed to import Vertex AI module: {e}")
         VERTEX_AI_AVAILABLE = False
 
+# LLM_BACKEND=fake ではVertex AIの代わりに決定的なフェイクモデル（fake_llm.py）を使う
+USE_FAKE_LLM = LLM_BACKEND == "fake"
+
 load_dotenv()
 
 try:
@@ -49,11 +71,13 @@ try:
         if gcp_project_id:
             database_url = f"https://{gcp_project_id}-default-rtdb.firebaseio.com"
             logger.info(f"FIREBASE_DATABASE_URL inferred: {database_url}")
-        else:
+        elif not USE_MEMORY_RTDB:
             raise ValueError(
                 "FIREBASE_DATABASE_URL and GCP_PROJECT_ID not set.")
+    # インメモリRTDBを使う場合も、Firebase Authentication のためにアプリは初期化する
     if not firebase_admin._apps:
-        firebase_admin.initialize_app(options={'databaseURL': database_url})
+        firebase_admin.initialize_app(
+            options={'databaseURL': database_url} if database_url else None)
     logger.info("Firebase Admin SDK initialized.")
 except Exception as e:
     logger.error(f"Error initializing Firebase Admin SDK: {e}")
@@ -184,7 +208,7 @@ async def join_room_endpoint(request_data: JoinRoomRequest):
         user_record = firebase_auth.get_user(uid)
         display_name = request_data.speakerName or user_record.display_name or user_record.email or f"user_{uid[:5]}"
 
-        room_ref = db.reference(f"rooms/{request_data.roomId}")
+        room_ref = db.reference(room_path(request_data.roomId))
         room_data = room_ref.get()
 
         if not room_data:
@@ -228,7 +252,7 @@ async def add_message_endpoint(request_data: AddMessageRequest):
             f"user_{uid[:5]}"
         )
 
-        room_ref = db.reference(f"rooms/{request_data.roomId}")
+        room_ref = db.reference(room_path(request_data.roomId))
         if not room_ref.get():
             raise HTTPException(status_code=404, detail="Demo room not found")
 
@@ -240,12 +264,8 @@ async def add_message_endpoint(request_data: AddMessageRequest):
             role="user"
         )
 
-        transcript_ref = room_ref.child("transcript")
-        current_transcript_list = transcript_ref.get()
-        if not isinstance(current_transcript_list, list):
-            current_transcript_list = []
-        current_transcript_list.append(new_db_entry.model_dump())
-        transcript_ref.set(current_transcript_list)
+        append_transcript_entries(
+            request_data.roomId, [new_db_entry.model_dump()])
 
         logger.info(
             f"Message added to demo room {request_data.roomId} by {display_name}")
@@ -260,13 +280,74 @@ async def add_message_endpoint(request_data: AddMessageRequest):
             status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
-async def process_single_agent(agent, task_payload: TaskPayload, agent_name: str, instruction_text: str, results_dict: dict, conversation_history_for_agent: List[LLMMessage], llm_model_instance: GenerativeModel):
+def apply_participant_fast_path(room_ref, speaker_id: str, speaker_name: Optional[str], participant_info: Optional[Dict[str, Any]], text: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    LLMを使わずに参加者情報を最新に保つ決定的な処理ステージ。
+    発言中の明示的な役割宣言をパターンで反映する（既存の参加者のみ）。
+    participants/{uid} はルームの読み取り権限になるため、未登録の発言者は登録しない（参加申請の承認を経て登録される）。
+    (解決済みの表示名, 発言者の最新の参加者情報) を返す。
+    """
+    resolved_name = participant_info.get(
+        "name") if participant_info else speaker_name
+    participant_updates = {}
+
+    # 自分の役割宣言は参加者一覧を読まずに判定し、他者への言及があった場合のみ一覧を取得する
+    known_participants = {speaker_id: participant_info} if participant_info else {}
+    role_updates, needs_roster = extract_role_updates(
+        text, speaker_id, known_participants)
+    if needs_roster:
+        known_participants = {
+            **(room_state_cache.get_child(room_ref.key, "participants") or {}), **known_participants}
+        role_updates, ambiguous = extract_role_updates(
+            text, speaker_id, known_participants)
+        if ambiguous:
+            logger.info(
+                f"Ambiguous participant statement left to the orchestrator: '{text}'")
+
+    for p_id, p_data in apply_role_updates(known_participants, role_updates).items():
+        participant_updates[p_id] = p_data
+        logger.info(
+            f"Participant role updated by pattern: {p_id} -> {p_data.get('role')}")
+
+    if participant_updates:
+        room_ref.child("participants").update(participant_updates)
+        for p_id, p_data in participant_updates.items():
+            room_state_cache.apply_local_write(
+                room_ref.key, f"participants/{p_id}", p_data)
+    return resolved_name, participant_updates.get(speaker_id, participant_info)
+
+
+@traced("agent")
+async def process_single_agent(agent, task_payload: TaskPayload, agent_name: str, instruction_text: str, results_dict: dict, conversation_history_for_agent: List[LLMMessage], llm_model_instance: LLMClient):
     logger.info(
         f"Invoking {agent_name} for task {task_payload.taskId} in room {task_payload.roomId} with instruction: '{instruction_text}'")
+    model_name = getattr(llm_model_instance, "model_name", "")
+    set_span_attributes(agent=agent_name, model=model_name, room_id=task_payload.roomId)
+    # エージェント内で文字列のプロンプトを送った場合も、トークン使用量をこのエージェントに付ける
+    usage_agent.set(agent_name)
+    timer = agent_stage_timer(agent_name, model_name, task_payload.roomId)
     try:
         if hasattr(agent, 'execute'):
-            room_ref_path = f"rooms/{task_payload.roomId}"
-            room_data_snapshot = db.reference(room_ref_path).get() or {}
+            # 会話履歴は直近ウィンドウ + 指示に関連する過去発言 (BM25) に絞り込む
+            # 変換済みトランスクリプトのキャッシュがあれば、整形済みの行と履歴文字列を共有する
+            converted_transcript = room_history_cache.get(task_payload.roomId)
+            shared_history = len(converted_transcript) == len(conversation_history_for_agent)
+            history_texts = converted_transcript.texts if shared_history else [
+                msg.parts[0].get('text', '') if msg.parts else '' for msg in conversation_history_for_agent]
+            selected_positions = select_history_positions(
+                task_payload.roomId, history_texts, instruction_text)
+            if len(selected_positions) < len(conversation_history_for_agent):
+                logger.info(
+                    f"{agent_name}: using {len(selected_positions)} of {len(conversation_history_for_agent)} transcript entries as history.")
+            history_str = converted_transcript.history_str(
+                selected_positions) if shared_history else None
+            conversation_history_for_agent = [
+                conversation_history_for_agent[i] for i in selected_positions]
+            timer.mark("history_select")
+
+            room_ref_path = room_path(task_payload.roomId)
+            # トランスクリプトは transcripts/{id} に分離されており、conversation_history で渡す
+            room_data_snapshot = room_state_cache.get(task_payload.roomId) or {}
             current_data_for_agent = {
                 "participants": room_data_snapshot.get("participants"),
                 "tasks": room_data_snapshot.get("tasks"),
@@ -286,270 +367,358 @@ async def process_single_agent(agent, task_payload: TaskPayload, agent_name: str
             agent_specific_args = {
                 "instruction": instruction_text,
                 "conversation_history": conversation_history_for_agent,
+                "history_str": history_str,  # 整形済みの履歴（Noneの場合は各エージェントが組み立てる）
                 "current_data": current_data_for_agent,
                 "room_id": task_payload.roomId,
                 "speaker_id": task_payload.speakerId,  # speakerIdを追加
                 "speaker_name": task_payload.speakerName,
                 "llm_model": llm_model_instance  # LLMモデルインスタンスを渡す
             }
-            updated_data_from_agent, user_message_text = await agent.execute(**agent_specific_args)
-
+            # 同じルーム状態・会話履歴に対する同じ指示の再ディスパッチは、前回の結果を再利用する
+            response_cache_key = agent_response_cache.make_key(
+                agent_name, model_name, instruction_text, {
+                    "room": room_data_snapshot,
+                    "history": history_str if history_str is not None else [
+                        msg.parts[0].get('text', '') if msg.parts else '' for msg in conversation_history_for_agent],
+                    "speaker": [task_payload.speakerId, task_payload.speakerName],
+                })
+            cached_response = agent_response_cache.get(response_cache_key)
+            timer.mark("response_cache")
+            set_span_attributes(response_cache_hit=cached_response is not None)
+            if cached_response is not None:
+                updated_data_from_agent, user_message_text = cached_response
+                logger.info(
+                    f"{agent_name}: served from response cache for instruction '{instruction_text}'.")
+            else:
+                reset_agent_succeeded()
+                with span("agent.execute", agent=agent_name):
+                    updated_data_from_agent, user_message_text = await agent.execute(**agent_specific_args)
+                    # LLM応答を受け取ってからエージェントが返すまで（応答の解析・検証）
+                    record_span_since_llm_response("agent.parse", agent=agent_name)
+                # フォールバック・エラーの結果はキャッシュしない（エージェントが成功を示した結果だけ）
+                if agent_succeeded():
+                    agent_response_cache.put(
+                        response_cache_key, updated_data_from_agent or {}, user_message_text)
+                timer.mark("execute")
+
+            unchanged_sections = []
             if updated_data_from_agent:
-                for key, value in updated_data_from_agent.items():
-                    if value is not None:
-                        db_key = key
-                        if key == "agenda":
-                            db_key = "currentAgenda"
-                        elif key == "overview_diagram":
-                            db_key = "overviewDiagram"
-                        db.reference(f"{room_ref_path}/{db_key}").set(value)
+                with span("rtdb.commit", agent=agent_name, room_id=task_payload.roomId) as commit_span:
+                    for key, value in updated_data_from_agent.items():
+                        if value is not None:
+                            db_key = key
+                            if key == "agenda":
+                                db_key = "currentAgenda"
+                            elif key == "overview_diagram":
+                                db_key = "overviewDiagram"
+                            # コミット前にタスク/ノートの近似重複を統合し、プロンプトに再送されるリストを小さく保つ
+                            value, _ = deduplicate_collection(
+                                task_payload.roomId, db_key, value)
+                            updated_data_from_agent[key] = value
+                            # 現在の値と内容が同じなら書き込まない（クライアントの再描画も起きない）
+                            if section_hash(value) == section_hash(room_state_cache.get_child(task_payload.roomId, db_key)):
+                                unchanged_sections.append(db_key)
+                                section_write_stats.record(db_key, written=False)
+                                continue
+                            db.reference(f"{room_ref_path}/{db_key}").set(value)
+                            room_state_cache.apply_local_write(
+                                task_payload.roomId, db_key, value)
+                            section_write_stats.record(db_key, written=True)
+                    set_span_attributes(unchanged_sections=len(unchanged_sections))
+
+            timer.mark("write")
+            timer.finish()
+            record_agent_invocation(
+                agent_name, model_name, "cached" if cached_response is not None else "ok")
 
             results_dict[agent_name] = {
-                "data": updated_data_from_agent, "message": user_message_text}
+                "data": updated_data_from_agent, "message": user_message_text,
+                "unchangedSections": unchanged_sections}
             logger.info(
-                f"{agent_name} processed successfully. Message: {user_message_text}")
+                f"{agent_name} processed successfully ({len(unchanged_sections)} unchanged section write(s) skipped). Message: {user_message_text}")
         else:
             results_dict[agent_name] = {
                 "error": f"{agent_name} does not have an execute method."}
+            record_agent_invocation(agent_name, model_name, "error")
     except Exception as e:
         logger.error(f"Error processing {agent_name}: {e}", exc_info=True)
         results_dict[agent_name] = {"error": str(e)}
+        record_agent_invocation(agent_name, model_name, "error")
 
 
+DISPATCH_REPRESENTATIVE_MODE_CONTEXT = """**重要: 代表参加者モードが有効です:**
+この会議では参加者は代表者として発言しており、個々の発言者の特定はできません。
+各エージェントに渡す指示では、発言者が特定できないことを考慮してください。"""
+
+DISPATCH_PROMPT = PromptTemplate(
+    "Orchestrator",
+    static_sections=[
+        ("role", """あなたは会議中の発言を解釈し、適切な専門エージェントを呼び出すAIオーケストレーターです。
+以下の指示に従って、呼び出すべきエージェントとその指示内容をJSON形式で応答してください。"""),
+        ("agents", """利用可能な専門エージェントのリストとそれぞれの役割:
+- **TaskManagementAgent**: 会議中のタスク（TODO、進行中、完了）の追加、更新、削除、担当者や期限の設定など、タスクリストの管理を行います。
+- **NotesGeneratorAgent**: 会議中の重要なメモ、決定事項、課題などを記録・要約し、ノートリストを生成・更新します。
+- **AgendaManagementAgent**: 会議の主要議題や詳細、次に議論すべき推奨議題を管理・更新します。
+- **OverviewDiagramAgent**: 会議の内容やプロジェクトの構造を視覚的に表現するMermaid.jsの概要図を生成・更新します。
+- **ParticipantManagementAgent**: 参加者の名前や役割を更新します。新しい発言者の登録や「私は〇〇担当です」のような明示的な役割宣言は自動処理済みのため、それ以外の曖昧な参加者情報の変更がある場合にのみ呼び出してください。"""),
+        ("response_format", """応答形式の厳守のお願い:
+応答は必ず以下のJSON形式のリストとしてください。
+`[
+  {"agent_name": "上記リストから選択したエージェント名", "instruction": "選択したエージェントへの具体的な指示内容（文字列）"},
+  ...
+]`
+- `agent_name` には、必ず上記リスト内のエージェント名を指定してください。
+- `instruction` には、そのエージェントに実行させたい具体的な指示を、簡潔な日本語の文字列で記述してください。複雑な構造化データは含めないでください。
+- 複数のエージェントを呼び出す必要がある場合は、リスト内に複数のオブジェクトを含めてください。
+- 呼び出すべき適切なエージェントが存在しない場合は、空のリスト `[]` を返してください。"""),
+        ("examples", """具体例:
+- タスク管理エージェントに新しいタスクを登録する場合:
+  `[ {"agent_name": "TaskManagementAgent", "instruction": "新しいタスク「API仕様書の作成」を登録してください"} ]`
+- アジェンダ管理エージェントに現在のアジェンダを更新する場合:
+  `[ {"agent_name": "AgendaManagementAgent", "instruction": "現在のアジェンダのメイントピックを「次期プロジェクトの計画」に変更してください"} ]`
+- 該当するエージェントがない場合:
+  `[]`"""),
+    ],
+    dynamic_sections=[
+        ("representative_mode", "{representative_mode_context}"),
+        ("session_data", SESSION_DATA_SECTION),
+        ("history", "会話履歴:\n{history}\n最新発言: {speaker_name}: {user_prompt}"),
+        ("closing", f"上記を踏まえ、会話履歴全体を考慮しつつ、特に最新の{LLM_TRIGGER_MESSAGE_COUNT}発言に注目して、呼び出すべきエージェントと指示をJSONリスト形式で出力してください。基本的には3つ以上のエージェントが関係する場合が多いはずです。:"),
+    ],
+)
+
+
+def convert_transcript_entry(entry_dict: Dict[str, Any]) -> LLMMessage:
+    """DBスキーマのトランスクリプトエントリをLLMMessageに変換する（発言者名を本文に含める）。"""
+    try:
+        text = entry_dict.get("text", "[内容なし]")
+        # userNameを優先し、なければuserIdを使用
+        speaker_name_for_llm = entry_dict.get(
+            "userName") or ""  # userNameがなければ空文字列
+
+        # roleフィールドに応じてLLMMessageのroleを決定
+        entry_role = (entry_dict.get("role") or "").lower()
+        if entry_role == "user":
+            llm_role = "user"
+        elif entry_role == "ai":
+            llm_role = "model"  # Vertex AI互換
+        else:
+            # roleが未設定またはunknownの場合はuserとして扱う（参加者の発言）
+            llm_role = "user"
+
+        if not speaker_name_for_llm:
+            logger.warning(
+                f"Transcript entry missing 'userName' field: {entry_dict}. Using empty string for speaker name.")
+
+        # 発言者名もメッセージに含める
+        return LLMMessage(role=llm_role, parts=[{"text": f"{speaker_name_for_llm}: {text}"}])
+    except Exception as e:
+        logger.error(
+            f"Error converting DB transcript entry to LLMMessage: {entry_dict}, Error: {e}", exc_info=True)
+        # エラー時はスキップするか、エラーを示すメッセージを追加するか
+        return LLMMessage(role="user", parts=[{"text": "[変換エラー]"}])
+
+
+@traced("secrets.llm_models")
+def select_llm_model_name(room_id: str) -> str:
+    """room_secrets/{room_id}/llm_models の先頭のモデルを使う。未設定なら既定のモデル。"""
+    llm_models_from_secrets = db.reference(
+        f"room_secrets/{room_id}/llm_models").get()
+
+    selected_llm_model_name = VERTEX_MODEL_NAME  # デフォルトモデル
+
+    if llm_models_from_secrets and isinstance(llm_models_from_secrets, list) and len(llm_models_from_secrets) > 0:
+        # 最初の利用可能なモデルを選択
+        selected_llm_model_name = llm_models_from_secrets[0]
+        logger.info(
+            f"Using LLM model from room_secrets: {selected_llm_model_name}")
+    else:
+        logger.info(
+            f"No specific LLM model found in room_secrets for room {room_id}. Using default: {selected_llm_model_name}")
+    return selected_llm_model_name
+
+
+@traced("orchestrate_agents")
 async def orchestrate_agents(task_payload: TaskPayload, background_tasks: BackgroundTasks, db_transcript_entries: List[Dict[str, Any]], llm_api_key: Optional[str] = None):
     logger.info(
         f"Orchestrating agents for task: {task_payload.taskId}, room: {task_payload.roomId}")
-
-    if not VERTEX_AI_AVAILABLE:
+    set_span_attributes(room_id=task_payload.roomId, task_id=task_payload.taskId,
+                        transcript_entries=len(db_transcript_entries))
+    timer = stage_timer("orchestrate", task_payload.roomId)
+    # プロンプトと応答の本文をログに出すかをここで決め、エージェントのLLM呼び出しにも引き継ぐ
+    sample_llm_logging()
+
+    # ルームのトークン予算に応じて縮退する（概要図エージェントの停止 → 安価なモデル → トリガー頻度の低下）
+    budget = evaluate_room_budget(task_payload.roomId)
+    publish_budget_state(task_payload.roomId, budget)
+    set_span_attributes(budget_tier=budget.tier_name)
+
+    if not VERTEX_AI_AVAILABLE and not USE_FAKE_LLM:
         raise HTTPException(
             status_code=503, detail="Vertex AI is not available.")
 
-    current_llm_model: Optional[GenerativeModel] = None
+    current_llm_model: Optional[LLMClient] = None
 
-    try:
-        from config import PROJECT_ID, REGION
-        if not PROJECT_ID or not REGION:
-            logger.error(
-                "PROJECT_ID or REGION not set in config. Cannot initialize Vertex AI.")
-            raise HTTPException(
-                status_code=503, detail="LLM service unavailable: Server configuration error (PROJECT_ID/REGION missing).")
-
-        # FirebaseからAPIキーを取得
-        retrieved_llm_api_key = None
+    if USE_FAKE_LLM:
+        # フェイクモデルはVertex AIの初期化とAPIキーを必要としない（モデル名の選択は同じ経路）
+        selected_llm_model_name = budget.model_for(select_llm_model_name(task_payload.roomId))
+        current_llm_model = LLMClient(FakeGenerativeModel(selected_llm_model_name),
+                                      selected_llm_model_name, "fake", room_id=task_payload.roomId)
+        logger.info(
+            f"Fake LLM model '{selected_llm_model_name}' instantiated.")
+    else:
         try:
-            retrieved_llm_api_key = api_key_manager.get_room_api_key(task_payload.roomId)
-        except Exception as e:
-            logger.error(f"Error retrieving API key: {e}", exc_info=True)
-            raise HTTPException(
-                status_code=503, detail=f"LLM service unavailable: Error retrieving API key: {str(e)}")
+            from config import PROJECT_ID, REGION
+            if not PROJECT_ID or not REGION:
+                logger.error(
+                    "PROJECT_ID or REGION not set in config. Cannot initialize Vertex AI.")
+                raise HTTPException(
+                    status_code=503, detail="LLM service unavailable: Server configuration error (PROJECT_ID/REGION missing).")
+
+            # FirebaseからAPIキーを取得
+            retrieved_llm_api_key = None
+            try:
+                with span("secrets.api_key", room_id=task_payload.roomId):
+                    retrieved_llm_api_key = api_key_manager.get_room_api_key(task_payload.roomId)
+            except Exception as e:
+                logger.error(f"Error retrieving API key: {e}", exc_info=True)
+                raise HTTPException(
+                    status_code=503, detail=f"LLM service unavailable: Error retrieving API key: {str(e)}")
         
-        # 環境変数からデフォルトのAPIキーを取得
-        default_api_key = os.environ.get('DEFAULT_VERTEX_API_KEY')
+            # 環境変数からデフォルトのAPIキーを取得
+            default_api_key = os.environ.get('DEFAULT_VERTEX_API_KEY')
         
-        # APIキーの優先順位: 1. Firebaseから取得したキー 2. 環境変数のデフォルトキー 3. 引数で渡されたキー
-        final_api_key = retrieved_llm_api_key or default_api_key or llm_api_key
+            # APIキーの優先順位: 1. Firebaseから取得したキー 2. 環境変数のデフォルトキー 3. 引数で渡されたキー
+            final_api_key = retrieved_llm_api_key or default_api_key or llm_api_key
         
-        if not final_api_key:
-            logger.error(f"No LLM API key found for room {task_payload.roomId}.")
-            raise HTTPException(
-                status_code=503, detail="LLM service unavailable: No API key available for this room.")
-
-        # Vertex AIを初期化
-        try:
-            vertexai.init(project=PROJECT_ID, location=REGION,
-                          api_key=final_api_key)
-            logger.info("Vertex AI initialized with API key.")
-        except ValueError as ve:
-            if "already been initialized" in str(ve):
-                logger.warning(
-                    "Vertex AI already initialized. Attempting to use existing initialization.")
-            else:
-                raise ve
-        except Exception as e:
-            logger.error(
-                f"Failed to initialize Vertex AI: {e}", exc_info=True)
-            # Check if the error is related to API key authentication
-            error_str = str(e).lower()
-            if any(keyword in error_str for keyword in ['api key', 'authentication', 'credentials', 'unauthorized', 'forbidden', 'invalid key']):
+            if not final_api_key:
+                logger.error(f"No LLM API key found for room {task_payload.roomId}.")
                 raise HTTPException(
-                    status_code=503, detail=f"LLM service unavailable: Invalid or expired Gemini API key. Please check your API key configuration.")
-            else:
-                raise HTTPException(
-                    status_code=503, detail=f"LLM service unavailable: Failed to initialize Vertex AI: {e}")
+                    status_code=503, detail="LLM service unavailable: No API key available for this room.")
 
-        # LLMモデルの選択ロジック
-        llm_models_from_secrets = db.reference(
-            f"room_secrets/{task_payload.roomId}/llm_models").get()
+            # Vertex AIを初期化
+            try:
+                vertexai.init(project=PROJECT_ID, location=REGION,
+                              api_key=final_api_key)
+                logger.info("Vertex AI initialized with API key.")
+            except ValueError as ve:
+                if "already been initialized" in str(ve):
+                    logger.warning(
+                        "Vertex AI already initialized. Attempting to use existing initialization.")
+                else:
+                    raise ve
+            except Exception as e:
+                logger.error(
+                    f"Failed to initialize Vertex AI: {e}", exc_info=True)
+                # Check if the error is related to API key authentication
+                error_str = str(e).lower()
+                if any(keyword in error_str for keyword in ['api key', 'authentication', 'credentials', 'unauthorized', 'forbidden', 'invalid key']):
+                    raise HTTPException(
+                        status_code=503, detail=f"LLM service unavailable: Invalid or expired Gemini API key. Please check your API key configuration.")
+                else:
+                    raise HTTPException(
+                        status_code=503, detail=f"LLM service unavailable: Failed to initialize Vertex AI: {e}")
 
-        selected_llm_model_name = VERTEX_MODEL_NAME  # デフォルトモデル
+            # LLMモデルの選択ロジック（予算の段階によっては安価なモデルに切り替える）
+            selected_llm_model_name = budget.model_for(select_llm_model_name(task_payload.roomId))
 
-        if llm_models_from_secrets and isinstance(llm_models_from_secrets, list) and len(llm_models_from_secrets) > 0:
-            # 最初の利用可能なモデルを選択
-            selected_llm_model_name = llm_models_from_secrets[0]
-            logger.info(
-                f"Using LLM model from room_secrets: {selected_llm_model_name}")
-        else:
-            logger.info(
-                f"No specific LLM model found in room_secrets for room {task_payload.roomId}. Using default: {selected_llm_model_name}")
+            # GenerativeModelをインスタンス化
+            try:
+                # 静的プレフィックスのコンテキストキャッシュは認証情報とモデルごとに分ける
+                current_llm_model = LLMClient(GenerativeModel(selected_llm_model_name),
+                                              selected_llm_model_name, credentials_scope(final_api_key),
+                                              room_id=task_payload.roomId)
+                logger.info(
+                    f"Vertex AI model '{selected_llm_model_name}' instantiated.")
+            except Exception as e:
+                logger.error(
+                    f"Failed to instantiate Vertex AI model: {e}", exc_info=True)
+                # Check if the error is related to API key authentication during model instantiation
+                error_str = str(e).lower()
+                if any(keyword in error_str for keyword in ['api key', 'authentication', 'credentials', 'unauthorized', 'forbidden', 'invalid key']):
+                    raise HTTPException(
+                        status_code=503, detail=f"LLM service unavailable: Invalid or expired Gemini API key. Please check your API key configuration.")
+                else:
+                    raise HTTPException(
+                        status_code=503, detail=f"LLM service unavailable: Failed to instantiate Vertex AI model '{selected_llm_model_name}': {e}")
 
-        # GenerativeModelをインスタンス化
-        try:
-            current_llm_model = GenerativeModel(selected_llm_model_name)
-            logger.info(
-                f"Vertex AI model '{selected_llm_model_name}' instantiated.")
         except Exception as e:
             logger.error(
-                f"Failed to instantiate Vertex AI model: {e}", exc_info=True)
-            # Check if the error is related to API key authentication during model instantiation
+                f"Failed to initialize or instantiate Vertex AI: {e}", exc_info=True)
+            # Check if the error is related to API key authentication
             error_str = str(e).lower()
             if any(keyword in error_str for keyword in ['api key', 'authentication', 'credentials', 'unauthorized', 'forbidden', 'invalid key']):
                 raise HTTPException(
                     status_code=503, detail=f"LLM service unavailable: Invalid or expired Gemini API key. Please check your API key configuration.")
             else:
                 raise HTTPException(
-                    status_code=503, detail=f"LLM service unavailable: Failed to instantiate Vertex AI model '{selected_llm_model_name}': {e}")
-
-    except Exception as e:
-        logger.error(
-            f"Failed to initialize or instantiate Vertex AI: {e}", exc_info=True)
-        # Check if the error is related to API key authentication
-        error_str = str(e).lower()
-        if any(keyword in error_str for keyword in ['api key', 'authentication', 'credentials', 'unauthorized', 'forbidden', 'invalid key']):
-            raise HTTPException(
-                status_code=503, detail=f"LLM service unavailable: Invalid or expired Gemini API key. Please check your API key configuration.")
-        else:
-            raise HTTPException(
-                status_code=503, detail=f"LLM service unavailable or failed to initialize: {e}")
-    finally:
-        pass
+                    status_code=503, detail=f"LLM service unavailable or failed to initialize: {e}")
+        finally:
+            pass
 
     if current_llm_model is None:
         raise HTTPException(
             status_code=503, detail="LLM service unavailable or failed to initialize.")
-
-    room_ref_path = f"rooms/{task_payload.roomId}"
+    # APIキーの取得・モデルの選択と初期化
+    timer.mark("model_setup")
 
     # DBから読み込んだ新スキーマのトランスクリプトをLLM用のLLMMessage形式に変換
-    llm_transcript_messages: List[LLMMessage] = []
-    for entry_dict in db_transcript_entries:
-        try:
-            # DBスキーマからLLMMessageへの変換ロジック
-            text = entry_dict.get("text", "[内容なし]")
-            # userNameを優先し、なければuserIdを使用
-            speaker_name_for_llm = entry_dict.get(
-                "userName") or ""  # userNameがなければ空文字列
-
-            # roleフィールドに応じてLLMMessageのroleを決定
-            entry_role = (entry_dict.get("role") or "").lower()
-            if entry_role == "user":
-                llm_role = "user"
-            elif entry_role == "ai":
-                llm_role = "model"  # Vertex AI互換
-            else:
-                # roleが未設定またはunknownの場合はuserとして扱う（参加者の発言）
-                llm_role = "user"
-
-            if not speaker_name_for_llm:
-                logger.warning(
-                    f"Transcript entry missing 'userName' field: {entry_dict}. Using empty string for speaker name.")
+    # 変換済みの位置はキャッシュされ、前回のトリガー以降に追加されたエントリだけを変換する
+    converted_transcript = room_history_cache.get(task_payload.roomId)
+    newly_converted = converted_transcript.sync(
+        db_transcript_entries, convert_transcript_entry)
+    logger.info(
+        f"[{task_payload.roomId}] Converted {newly_converted} new transcript entries ({len(converted_transcript)} cached).")
+    llm_transcript_messages: List[LLMMessage] = list(converted_transcript.messages)
+    timer.mark("transcript_convert")
 
-            llm_transcript_messages.append(
-                # 発言者名もメッセージに含める
-                LLMMessage(role=llm_role, parts=[{"text": f"{speaker_name_for_llm}: {text}"}]))
-        except Exception as e:
-            logger.error(
-                f"Error converting DB transcript entry to LLMMessage: {entry_dict}, Error: {e}", exc_info=True)
-            # エラー時はスキップするか、エラーを示すメッセージを追加するか
-            llm_transcript_messages.append(LLMMessage(
-                role="user", parts=[{"text": "[変換エラー]"}]))
-
-    session_data_for_llm_context = db.reference(room_ref_path).get() or {}
-    session_data_for_llm_context['transcript'] = [
-        msg.model_dump() for msg in llm_transcript_messages]
+    # トランスクリプトは下の会話履歴として渡す（rooms/{id} には含まれない）
+    session_data_for_llm_context = room_state_cache.get(task_payload.roomId) or {}
     session_data_json_str = json.dumps(
         session_data_for_llm_context, ensure_ascii=False, indent=2)
+    timer.mark("session_data")
 
-    history_parts = []
+    history_str = ""
     user_prompt = ""
 
     if llm_transcript_messages:
         if len(llm_transcript_messages) > 1:
-            for msg_model in llm_transcript_messages[:-1]:
-                part_text = msg_model.parts[0].get('text', '[content missing]')
-                history_parts.append(f"{msg_model.role}: {part_text}")
+            # 直近の発言ウィンドウと、最新の発言群に関連する過去の発言だけを履歴に含める
+            transcript_texts = converted_transcript.texts
+            recent_utterances_query = "\n".join(
+                transcript_texts[-LLM_TRIGGER_MESSAGE_COUNT:])
+            history_str = converted_transcript.history_str(select_history_positions(
+                task_payload.roomId, transcript_texts[:-1], recent_utterances_query))
         latest_msg_model = llm_transcript_messages[-1]
         user_prompt = latest_msg_model.parts[0].get(
             'text', '[empty user prompt]')
 
-    history_str = "\n".join(history_parts)
+    timer.mark("history_select")
     logger.info(
         f"Latest user prompt for dispatch: '{user_prompt}' by {task_payload.speakerName}")
-    logger.debug(f"History for LLM: \n{history_str}")
+    logger.debug("History for LLM: \n%s", history_str)
 
     available_agents = ["TaskManagementAgent", "NotesGeneratorAgent",
-                        "AgendaManagementAgent", "OverviewDiagramAgent"]
+                        "AgendaManagementAgent", "OverviewDiagramAgent", "ParticipantManagementAgent"]
     available_agents_str = ", ".join(available_agents)
 
     # Check if representative mode is enabled
     representative_mode = session_data_for_llm_context.get("representativeMode", False)
-    representative_mode_context = ""
-    if representative_mode:
-        representative_mode_context = """
-**重要: 代表参加者モードが有効です:**
-この会議では参加者は代表者として発言しており、個々の発言者の特定はできません。
-各エージェントに渡す指示では、発言者が特定できないことを考慮してください。
-"""
-
-    dispatch_prompt_template = f"""あなたは会議中の発言を解釈し、適切な専門エージェントを呼び出すAIオーケストレーターです。
-以下の指示に従って、呼び出すべきエージェントとその指示内容をJSON形式で応答してください。
-{representative_mode_context}
-
-利用可能な専門エージェントのリストとそれぞれの役割:
-- **TaskManagementAgent**: 会議中のタスク（TODO、進行中、完了）の追加、更新、削除、担当者や期限の設定など、タスクリストの管理を行います。
-- **NotesGeneratorAgent**: 会議中の重要なメモ、決定事項、課題などを記録・要約し、ノートリストを生成・更新します。
-- **AgendaManagementAgent**: 会議の主要議題や詳細、次に議論すべき推奨議題を管理・更新します。
-- **OverviewDiagramAgent**: 会議の内容やプロジェクトの構造を視覚的に表現するMermaid.jsの概要図を生成・更新します。
 
-応答形式の厳守のお願い:
-応答は必ず以下のJSON形式のリストとしてください。
-`[
-  {{"agent_name": "上記リストから選択したエージェント名", "instruction": "選択したエージェントへの具体的な指示内容（文字列）"}},
-  ...
-]`
-- `agent_name` には、必ず上記リスト内のエージェント名を指定してください。
-- `instruction` には、そのエージェントに実行させたい具体的な指示を、簡潔な日本語の文字列で記述してください。複雑な構造化データは含めないでください。
-- 複数のエージェントを呼び出す必要がある場合は、リスト内に複数のオブジェクトを含めてください。
-- 呼び出すべき適切なエージェントが存在しない場合は、空のリスト `[]` を返してください。
-
-具体例:
-- タスク管理エージェントに新しいタスクを登録する場合:
-  `[ {{"agent_name": "TaskManagementAgent", "instruction": "新しいタスク「API仕様書の作成」を登録してください"}} ]`
-- アジェンダ管理エージェントに現在のアジェンダを更新する場合:
-  `[ {{"agent_name": "AgendaManagementAgent", "instruction": "現在のアジェンダのメイントピックを「次期プロジェクトの計画」に変更してください"}} ]`
-- 該当するエージェントがない場合:
-  `[]`
-
-現在のセッションデータ:
-```json
-{session_data_json_str}
-```
-会話履歴:
-{history_str}
-最新発言: {task_payload.speakerName}: {user_prompt}
-
-上記を踏まえ、会話履歴全体を考慮しつつ、特に最新の{LLM_TRIGGER_MESSAGE_COUNT}発言に注目して、呼び出すべきエージェントと指示をJSONリスト形式で出力してください。基本的には3つ以上のエージェントが関係する場合が多いはずです。:"""
-
-    # プロンプトをログに出力
-    logger.info(f"Prompt sent to Orchestrator LLM:\n{dispatch_prompt_template}")
+    dispatch_prompt = DISPATCH_PROMPT.render(
+        representative_mode_context=DISPATCH_REPRESENTATIVE_MODE_CONTEXT if representative_mode else "",
+        session_data_json=session_data_json_str,
+        history=history_str,
+        speaker_name=task_payload.speakerName,
+        user_prompt=user_prompt)
+    timer.mark("dispatch_prompt")
 
-    llm_response = await current_llm_model.generate_content_async(dispatch_prompt_template)
+    llm_response = await current_llm_model.generate_content_async(dispatch_prompt)
+    timer.mark("dispatch_llm")
     # ... (LLM応答パースとエージェント起動のロジックは前回の修正を流用)
     llm_dispatch_decision_text = getattr(llm_response, 'text', "")
     if not llm_dispatch_decision_text and getattr(llm_response, 'candidates', None) and llm_response.candidates[0].content.parts:
         llm_dispatch_decision_text = llm_response.candidates[0].content.parts[0].text
-    # 生の応答テキストをログに出力
-    logger.info(
-        f"Raw Orchestrator LLM response text: {llm_dispatch_decision_text}")
 
     if llm_dispatch_decision_text.strip().startswith("```json"):
         llm_dispatch_decision_text = llm_dispatch_decision_text.strip()[
@@ -566,10 +735,19 @@ async def orchestrate_agents(task_payload: TaskPayload, background_tasks: Backgr
         logger.error(
             f"Failed to parse orchestrator LLM response: {llm_dispatch_decision_text}.")
         dispatch_actions = []
+    record_span_since_llm_response("orchestrator.parse", actions=len(dispatch_actions))
+    dropped_actions = [action for action in dispatch_actions
+                       if isinstance(action, dict) and budget.drops_agent(action.get("agent_name"))]
+    if dropped_actions:
+        logger.info(
+            f"[{task_payload.roomId}] Skipping {len(dropped_actions)} action(s) for the token budget tier '{budget.tier_name}'.")
+        dispatch_actions = [action for action in dispatch_actions if action not in dropped_actions]
+    timer.mark("dispatch_parse")
 
     all_agents_map = {
         "TaskManagementAgent": task_agent, "NotesGeneratorAgent": notes_agent,
         "AgendaManagementAgent": agenda_agent, "OverviewDiagramAgent": overview_diagram_agent,
+        "ParticipantManagementAgent": participant_agent,
     }
     results_from_agents = {}
     active_agent_names = []
@@ -614,22 +792,17 @@ async def orchestrate_agents(task_payload: TaskPayload, background_tasks: Backgr
     # すべてのエージェントタスクが完了するのを待つ
     if agent_tasks:
         await asyncio.gather(*agent_tasks)
+    timer.mark("agents")
 
     # エージェントへの指示をトランスクリプトに追記
-    # 安全にトランスクリプトを更新するため、最新のデータを取得して更新する
-    transcript_ref = db.reference(f"{room_ref_path}/transcript")
-    
-    # 最新のトランスクリプトを取得
-    current_transcript_list = transcript_ref.get()
-    if current_transcript_list is None or not isinstance(current_transcript_list, list):
-        current_transcript_list = []
 
     # エージェント名とアイコン・短縮名の対応関係
     agent_display_config = {
         "TaskManagementAgent": {"icon": "🗂️", "short_name": "Task"},
         "NotesGeneratorAgent": {"icon": "📝", "short_name": "Notes"},
         "AgendaManagementAgent": {"icon": "📋", "short_name": "Agenda"},
-        "OverviewDiagramAgent": {"icon": "🗺️", "short_name": "Diagram"}
+        "OverviewDiagramAgent": {"icon": "🗺️", "short_name": "Diagram"},
+        "ParticipantManagementAgent": {"icon": "👥", "short_name": "Participants"}
     }
     
     ai_messages_to_append = []
@@ -648,18 +821,17 @@ async def orchestrate_agents(task_payload: TaskPayload, background_tasks: Backgr
             userName="AI",  # AIの表示名
             timestamp=datetime.utcnow().isoformat() + "Z",
             role="ai"  # ロールを'ai'に設定
-        )
+        ).model_dump()
+        # このオーケストレーションのトレースを後から辿れるようにする（トレース無効時は付けない）
+        trace_id = current_trace_id()
+        if trace_id:
+            new_ai_entry["traceId"] = trace_id
         
-        # トランスクリプトの更新を試みる（競合状態を避けるため）
+        # トランザクションで追記し、処理中に届いたユーザー発言を上書きしないようにする
         try:
-            # 最新のトランスクリプトを再取得して更新
-            latest_transcript = transcript_ref.get() or []
-            if not isinstance(latest_transcript, list):
-                latest_transcript = []
-            
-            latest_transcript.append(new_ai_entry.model_dump())
-            transcript_ref.set(latest_transcript)
-            logger.info(f"Appended AI instructions to transcript. New length: {len(latest_transcript)}")
+            new_transcript_length = append_transcript_entries(
+                task_payload.roomId, [new_ai_entry])
+            logger.info(f"Appended AI instructions to transcript. New length: {new_transcript_length}")
             
             # AIメッセージの追加後にカウンターを更新しない（ユーザーメッセージのみをカウント対象とするため）
         except Exception as e:
@@ -667,9 +839,10 @@ async def orchestrate_agents(task_payload: TaskPayload, background_tasks: Backgr
             # エラーが発生しても処理を継続
     else:
         logger.info("No AI instructions to append to transcript.")
+    timer.mark("transcript_write")
 
     # 最新のroomデータを取得して返却用に利用
-    room_data_after_scheduling = db.reference(room_ref_path).get() or {}
+    room_data_after_scheduling = room_state_cache.get(task_payload.roomId) or {}
 
     final_result = AgentResult(
         invokedAgents=active_agent_names,
@@ -683,11 +856,184 @@ async def orchestrate_agents(task_payload: TaskPayload, background_tasks: Backgr
         updatedOverviewDiagram=room_data_after_scheduling.get(
             "overviewDiagram")
     )
+    timer.mark("result")
+    timer.finish()
     return final_result
 
 
+@traced("rtdb.transcript_append")
+def append_transcript_entries(room_id: str, entries: List[Dict[str, Any]]) -> int:
+    """
+    transcripts/{room_id} にエントリをまとめて追記する。追記後の件数を返す。
+    room_meta/{room_id} への1回のトランザクションで追記位置を確保し、同時に
+    user_message_count の加算と llm_pending_since（最初の未処理発言の時刻）の記録を行う。
+    既存のトランスクリプトはカウンターがまだないルームで1回だけ読むため、
+    会議が長くなっても追記のコストは変わらない。
+    """
+    set_span_attributes(room_id=room_id, entries=len(entries))
+    added_user_count = count_user_entries(entries)
+    pending_since = next((entry.get("timestamp") for entry in entries
+                          if entry.get("role") != "ai"), None)
+    existing_user_entries: List[Dict[str, Any]] = []
+    existing_counts: Dict[str, int] = {}
+
+    def _load_existing():
+        # カウンターのないルームは、追記前のトランスクリプトから件数を初期化する
+        if not existing_counts:
+            existing_transcript = read_transcript(room_id)
+            existing_user_entries.extend(entry for entry in existing_transcript
+                                         if isinstance(entry, dict) and entry.get("role") != "ai")
+            existing_counts["transcript_length"] = len(existing_transcript)
+            existing_counts["user_message_count"] = len(existing_user_entries)
+            logger.info(
+                f"[{room_id}] Initialized room_meta counters from transcript: {existing_counts}")
+
+    def _reserve(meta):
+        meta = meta if isinstance(meta, dict) else {}
+        for key in ("transcript_length", "user_message_count"):
+            if not isinstance(meta.get(key), int):
+                _load_existing()
+                meta[key] = existing_counts[key]
+        meta["transcript_length"] += len(entries)
+        if added_user_count:
+            processed_count = meta.get("last_llm_processed_message_count") or 0
+            if not meta.get("llm_pending_since") and len(existing_user_entries) > processed_count:
+                # 初期化したルームでは、既存の未処理発言のうち最初のものの時刻を使う
+                meta["llm_pending_since"] = existing_user_entries[processed_count].get("timestamp")
+            meta["user_message_count"] += added_user_count
+            meta["llm_pending_since"] = meta.get("llm_pending_since") or pending_since
+        return meta
+
+    updated_meta = db.reference(room_meta_path(room_id)).transaction(_reserve)
+    new_length = updated_meta["transcript_length"]
+    start_index = new_length - len(entries)
+    indexed_entries = {str(start_index + i): entry for i, entry in enumerate(entries)}
+    db.reference(transcript_path(room_id)).update(indexed_entries)
+
+    room_meta_cache.apply_local_write(room_id, "", updated_meta)
+    for index, entry in indexed_entries.items():
+        transcript_cache.apply_local_write(room_id, index, entry)
+    return new_length
+
+
+def read_transcript(room_id: str) -> List[Dict[str, Any]]:
+    """transcripts/{room_id} をリストとして読む（追記が途中で失敗した欠番は詰める）。"""
+    return transcript_as_list(transcript_cache.get(room_id))
+
+
+def read_user_message_count(room_id: str) -> int:
+    """user_message_count を読む。カウンターがないルームではトランスクリプトから1回だけ初期化する。"""
+    current_count = room_meta_cache.get_child(room_id, "user_message_count")
+    if isinstance(current_count, int):
+        return current_count
+    initial_count = count_user_entries(read_transcript(room_id))
+    # 同時に追記が走っても加算済みの値を上書きしないよう、未初期化の場合だけ書き込む
+    current_count = db.reference(f"{room_meta_path(room_id)}/user_message_count").transaction(
+        lambda value: value if isinstance(value, int) else initial_count)
+    room_meta_cache.apply_local_write(
+        room_id, "user_message_count", current_count)
+    logger.info(
+        f"[{room_id}] Initialized user_message_count from transcript: {current_count}")
+    return current_count
+
+
+def first_unprocessed_timestamp(room_id: str, processed_count: int) -> Optional[str]:
+    """processed_count 件目より後の最初のユーザー発言の時刻（未処理発言がなければ None）。"""
+    user_entries = [entry for entry in read_transcript(room_id)
+                    if isinstance(entry, dict) and entry.get("role") != "ai"]
+    if len(user_entries) <= processed_count:
+        return None
+    return user_entries[processed_count].get("timestamp")
+
+
+@traced("trigger")
+async def evaluate_llm_trigger(task_payload: TaskPayload, background_tasks: BackgroundTasks, request_id: str) -> JsonRpcResponse:
+    """
+    トリガーポリシーを評価し、条件を満たしていればエージェントのオーケストレーションを実行する。
+    判定には room_meta の2つのカウンターと処理中フラグだけを読み、トランスクリプトはトリガー時のみ取得する。
+    """
+    room_id = task_payload.roomId
+    timer = stage_timer("trigger", room_id)
+    # トークン予算の最後の段階では、より多くの発言をまとめてから処理する
+    trigger_count = trigger_message_count(room_id)
+    meta_ref = db.reference(room_meta_path(room_id))
+    current_user_message_count = read_user_message_count(room_id)
+    set_span_attributes(user_message_count=current_user_message_count)
+
+    last_processed_count = room_meta_cache.get_child(
+        room_id, "last_llm_processed_message_count") or 0
+    if last_processed_count > current_user_message_count:
+        last_processed_count = 0
+        meta_ref.child("last_llm_processed_message_count").set(0)
+        logger.warning(
+            f"[{room_id}] Reset last_llm_processed_message_count to 0.")
+
+    logger.info(
+        f"[{room_id}] Current user messages: {current_user_message_count}, Last processed: {last_processed_count}, Trigger: {trigger_count}")
+
+    if (current_user_message_count - last_processed_count) < trigger_count:
+        timer.mark("read_counters")
+        record_trigger_decision(room_id, "below_threshold")
+        set_span_attributes(room_id=room_id, decision="below_threshold")
+        return JsonRpcResponse(result=AgentResult(invokedAgents=[]), id=request_id)
+
+    # 処理中フラグをチェック
+    is_processing = meta_ref.child("is_llm_processing").get() or False
+    timer.mark("read_counters")
+    if is_processing:
+        logger.info(f"[{room_id}] LLM processing already in progress. Skipping.")
+        record_trigger_decision(room_id, "already_processing")
+        set_span_attributes(room_id=room_id, decision="already_processing")
+        return JsonRpcResponse(result=AgentResult(invokedAgents=[]), id=request_id)
+
+    logger.info(f"[{room_id}] Triggering LLM processing.")
+
+    # 処理中フラグを設定
+    meta_ref.child("is_llm_processing").set(True)
+
+    try:
+        timer.mark("set_processing_flag")
+        db_transcript_entries = read_transcript(room_id)  # これは新スキーマの辞書のリスト
+        timer.mark("read_transcript")
+
+        # llmApiKeyを渡す
+        agent_processing_result = await orchestrate_agents(task_payload, background_tasks, db_transcript_entries, task_payload.llmApiKey)
+        timer.mark("orchestrate")
+
+        # 処理完了後にカウンターを更新
+        meta_ref.child("last_llm_processed_message_count").set(current_user_message_count)
+        room_meta_cache.apply_local_write(
+            room_id, "last_llm_processed_message_count", current_user_message_count)
+        # 処理中に新しい発言が届いていなければ未処理マーカーを消し、届いていれば最初の未処理発言の時刻に戻す
+        if read_user_message_count(room_id) <= current_user_message_count:
+            meta_ref.child("llm_pending_since").delete()
+        else:
+            meta_ref.child("llm_pending_since").set(
+                first_unprocessed_timestamp(room_id, current_user_message_count)
+                or datetime.utcnow().isoformat() + "Z")
+
+        # 処理中フラグをクリア
+        meta_ref.child("is_llm_processing").set(False)
+        timer.mark("update_counters")
+        timer.finish()
+        record_trigger_decision(room_id, "triggered")
+        set_span_attributes(room_id=room_id, decision="triggered")
+
+        return JsonRpcResponse(result=agent_processing_result, id=request_id)
+    except Exception as e:
+        # エラーが発生した場合、ログに記録し、クライアントにエラーを返す
+        logger.error(f"[{room_id}] Error in orchestrate_agents: {e}", exc_info=True)
+
+        # 処理中フラグをクリア
+        meta_ref.child("is_llm_processing").set(False)
+        record_trigger_decision(room_id, "error")
+        set_span_attributes(room_id=room_id, decision="error")
+
+        return JsonRpcResponse(error={"code": -32000, "message": f"LLM processing error: {str(e)}"}, id=request_id)
+
+
 @app.post("/invoke", response_model=JsonRpcResponse, summary="Invoke AIMeeBo Agent")
-async def invoke_agent(request: JsonRpcRequest, background_tasks: BackgroundTasks):
+async def invoke_agent(request: JsonRpcRequest, background_tasks: BackgroundTasks, http_request: Request):
     if request.method != "ExecuteTask":
         return JsonRpcResponse(error={"code": -32601, "message": "Method not found"}, id=request.id)
 
@@ -702,21 +1048,69 @@ async def invoke_agent(request: JsonRpcRequest, background_tasks: BackgroundTask
     if not room_id:
         return JsonRpcResponse(error={"code": -32602, "message": "Invalid params: 'roomId' missing"}, id=request.id)
 
+    # クライアントの再送（同じ taskId）は、処理中または完了済みの結果を共有して二重の追記・LLM処理を防ぐ
+    timer = stage_timer("invoke", room_id)
+    with request_span("POST /invoke", http_request.headers, room_id=room_id, task_id=task_payload.taskId):
+        response = await run_idempotent(
+            "invoke", room_id, task_payload.taskId, request.id,
+            lambda progress: process_invoke(task_payload, background_tasks, request.id, progress))
+        set_span_attributes(invoked_agents=len(response.result.invokedAgents) if response.result else 0,
+                            error=bool(response.error))
+    timer.finish()
+    record_request("invoke", room_id, response)
+    return response
+
+
+class InvokeProgress:
+    """/invoke・/invoke_batch の処理がどこまで進んだか（再送時にやり直してよいかの判定に使う）。"""
+
+    def __init__(self):
+        self.appended = False  # トランスクリプトへの追記が済んだか
+
+
+async def run_idempotent(endpoint: str, room_id: str, task_id: Optional[str], request_id: Any, process) -> JsonRpcResponse:
+    """
+    同じ (エンドポイント, ルーム, taskId) の処理を1回だけ実行し、重複リクエストには同じ結果を返す。
+    process は InvokeProgress を受け取り、トランスクリプトへの追記が済んだら appended を立てる。
+    """
+    progress = InvokeProgress()
+    if not task_id:
+        return await process(progress)
+    # 追記より前で失敗したエラーの応答（RTDBの一時的な障害など）だけは保持せず、再送時にもう一度処理する。
+    # 追記後のエラー（オーケストレーションの失敗など）は保持し、再送で発言が二重に追記されないようにする
+    response, duplicate = await invoke_idempotency.run(
+        (endpoint, room_id, task_id), lambda: process(progress),
+        retain=lambda result: result.error is None or progress.appended)
+    if duplicate:
+        logger.info(
+            f"[{room_id}] Duplicate /{endpoint} request for taskId {task_id}. Returning the shared result.")
+        return response.model_copy(update={"id": request_id})
+    return response
+
+
+async def process_invoke(task_payload: TaskPayload, background_tasks: BackgroundTasks, request_id: Any,
+                         progress: Optional[InvokeProgress] = None) -> JsonRpcResponse:
+    room_id = task_payload.roomId
+    timer = stage_timer("invoke", room_id)
     try:
-        room_ref = db.reference(f"rooms/{room_id}")
-        transcript_ref = room_ref.child("transcript")
+        room_ref = db.reference(room_path(room_id))
 
-        if task_payload.messages and len(task_payload.messages) == 1:
+        if task_payload.messages:
+            if len(task_payload.messages) > 1:
+                logger.warning(
+                    f"[{room_id}] task_payload.messages contained {len(task_payload.messages)} messages, expected 1. Processing only the first one. Use /invoke_batch for multiple messages.")
             latest_llm_message = task_payload.messages[0]  # LLMMessage形式
             if latest_llm_message.parts:  # partsがあることを確認
                 text_to_save = latest_llm_message.parts[0].get(
                     'text', '[内容なし]')
 
                 # Firebaseから参加者情報を取得し、displayNameを優先的に使用
-                participant_info = room_ref.child(
-                    f"participants/{task_payload.speakerId}").get()
-                resolved_speaker_name = participant_info.get(
-                    "name") if participant_info else task_payload.speakerName
+                participant_info = room_state_cache.get_child(
+                    room_id, f"participants/{task_payload.speakerId}")
+                # 明示的な役割宣言の反映 (LLM呼び出しなし)。speakerId は検証されていないため自動登録はしない
+                resolved_speaker_name, _ = apply_participant_fast_path(
+                    room_ref, task_payload.speakerId, task_payload.speakerName, participant_info, text_to_save)
+                timer.mark("participant_fast_path")
 
                 new_db_entry = DBTranscriptEntry(
                     text=text_to_save,
@@ -725,111 +1119,311 @@ async def invoke_agent(request: JsonRpcRequest, background_tasks: BackgroundTask
                     timestamp=datetime.utcnow().isoformat() + "Z",
                     role="user"  # ユーザーの発言として明示的に設定
                 )
-                new_db_entry_dict = new_db_entry.model_dump()
-
-                current_transcript_list = transcript_ref.get()
-                if current_transcript_list is None or not isinstance(current_transcript_list, list):
-                    current_transcript_list = []
-                current_transcript_list.append(new_db_entry_dict)
-                transcript_ref.set(current_transcript_list)
+                new_transcript_length = append_transcript_entries(
+                    room_id, [new_db_entry.model_dump()])
+                if progress is not None:
+                    progress.appended = True
+                timer.mark("transcript_append")
                 logger.info(
-                    f"[{room_id}] Appended new message to transcript (DB schema). New length: {len(current_transcript_list)}")
+                    f"[{room_id}] Appended new message to transcript (DB schema). New length: {new_transcript_length}")
             else:  # partsがない場合 (通常ありえないが念のため)
                 logger.warning(
                     f"[{room_id}] Received message with no parts: {latest_llm_message}. Skipping transcript append.")
 
-        elif task_payload.messages:
-            logger.warning(
-                f"[{room_id}] task_payload.messages contained {len(task_payload.messages)} messages, expected 1. Processing only the first one.")
-            # (上記と同様の処理を最初のメッセージに対して行う)
-            latest_llm_message = task_payload.messages[0]
-            if latest_llm_message.parts:
-                text_to_save = latest_llm_message.parts[0].get(
-                    'text', '[内容なし]')
-                # Firebaseから参加者情報を取得し、displayNameを優先的に使用
-                participant_info = room_ref.child(
-                    f"participants/{task_payload.speakerId}").get()
-                resolved_speaker_name = participant_info.get(
-                    "name") if participant_info else task_payload.speakerName
-
-                new_db_entry = DBTranscriptEntry(
-                    text=text_to_save,
-                    userId=task_payload.speakerId,
-                    userName=resolved_speaker_name,
-                    timestamp=datetime.utcnow().isoformat() + "Z",
-                    role="user"  # ユーザーの発言として明示的に設定
-                )
-                # ... (追記処理)
-
         # デモルームの場合はここで処理を終了
         if room_id == ALLOWED_DEMO_ROOM:
             logger.info(
                 f"[{room_id}] Demo room message. Skipping AI processing.")
-            return JsonRpcResponse(result=AgentResult(invokedAgents=[]), id=request.id)
+            return JsonRpcResponse(result=AgentResult(invokedAgents=[]), id=request_id)
 
-        room_data = room_ref.get()
-        if room_data is None:
-            return JsonRpcResponse(error={"code": -32000, "message": f"Server error: Room {room_id} disappeared"}, id=request.id)
+        timer.skip()
+        response = await evaluate_llm_trigger(task_payload, background_tasks, request_id)
+        timer.mark("trigger")
+        return response
 
-        db_transcript_entries = room_data.get(
-            "transcript", [])  # これは新スキーマの辞書のリスト
-        
-        # ユーザーメッセージのみをカウント（AIメッセージを除外）
-        user_messages = [entry for entry in db_transcript_entries if entry.get("role") != "ai"]
-        current_user_message_count = len(user_messages)
-
-        last_processed_count = room_data.get(
-            "last_llm_processed_message_count", 0)
-        if last_processed_count > current_user_message_count:
-            last_processed_count = 0
-            room_ref.child("last_llm_processed_message_count").set(0)
-            logger.warning(
-                f"[{room_id}] Reset last_llm_processed_message_count to 0.")
+    except Exception as e:
+        logger.error(f"Error in /invoke: {e}", exc_info=True)
+        return JsonRpcResponse(error={"code": -32000, "message": f"Server error: {e}"}, id=request_id)
 
+
+class BatchInvokeRequest(BaseModel):
+    taskId: str
+    roomId: str
+    messages: List[DBTranscriptEntry]  # 音声認識のバーストなど、複数話者の発言をまとめて送信
+    llmApiKey: Optional[str] = None
+
+
+@app.post("/invoke_batch", response_model=JsonRpcResponse, summary="Append a burst of messages and evaluate the trigger once")
+async def invoke_batch_endpoint(request_data: BatchInvokeRequest, background_tasks: BackgroundTasks, http_request: Request):
+    room_id = request_data.roomId
+    if not request_data.messages:
+        return JsonRpcResponse(error={"code": -32602, "message": "Invalid params: 'messages' is empty"}, id=request_data.taskId)
+
+    timer = stage_timer("invoke_batch", room_id)
+    with request_span("POST /invoke_batch", http_request.headers, room_id=room_id, task_id=request_data.taskId,
+                      messages=len(request_data.messages)):
+        response = await run_idempotent(
+            "invoke_batch", room_id, request_data.taskId, request_data.taskId,
+            lambda progress: process_invoke_batch(request_data, background_tasks, progress))
+        set_span_attributes(invoked_agents=len(response.result.invokedAgents) if response.result else 0,
+                            error=bool(response.error))
+    timer.finish()
+    record_request("invoke_batch", room_id, response)
+    return response
+
+
+async def process_invoke_batch(request_data: BatchInvokeRequest, background_tasks: BackgroundTasks,
+                               progress: Optional[InvokeProgress] = None) -> JsonRpcResponse:
+    room_id = request_data.roomId
+    timer = stage_timer("invoke_batch", room_id)
+    try:
+        room_ref = db.reference(room_path(room_id))
+        # 参加者一覧は1回だけ読み、発言者ごとの参加者情報の取得を省く
+        participants = room_state_cache.get_child(room_id, "participants") or {}
+
+        new_entries = []
+        resolved_names: Dict[str, Optional[str]] = {}
+        for message in request_data.messages:
+            speaker_id = message.userId
+            if message.role and message.role != "user":
+                # AIの発言はサーバーだけが書き込む。クライアントが指定したロールは使わない
+                logger.warning(
+                    f"[{room_id}] Ignoring role '{message.role}' in /invoke_batch message from {speaker_id}. Storing it as a user message.")
+            resolved_name, participant_info = apply_participant_fast_path(
+                room_ref, speaker_id, message.userName, participants.get(speaker_id), message.text)
+            # 同じバッチ内の後続の発言でも役割の更新を踏まえるよう、ローカルの一覧にも反映する
+            if participant_info:
+                participants[speaker_id] = participant_info
+            resolved_names[speaker_id] = resolved_name
+            new_entries.append(DBTranscriptEntry(
+                text=message.text,
+                userId=speaker_id,
+                userName=resolved_name,
+                timestamp=datetime.utcnow().isoformat() + "Z",  # /invoke と同じくサーバーの時刻を使う
+                role="user"
+            ).model_dump())
+
+        timer.mark("participant_fast_path")
+        new_transcript_length = append_transcript_entries(room_id, new_entries)
+        if progress is not None:
+            progress.appended = True
+        timer.mark("transcript_append")
         logger.info(
-            f"[{room_id}] Current user messages: {current_user_message_count}, Last processed: {last_processed_count}, Trigger: {LLM_TRIGGER_MESSAGE_COUNT}")
+            f"[{room_id}] Appended {len(new_entries)} messages in one batch. New length: {new_transcript_length}")
 
-        # 処理中フラグをチェック
-        is_processing = room_data.get("is_llm_processing", False)
-        if is_processing:
-            logger.info(f"[{room_id}] LLM processing already in progress. Skipping.")
-            return JsonRpcResponse(result=AgentResult(invokedAgents=[]), id=request.id)
+        if room_id == ALLOWED_DEMO_ROOM:
+            logger.info(
+                f"[{room_id}] Demo room batch. Skipping AI processing.")
+            return JsonRpcResponse(result=AgentResult(invokedAgents=[]), id=request_data.taskId)
+
+        # トリガーポリシーはバッチ全体に対して1回だけ評価する
+        last_message = request_data.messages[-1]
+        task_payload = TaskPayload(
+            taskId=request_data.taskId,
+            messages=[],
+            roomId=room_id,
+            speakerId=last_message.userId,
+            speakerName=resolved_names.get(last_message.userId) or last_message.userName,
+            llmApiKey=request_data.llmApiKey
+        )
+        timer.skip()
+        response = await evaluate_llm_trigger(task_payload, background_tasks, request_data.taskId)
+        timer.mark("trigger")
+        return response
 
-        if (current_user_message_count - last_processed_count) >= LLM_TRIGGER_MESSAGE_COUNT:
-            logger.info(f"[{room_id}] Triggering LLM processing.")
-            
-            # 処理中フラグを設定
-            room_ref.child("is_llm_processing").set(True)
-            
+    except Exception as e:
+        logger.error(f"Error in /invoke_batch: {e}", exc_info=True)
+        return JsonRpcResponse(error={"code": -32000, "message": f"Server error: {e}"}, id=request_data.taskId)
+
+@app.websocket("/ws/transcript/{room_id}")
+async def transcript_stream_endpoint(websocket: WebSocket, room_id: str):
+    """
+    音声認識結果のストリーミング受信。接続ごとに1回だけ認証し、途中結果/確定結果を
+    utteranceId 単位でバッファして、確定した発言をマイクロバッチでトランスクリプトに追記する。
+
+    クライアント → サーバー:
+      {"type": "auth", "idToken": "...", "speakerName": "...", "llmApiKey": "..."}  (最初の1回)
+      {"type": "utterance", "utteranceId": "...", "text": "...", "isFinal": true}
+      {"type": "flush"} / {"type": "ping"}
+    サーバー → クライアント:
+      {"type": "ready"} / {"type": "ack", ...} / {"type": "result", ...} / {"type": "pong"} / {"type": "error", ...}
+    """
+    await websocket.accept()
+    send_lock = asyncio.Lock()
+
+    async def send(payload: Dict[str, Any]):
+        try:
+            async with send_lock:
+                await websocket.send_json(payload)
+        except Exception:
+            pass  # 切断済みの場合は送信しない
+
+    try:
+        auth_frame = await asyncio.wait_for(websocket.receive_json(), timeout=10)
+        if auth_frame.get("type") != "auth" or not auth_frame.get("idToken"):
+            raise ValueError("first frame must be an auth frame")
+        with request_span("WS /ws/transcript auth", websocket.headers, room_id=room_id), span("auth"):
+            uid = firebase_auth.verify_id_token(auth_frame["idToken"])["uid"]
+    except WebSocketDisconnect:
+        return
+    except Exception as e:
+        logger.warning(f"[{room_id}] Transcript stream authentication failed: {e}")
+        await websocket.close(code=4401)
+        return
+
+    room_ref = db.reference(room_path(room_id))
+    participant_info = room_state_cache.get_child(room_id, f"participants/{uid}")
+    if participant_info is None and room_id != ALLOWED_DEMO_ROOM:
+        logger.warning(f"[{room_id}] Transcript stream rejected: {uid} is not a participant.")
+        await websocket.close(code=4403)
+        return
+
+    speaker_name = auth_frame.get("speakerName") or "Unknown Speaker"
+    llm_api_key = auth_frame.get("llmApiKey")
+    buffer = TranscriptStreamBuffer()
+    trigger_task: Optional[asyncio.Task] = None
+    logger.info(f"[{room_id}] Transcript stream opened for {uid}.")
+    await send({"type": "ready"})
+
+    async def run_trigger(task_id: str, resolved_name: Optional[str]):
+        task_payload = TaskPayload(
+            taskId=task_id, messages=[], roomId=room_id, speakerId=uid,
+            speakerName=resolved_name, llmApiKey=llm_api_key)
+        try:
+            response = await evaluate_llm_trigger(task_payload, BackgroundTasks(), task_id)
+        except Exception as e:
+            logger.error(f"[{room_id}] Error evaluating trigger for stream: {e}", exc_info=True)
+            return
+        if response.error or (response.result and response.result.invokedAgents):
+            await send({"type": "result", **response.model_dump(exclude_none=True)})
+
+    async def flush(utterances: List[Dict[str, Any]]):
+        if not utterances:
+            return
+        # フラッシュ1回分（追記とそれに続くトリガー評価）を1つのトレースにする
+        with request_span("WS /ws/transcript flush", room_id=room_id, utterances=len(utterances)):
+            await flush_utterances(utterances)
+
+    async def flush_utterances(utterances: List[Dict[str, Any]]):
+        nonlocal participant_info, trigger_task
+        new_entries = []
+        resolved_name = speaker_name
+        # /invoke・/invoke_batch と同じく、保存する時刻はクライアント申告ではなくサーバーの時刻
+        timestamp = datetime.utcnow().isoformat() + "Z"
+        for utterance in utterances:
+            resolved_name, participant_info = apply_participant_fast_path(
+                room_ref, uid, speaker_name, participant_info, utterance["text"])
+            new_entries.append(DBTranscriptEntry(
+                text=utterance["text"],
+                userId=uid,
+                userName=resolved_name,
+                timestamp=timestamp,
+                role="user"
+            ).model_dump())
+        new_transcript_length = append_transcript_entries(room_id, new_entries)
+        logger.info(
+            f"[{room_id}] Appended {len(new_entries)} streamed messages. New length: {new_transcript_length}")
+        await send({"type": "ack", "utteranceIds": [u["utteranceId"] for u in utterances],
+                    "transcriptLength": new_transcript_length})
+
+        # トリガー評価中に届いた発言は次のフラッシュで評価する（is_llm_processingフラグでも二重起動は防がれる）
+        if room_id != ALLOWED_DEMO_ROOM and (trigger_task is None or trigger_task.done()):
+            trigger_task = asyncio.create_task(
+                run_trigger(f"ws_{utterances[-1]['utteranceId']}", resolved_name))
+
+    try:
+        while True:
+            timeout = buffer.seconds_until_flush()
             try:
-                # llmApiKeyを渡す
-                agent_processing_result = await orchestrate_agents(task_payload, background_tasks, db_transcript_entries, task_payload.llmApiKey)
-                
-                # 処理完了後にカウンターを更新
-                room_ref.child("last_llm_processed_message_count").set(current_user_message_count)
-                
-                # 処理中フラグをクリア
-                room_ref.child("is_llm_processing").set(False)
-                
-                return JsonRpcResponse(result=agent_processing_result, id=request.id)
-            except Exception as e:
-                # エラーが発生した場合、ログに記録し、クライアントにエラーを返す
-                logger.error(f"[{room_id}] Error in orchestrate_agents: {e}", exc_info=True)
-                
-                # 処理中フラグをクリア
-                room_ref.child("is_llm_processing").set(False)
-                
-                return JsonRpcResponse(error={"code": -32000, "message": f"LLM processing error: {str(e)}"}, id=request.id)
-        else:
-            return JsonRpcResponse(result=AgentResult(invokedAgents=[]), id=request.id)
+                frame = await asyncio.wait_for(websocket.receive_json(), timeout=timeout)
+            except asyncio.TimeoutError:
+                frame = None
+            except ValueError:
+                await send({"type": "error", "message": "Invalid JSON frame"})
+                continue
+            if frame is not None and not isinstance(frame, dict):
+                await send({"type": "error", "message": "Invalid frame: expected a JSON object"})
+                continue
+
+            if frame is not None:
+                frame_type = frame.get("type")
+                if frame_type == "utterance":
+                    buffer.add(str(frame.get("utteranceId") or ""), frame.get("text", ""),
+                               bool(frame.get("isFinal")))
+                elif frame_type == "flush":
+                    await flush(buffer.drain())
+                elif frame_type == "ping":
+                    await send({"type": "pong"})
+                else:
+                    await send({"type": "error", "message": f"Unknown frame type: {frame_type}"})
 
+            if buffer.should_flush():
+                await flush(buffer.drain())
+    except WebSocketDisconnect:
+        logger.info(f"[{room_id}] Transcript stream closed for {uid}.")
     except Exception as e:
-        logger.error(f"Error in /invoke: {e}", exc_info=True)
-        return JsonRpcResponse(error={"code": -32000, "message": f"Server error: {e}"}, id=request.id)
+        logger.error(f"[{room_id}] Error in transcript stream: {e}", exc_info=True)
+    finally:
+        try:
+            await flush(buffer.drain_all())
+        except Exception as e:
+            logger.error(f"[{room_id}] Failed to flush transcript stream on close: {e}", exc_info=True)
+        # 実行中のオーケストレーションは処理中フラグを解除させるため、キャンセルせず完了を待つ
+        if trigger_task is not None and not trigger_task.done():
+            await trigger_task
 
 # ... (create_room_endpoint は変更なし)
 
 
+@app.get("/room_cache_stats", summary="Hit/miss metrics of the in-process room state cache and skipped section writes")
+async def room_cache_stats_endpoint():
+    stats = {cache.root: cache.stats() for cache in (room_state_cache, transcript_cache, room_meta_cache)}
+    stats["sectionWrites"] = section_write_stats.stats()
+    if USE_MEMORY_RTDB:
+        stats["rtdb"] = db.stats()
+    return stats
+
+
+@app.get("/llm_cache_stats", summary="Metrics of the prompt context cache and the agent response cache")
+async def llm_cache_stats_endpoint():
+    stats = {"contextCache": context_cache_manager.stats(), "responseCache": agent_response_cache.stats()}
+    if USE_FAKE_LLM:
+        stats["fakeLlm"] = fake_llm_stats.stats()
+    return stats
+
+
+@app.get("/metrics", summary="Prometheus metrics (per-stage latency histograms, agent/LLM/RTDB counters)")
+async def metrics_endpoint():
+    if not PROMETHEUS_AVAILABLE:
+        raise HTTPException(
+            status_code=503, detail="Metrics are disabled or prometheus_client is not installed.")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/token_usage", summary="LLM token usage and estimated cost of this process, by agent, model and top rooms")
+async def token_usage_endpoint(top: int = 20):
+    return token_usage.report(top)
+
+
+@app.get("/token_usage/{room_id}", summary="Cumulative LLM token usage and estimated cost of a room by agent and model")
+async def room_token_usage_endpoint(room_id: str):
+    return await asyncio.to_thread(token_usage.room_report, room_id)
+
+
+@app.on_event("startup")
+async def start_token_usage_flush():
+    token_usage.start()
+
+
+@app.on_event("shutdown")
+def close_room_cache_listeners():
+    for cache in (room_state_cache, transcript_cache, room_meta_cache):
+        cache.close_all()
+    token_usage.stop()
+    shutdown_tracing()
+
+
 class CreateRoomRequest(BaseModel):
     idToken: str
     room_id: str
@@ -840,6 +1434,8 @@ class CreateRoomRequest(BaseModel):
     speakerName: Optional[str] = None  # speakerNameを追加
     representativeMode: Optional[bool] = False  # 代表参加者モード
     api_key_duration_hours: Optional[int] = 24  # APIキーの持続時間（時間）
+    token_budget_per_hour: Optional[int] = None  # トークン予算（1時間あたり、0は無制限、未指定はサーバーの既定）
+    token_budget_per_meeting: Optional[int] = None  # トークン予算（会議全体）
     
     @field_validator('api_key_duration_hours')
     @classmethod
@@ -869,7 +1465,7 @@ async def create_room_endpoint(request_data: CreateRoomRequest):
         # speakerNameが提供されていればそれを使用、なければ既存のロジック
         display_name = request_data.speakerName or user_record.display_name or user_record.email or f"user_{uid[:5]}"
 
-        room_ref = db.reference(f"rooms/{room_id}")
+        room_ref = db.reference(room_path(room_id))
         if room_ref.get():
             # ルームが既に存在する場合、作成者がそのルームの参加者として追加されているか確認
             if room_ref.child(f"participants/{uid}").get():
@@ -885,7 +1481,7 @@ async def create_room_endpoint(request_data: CreateRoomRequest):
         meeting_subtitle = request_data.meeting_subtitle or ""
 
         # Firebase Realtime Databaseからtemplateルームのデータを読み込む
-        template_room_ref = db.reference("rooms/template")
+        template_room_ref = db.reference(room_path("template"))
         template_room_data = template_room_ref.get()
 
         if not template_room_data:
@@ -905,11 +1501,9 @@ async def create_room_endpoint(request_data: CreateRoomRequest):
                 "overviewDiagram": {"title": "会議の概要図", "mermaidDefinition": "graph TD;\nA[会議開始];"},
                 "currentAgenda": {"mainTopic": "会議開始", "details": []},
                 "suggestedNextTopics": [],
-                "transcript": [],
-                "last_llm_processed_message_count": 0,
-                "is_llm_processing": False,
                 "representativeMode": request_data.representativeMode or False
             }
+            initial_transcript = []
         else:
             # テンプレートデータをコピーし、新しいルームの情報を設定
             new_room_data = template_room_data.copy()
@@ -920,8 +1514,11 @@ async def create_room_endpoint(request_data: CreateRoomRequest):
             new_room_data["ownerId"] = uid
             # テンプレートの参加者リストは引き継がず、作成者のみを追加
             new_room_data["participants"] = {}
-            new_room_data["last_llm_processed_message_count"] = 0
-            new_room_data["is_llm_processing"] = False
+            # トランスクリプトとカウンター類は transcripts/{id}・room_meta/{id} に分けて保存する
+            initial_transcript = transcript_as_list(
+                new_room_data.pop("transcript", None))
+            for meta_key in ROOM_META_KEYS:
+                new_room_data.pop(meta_key, None)
             new_room_data["representativeMode"] = request_data.representativeMode or False
 
         # 作成者を参加者として追加
@@ -933,6 +1530,14 @@ async def create_room_endpoint(request_data: CreateRoomRequest):
         }
 
         room_ref.set(new_room_data)
+        db.reference(room_meta_path(room_id)).set({
+            "transcript_length": len(initial_transcript),
+            "user_message_count": count_user_entries(initial_transcript),
+            "last_llm_processed_message_count": 0,
+            "is_llm_processing": False
+        })
+        if initial_transcript:
+            db.reference(transcript_path(room_id)).set(initial_transcript)
 
         # room_secretsにAPIキーとLLMモデルを保存
         room_secrets_ref = db.reference(f"room_secrets/{room_id}")
@@ -967,6 +1572,13 @@ async def create_room_endpoint(request_data: CreateRoomRequest):
         else:
             logger.info(f"Room {room_id} created without specific LLM models.")
 
+        token_budget = {key: value for key, value in (
+            ("perHour", request_data.token_budget_per_hour),
+            ("perMeeting", request_data.token_budget_per_meeting)) if value is not None}
+        if token_budget:
+            room_secrets_ref.update({'token_budget': token_budget})
+            logger.info(f"Room {room_id} created with token budget {token_budget}.")
+
         return {"status": "success", "message": "Room created successfully", "data": new_room_data}
     except Exception as e:
         logger.error(f"Error creating room {room_id}: {e}", exc_info=True)
@@ -987,7 +1599,7 @@ async def approve_join_request_endpoint(request_data: ApproveJoinRequest):
         decoded_token = firebase_auth.verify_id_token(request_data.idToken)
         owner_uid = decoded_token['uid']
 
-        room_ref = db.reference(f"rooms/{request_data.roomId}")
+        room_ref = db.reference(room_path(request_data.roomId))
         room_data = room_ref.get()
 
         if not room_data:
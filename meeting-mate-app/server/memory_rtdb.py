@@ -0,0 +1,480 @@
+"""
+Firebase Realtime Database のプロセス内（インメモリ）実装。
+
+firebase_admin.db の Reference / Query / listen と同じ呼び出し方ができ、
+RTDB_BACKEND=memory のときに rtdb.py から使われる（Firebaseプロジェクトのないオフライン環境・負荷試験用）。
+保存形式は RTDB に合わせ、None・空のオブジェクトは保存せず、配列は連番キーのオブジェクトとして持ち、
+読み出し時に RTDB と同じ規則で配列に戻す。
+操作ごとに遅延（ミリ秒）を設定でき、リスナーへのイベントも別スレッドから同じ遅延で届く。
+"""
+import copy
+import hashlib
+import json
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import logger
+
+# 遅延を個別に設定できる操作
+OPERATIONS = ("get", "set", "update", "push", "delete", "transaction", "query", "event")
+
+_INVALID_KEY_CHARS = set(".$#[]")
+_PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+
+def parse_latency_overrides(spec: Optional[str]) -> Dict[str, float]:
+    """"get=5,transaction=40" 形式の設定を {操作: ミリ秒} にする。"""
+    overrides = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, value = item.partition("=")
+        name = name.strip().lower()
+        if name not in OPERATIONS:
+            logger.warning(f"Unknown RTDB operation in latency overrides: '{name}'")
+            continue
+        try:
+            overrides[name] = float(value)
+        except ValueError:
+            logger.warning(f"Invalid latency for RTDB operation '{name}': '{value}'")
+    return overrides
+
+
+def _split_path(path: Optional[str]) -> List[str]:
+    segments = [segment for segment in (path or "").split("/") if segment]
+    for segment in segments:
+        if _INVALID_KEY_CHARS & set(segment):
+            raise ValueError(f"Invalid path segment: '{segment}'")
+    return segments
+
+
+def _join_path(segments: List[str]) -> str:
+    return "/" + "/".join(segments)
+
+
+def _to_tree(value: Any) -> Any:
+    """保存用の形（配列は連番キーのオブジェクト、None と空のオブジェクトは除去）に変換する。"""
+    if isinstance(value, dict):
+        tree = {}
+        for key, item in value.items():
+            item = _to_tree(item)
+            if item is not None:
+                tree[str(key)] = item
+        return tree or None
+    if isinstance(value, list):
+        return _to_tree({str(index): item for index, item in enumerate(value)})
+    return value
+
+
+def _from_tree(node: Any) -> Any:
+    """
+    保存形式を RTDB と同じ規則で読み出し用の値に戻す。
+    キーがすべて0以上の整数で、最大キーが件数の2倍未満のオブジェクトは配列（欠番は None）として返す。
+    """
+    if not isinstance(node, dict):
+        return node
+    children = {key: _from_tree(item) for key, item in node.items()}
+    if children and all(key.isdigit() for key in children):
+        max_index = max(int(key) for key in children)
+        if max_index < 2 * len(children):
+            return [children.get(str(index)) for index in range(max_index + 1)]
+    return children
+
+
+def _get_node(root: Any, segments: List[str]) -> Any:
+    node = root
+    for segment in segments:
+        if not isinstance(node, dict):
+            return None
+        node = node.get(segment)
+    return node
+
+
+def _set_node(root: Any, segments: List[str], value: Any) -> Any:
+    """root の segments の位置を value（保存形式）に置き換えた木を返す。"""
+    if not segments:
+        return value
+    node = dict(root) if isinstance(root, dict) else {}
+    child = _set_node(node.get(segments[0]), segments[1:], value)
+    if child is None:
+        node.pop(segments[0], None)
+    else:
+        node[segments[0]] = child
+    return node or None
+
+
+def _key_sort_key(key: str) -> Tuple[int, Any]:
+    # RTDBのキー順：32ビット整数として読めるキーを数値順に先に、それ以外を文字列順に
+    if key.lstrip("-").isdigit() and -2 ** 31 <= int(key) < 2 ** 31:
+        return (0, int(key))
+    return (1, key)
+
+
+def _value_sort_key(value: Any) -> Tuple[int, Any]:
+    # RTDBの値の順序：null < false < true < 数値 < 文字列 < オブジェクト
+    if value is None:
+        return (0, 0)
+    if value is False:
+        return (1, 0)
+    if value is True:
+        return (2, 0)
+    if isinstance(value, (int, float)):
+        return (3, value)
+    if isinstance(value, str):
+        return (4, value)
+    return (5, 0)
+
+
+def _payload_size(value: Any) -> int:
+    if value is None:
+        return 0
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+class Event:
+    """firebase_admin.db.Event と同じ属性を持つリスナーイベント。"""
+
+    def __init__(self, event_type: str, path: str, data: Any):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class ListenerRegistration:
+    """リスナーごとの配信スレッド。close() で配信を止め、スレッドの終了を待つ。"""
+
+    def __init__(self, database: "InMemoryDatabase", segments: List[str], callback: Callable[[Event], None]):
+        self._database = database
+        self.segments = segments
+        self._callback = callback
+        self._queue: "queue.Queue[Optional[Event]]" = queue.Queue()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f"memory-rtdb-listener{_join_path(segments)}")
+        self._thread.start()
+
+    def _enqueue(self, event: Event):
+        if not self._closed.is_set():
+            self._queue.put(event)
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            if event is None or self._closed.is_set():
+                return
+            self._database._delay("event")
+            try:
+                self._callback(event)
+            except Exception as e:
+                logger.error(f"In-memory RTDB listener callback for '{_join_path(self.segments)}' failed: {e}")
+            self._database._count("eventsDelivered", 0)
+
+    def close(self):
+        self._closed.set()
+        self._queue.put(None)
+        self._database._remove_listener(self)
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+class Query:
+    """order_by_* / start_at / end_at / equal_to / limit_to_* を組み合わせた読み出し。"""
+
+    def __init__(self, reference: "Reference", order_by: str, child_path: Optional[str] = None):
+        self._reference = reference
+        self._order_by = order_by
+        self._child_segments = _split_path(child_path) if child_path else []
+        self._start = None
+        self._end = None
+        self._limit_first: Optional[int] = None
+        self._limit_last: Optional[int] = None
+
+    def start_at(self, start: Any) -> "Query":
+        self._start = start
+        return self
+
+    def end_at(self, end: Any) -> "Query":
+        self._end = end
+        return self
+
+    def equal_to(self, value: Any) -> "Query":
+        self._start = self._end = value
+        return self
+
+    def limit_to_first(self, limit: int) -> "Query":
+        if self._limit_last is not None:
+            raise ValueError("Cannot set both first and last limits.")
+        self._limit_first = int(limit)
+        return self
+
+    def limit_to_last(self, limit: int) -> "Query":
+        if self._limit_first is not None:
+            raise ValueError("Cannot set both first and last limits.")
+        self._limit_last = int(limit)
+        return self
+
+    def _sort_key(self, key: str, value: Any):
+        if self._order_by == "key":
+            return _key_sort_key(key)
+        if self._order_by == "value":
+            return (_value_sort_key(value), _key_sort_key(key))
+        return (_value_sort_key(_get_node(value, self._child_segments)), _key_sort_key(key))
+
+    def _bound(self, value: Any):
+        return _key_sort_key(str(value)) if self._order_by == "key" else _value_sort_key(value)
+
+    def get(self) -> "OrderedDict[str, Any]":
+        node = self._reference._database._read("query", self._reference.segments)
+        if not isinstance(node, dict):
+            return OrderedDict()
+        items = sorted(node.items(), key=lambda item: self._sort_key(*item))
+        if self._start is not None or self._end is not None:
+            def _ordered_value(key, value):
+                if self._order_by == "key":
+                    return _key_sort_key(key)
+                target = value if self._order_by == "value" else _get_node(value, self._child_segments)
+                return _value_sort_key(target)
+            items = [(key, value) for key, value in items
+                     if (self._start is None or _ordered_value(key, value) >= self._bound(self._start))
+                     and (self._end is None or _ordered_value(key, value) <= self._bound(self._end))]
+        if self._limit_first is not None:
+            items = items[:self._limit_first]
+        elif self._limit_last is not None:
+            items = items[-self._limit_last:] if self._limit_last else []
+        return OrderedDict((key, _from_tree(value)) for key, value in items)
+
+
+class Reference:
+    """firebase_admin.db.Reference と同じ操作を持つ参照。"""
+
+    def __init__(self, database: "InMemoryDatabase", segments: List[str]):
+        self._database = database
+        self.segments = segments
+
+    @property
+    def key(self) -> Optional[str]:
+        return self.segments[-1] if self.segments else None
+
+    @property
+    def path(self) -> str:
+        return _join_path(self.segments)
+
+    @property
+    def parent(self) -> Optional["Reference"]:
+        return Reference(self._database, self.segments[:-1]) if self.segments else None
+
+    def child(self, path: str) -> "Reference":
+        if not path or not isinstance(path, str):
+            raise ValueError(f"Invalid path argument: '{path}'")
+        return Reference(self._database, self.segments + _split_path(path))
+
+    def get(self, etag: bool = False, shallow: bool = False):
+        if etag and shallow:
+            raise ValueError("etag and shallow cannot both be set to True.")
+        value = self._database._read("get", self.segments, shallow=shallow)
+        if etag:
+            return value, self._database._etag(value)
+        return value
+
+    def set(self, value: Any):
+        if value is None:
+            raise ValueError("Value must not be None.")
+        self._database._write("set", self.segments, value)
+
+    def update(self, value: Dict[str, Any]):
+        if not value or not isinstance(value, dict):
+            raise ValueError("Value argument must be a non-empty dictionary.")
+        if None in value.keys():
+            raise ValueError("Dictionary must not contain None keys.")
+        self._database._patch(self.segments, value)
+
+    def push(self, value: Any = "") -> "Reference":
+        if value is None:
+            raise ValueError("Value must not be None.")
+        child_ref = Reference(self._database, self.segments + [self._database._next_push_id()])
+        self._database._write("push", child_ref.segments, value)
+        return child_ref
+
+    def delete(self):
+        self._database._write("delete", self.segments, None)
+
+    def transaction(self, transaction_update: Callable[[Any], Any]) -> Any:
+        if not callable(transaction_update):
+            raise ValueError("transaction_update must be a function.")
+        return self._database._transaction(self.segments, transaction_update)
+
+    def listen(self, callback: Callable[[Event], None]) -> ListenerRegistration:
+        return self._database._add_listener(self.segments, callback)
+
+    def order_by_child(self, path: str) -> Query:
+        if not path or not isinstance(path, str):
+            raise ValueError(f"Illegal child path: '{path}'")
+        return Query(self, "child", path)
+
+    def order_by_key(self) -> Query:
+        return Query(self, "key")
+
+    def order_by_value(self) -> Query:
+        return Query(self, "value")
+
+
+class InMemoryDatabase:
+    """データ木・リスナー・統計を保持する。reference() は firebase_admin.db.reference() と同じように使う。"""
+
+    def __init__(self, latency_ms: float = 0.0, latency_overrides: Optional[Dict[str, float]] = None,
+                 seed_data: Optional[Dict[str, Any]] = None):
+        self.latency_ms = latency_ms
+        self.latency_overrides = dict(latency_overrides or {})
+        self._root: Any = _to_tree(copy.deepcopy(seed_data)) if seed_data else None
+        self._lock = threading.RLock()
+        self._listeners: List[ListenerRegistration] = []
+        self._last_push_time = 0
+        self._last_push_random: List[int] = []
+        self._counts: Dict[str, int] = {}
+
+    @classmethod
+    def from_json_file(cls, path: str, **kwargs) -> "InMemoryDatabase":
+        with open(path, "r", encoding="utf-8") as f:
+            seed_data = json.load(f)
+        logger.info(f"In-memory RTDB seeded from {path}")
+        return cls(seed_data=seed_data, **kwargs)
+
+    def reference(self, path: str = "/") -> Reference:
+        return Reference(self, _split_path(path))
+
+    def export(self) -> Any:
+        """データ全体のコピー（RTDBのJSONエクスポートと同じ形）。"""
+        with self._lock:
+            return _from_tree(copy.deepcopy(self._root))
+
+    def reset(self, data: Optional[Dict[str, Any]] = None):
+        """データと統計を初期化する（リスナーには "/" の put として通知する）。"""
+        with self._lock:
+            self._root = _to_tree(copy.deepcopy(data)) if data else None
+            self._counts = {}
+            for registration in list(self._listeners):
+                registration._enqueue(Event("put", "/", _from_tree(
+                    copy.deepcopy(_get_node(self._root, registration.segments)))))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            return {
+                "backend": "memory",
+                "latencyMs": self.latency_ms,
+                "latencyOverrides": dict(self.latency_overrides),
+                "listeners": len(self._listeners),
+                "operations": {name: counts.get(name, 0) for name in OPERATIONS if name != "event"},
+                "eventsDelivered": counts.get("eventsDelivered", 0),
+                "bytesRead": counts.get("bytesRead", 0),
+                "bytesWritten": counts.get("bytesWritten", 0),
+            }
+
+    # --- 内部処理 ---
+
+    def _delay(self, operation: str):
+        latency_ms = self.latency_overrides.get(operation, self.latency_ms)
+        if latency_ms > 0:
+            time.sleep(latency_ms / 1000.0)
+
+    def _count(self, name: str, size: int, size_name: Optional[str] = None):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+            if size_name:
+                self._counts[size_name] = self._counts.get(size_name, 0) + size
+
+    def _etag(self, value: Any) -> str:
+        payload = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+    def _read(self, operation: str, segments: List[str], shallow: bool = False) -> Any:
+        self._delay(operation)
+        with self._lock:
+            node = _get_node(self._root, segments)
+            if shallow and isinstance(node, dict):
+                value = {key: (True if isinstance(item, dict) else item) for key, item in node.items()}
+            else:
+                value = _from_tree(copy.deepcopy(node))
+        self._count(operation, _payload_size(value), "bytesRead")
+        return value
+
+    @staticmethod
+    def _serialize(value: Any) -> Tuple[Any, int]:
+        # JSONにできない値は firebase_admin と同様にエラーにする
+        payload = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        return json.loads(payload), len(payload.encode("utf-8"))
+
+    def _write(self, operation: str, segments: List[str], value: Any):
+        self._delay(operation)
+        value, size = self._serialize(value) if value is not None else (None, 0)
+        with self._lock:
+            self._root = _set_node(self._root, segments, _to_tree(value))
+            self._notify(segments, "put", value)
+        self._count(operation, size, "bytesWritten")
+
+    def _patch(self, segments: List[str], value: Dict[str, Any]):
+        self._delay("update")
+        value, size = self._serialize(value)
+        with self._lock:
+            for key, item in value.items():
+                self._root = _set_node(self._root, segments + _split_path(key), _to_tree(item))
+            self._notify(segments, "patch", value)
+        self._count("update", size, "bytesWritten")
+
+    def _transaction(self, segments: List[str], transaction_update: Callable[[Any], Any]) -> Any:
+        self._delay("transaction")
+        with self._lock:
+            current = _from_tree(copy.deepcopy(_get_node(self._root, segments)))
+            new_value, size = self._serialize(transaction_update(current))
+            self._root = _set_node(self._root, segments, _to_tree(new_value))
+            self._notify(segments, "put", new_value)
+        self._count("transaction", size, "bytesWritten")
+        return copy.deepcopy(new_value)
+
+    def _notify(self, segments: List[str], event_type: str, data: Any):
+        """segments への書き込みを、その位置を含む・その位置に含まれるリスナーに通知する（ロック内で呼ぶ）。"""
+        for registration in self._listeners:
+            listened = registration.segments
+            if segments[:len(listened)] == listened:
+                registration._enqueue(Event(event_type, _join_path(segments[len(listened):]), copy.deepcopy(data)))
+            elif listened[:len(segments)] == segments:
+                registration._enqueue(Event("put", "/", _from_tree(
+                    copy.deepcopy(_get_node(self._root, listened)))))
+
+    def _add_listener(self, segments: List[str], callback: Callable[[Event], None]) -> ListenerRegistration:
+        with self._lock:
+            registration = ListenerRegistration(self, segments, callback)
+            self._listeners.append(registration)
+            # 最初のイベントは RTDB と同様に現在の値全体
+            registration._enqueue(Event("put", "/", _from_tree(copy.deepcopy(_get_node(self._root, segments)))))
+        return registration
+
+    def _remove_listener(self, registration: ListenerRegistration):
+        with self._lock:
+            if registration in self._listeners:
+                self._listeners.remove(registration)
+
+    def _next_push_id(self) -> str:
+        """RTDBのpush IDと同じく、時刻順に並ぶ20文字のキーを作る。"""
+        with self._lock:
+            now = int(time.time() * 1000)
+            if now == self._last_push_time and self._last_push_random:
+                # 同じミリ秒内では乱数部分をインクリメントして順序を保つ
+                index = len(self._last_push_random) - 1
+                while index >= 0 and self._last_push_random[index] == 63:
+                    self._last_push_random[index] = 0
+                    index -= 1
+                if index >= 0:
+                    self._last_push_random[index] += 1
+            else:
+                self._last_push_random = [random.randrange(64) for _ in range(12)]
+            self._last_push_time = now
+            time_chars = []
+            for _ in range(8):
+                time_chars.append(_PUSH_CHARS[now % 64])
+                now //= 64
+            return "".join(reversed(time_chars)) + "".join(_PUSH_CHARS[i] for i in self._last_push_random)
@@ -0,0 +1,474 @@
+"""
+概要図エージェントが生成する Mermaid.js `graph TD/LR` サブセットの検証と自動修復。
+
+LLMの出力をクライアントに渡す前にサーバー側で構文チェックし、既知の失敗パターン
+（`:::` によるクラス指定、括弧を含む未クォートのサブグラフタイトルなど）は
+ローカルで修復する。ローカルで直せないエラーだけを修復プロンプトに回す。
+"""
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+HEADER_RE = re.compile(r'^(graph|flowchart)\s+(TD|TB|LR|RL|BT)\s*;?\s*$')
+NODE_ID_RE = re.compile(r'[A-Za-z0-9_À-￿]+(?:[-.][A-Za-z0-9_À-￿]+)*')
+CLASS_NAME_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_-]*')
+# 矢印の端は '>'（矢印）、'o'（円）、'x'（バツ）のいずれか
+EDGE_RE = re.compile(r'[<ox]?(?:-{2,}[>ox]|-{3,}|-\.+-[>ox]|-\.+-|={2,}[>ox]|={3,}|~~~)')
+EDGE_WITH_TEXT_RE = re.compile(
+    r'([<ox]?(?:--|==|-\.))\s+([^|]+?)\s+(-{2,}[>ox]|-{3,}|={2,}[>ox]|={3,}|\.-+[>ox]|\.-+)')
+EDGE_LABEL_RE = re.compile(r'\|([^|]*)\|')
+
+# ノード形状の開始/終了記号（長いものから順に判定する）
+NODE_SHAPES: List[Tuple[str, str]] = [
+    ("(((", ")))"), ("((", "))"), ("([", "])"), ("[[", "]]"), ("[(", ")]"),
+    ("[/", "/]"), ("[\\", "\\]"), ("{{", "}}"), ("(", ")"), ("[", "]"),
+    ("{", "}"), (">", "]"),
+]
+# 未クォートのラベルに含まれると Mermaid のパースが失敗する文字
+UNSAFE_LABEL_CHARS = set('()[]{}"<>|;')
+
+DEFAULT_HEADER = "graph TD"
+
+
+@dataclass
+class MermaidIssue:
+    line: int  # 1始まりの行番号 (0は定義全体)
+    message: str
+    fixable: bool = False
+
+    def __str__(self) -> str:
+        return f"line {self.line}: {self.message}" if self.line else self.message
+
+
+@dataclass
+class _NodeToken:
+    node_id: str
+    opener: str = ""
+    closer: str = ""
+    text: Optional[str] = None
+    quoted: bool = False
+    class_suffix: Optional[str] = None
+
+    def render(self) -> str:
+        if not self.opener:
+            return self.node_id
+        text = self.text or ""
+        if self.quoted or any(c in UNSAFE_LABEL_CHARS for c in text):
+            text = '"' + text.replace('"', "#quot;") + '"'
+        return f"{self.node_id}{self.opener}{text}{self.closer}"
+
+
+class _StatementParser:
+    """ノード/エッジからなる1ステートメントを解析する小さな再帰下降パーサ。"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.pos = 0
+        self.tokens: List[object] = []
+        self.issues: List[Tuple[str, bool]] = []
+
+    def _skip_ws(self):
+        while self.pos < len(self.source) and self.source[self.pos] in " \t":
+            self.pos += 1
+
+    def _at_end(self) -> bool:
+        self._skip_ws()
+        return self.pos >= len(self.source)
+
+    def parse(self) -> bool:
+        if not self._parse_node():
+            return False
+        while not self._at_end():
+            if self.source[self.pos] == "&":
+                self.tokens.append("&")
+                self.pos += 1
+                self._skip_ws()
+                if not self._parse_node():
+                    return False
+                continue
+            if not self._parse_edge():
+                self.issues.append(
+                    (f"unexpected text '{self.source[self.pos:self.pos + 20]}'", False))
+                return False
+            self._skip_ws()
+            if not self._parse_node():
+                return False
+        return True
+
+    def _parse_node(self) -> bool:
+        self._skip_ws()
+        match = NODE_ID_RE.match(self.source, self.pos)
+        if not match:
+            self.issues.append(
+                (f"expected node id at '{self.source[self.pos:self.pos + 20]}'", False))
+            return False
+        token = _NodeToken(node_id=match.group(0))
+        self.pos = match.end()
+
+        for opener, closer in NODE_SHAPES:
+            if self.source.startswith(opener, self.pos):
+                if not self._parse_label(token, opener, closer):
+                    return False
+                break
+
+        if self.source.startswith(":::", self.pos):
+            class_match = CLASS_NAME_RE.match(self.source, self.pos + 3)
+            if not class_match:
+                self.issues.append(("invalid ':::' class suffix", False))
+                return False
+            token.class_suffix = class_match.group(0)
+            self.pos = class_match.end()
+            self.issues.append(
+                (f"':::' class assignment on node '{token.node_id}'", True))
+
+        self.tokens.append(token)
+        return True
+
+    def _parse_label(self, token: _NodeToken, opener: str, closer: str) -> bool:
+        start = self.pos + len(opener)
+        if self.source.startswith('"', start):
+            end_quote = self.source.find('"', start + 1)
+            if end_quote == -1 or not self.source.startswith(closer, end_quote + 1):
+                self.issues.append(
+                    (f"unterminated quoted label on node '{token.node_id}'", False))
+                return False
+            token.text = self.source[start + 1:end_quote]
+            token.quoted = True
+            self.pos = end_quote + 1 + len(closer)
+        else:
+            end = self._find_closer(start, closer)
+            if end == -1:
+                self.issues.append(
+                    (f"unclosed shape '{opener}' on node '{token.node_id}'", False))
+                return False
+            token.text = self.source[start:end]
+            self.pos = end + len(closer)
+            if any(c in UNSAFE_LABEL_CHARS for c in token.text):
+                self.issues.append(
+                    (f"unquoted label with special characters on node '{token.node_id}'", True))
+        token.opener = opener
+        token.closer = closer
+        return True
+
+    def _find_closer(self, start: int, closer: str) -> int:
+        """括弧の深さを数えながら、深さ0で現れる終了記号の位置を返す。"""
+        depth = 0
+        i = start
+        pairs = {"(": ")", "[": "]", "{": "}"}
+        closing = set(pairs.values())
+        while i < len(self.source):
+            if depth == 0 and self.source.startswith(closer, i):
+                return i
+            ch = self.source[i]
+            if ch in pairs:
+                depth += 1
+            elif ch in closing and depth > 0:
+                depth -= 1
+            i += 1
+        return -1
+
+    def _parse_edge(self) -> bool:
+        match = EDGE_WITH_TEXT_RE.match(self.source, self.pos) or EDGE_RE.match(
+            self.source, self.pos)
+        if not match:
+            return False
+        self.pos = match.end()
+        edge_text = match.group(0)
+        self._skip_ws()
+        label_match = EDGE_LABEL_RE.match(self.source, self.pos)
+        if label_match:
+            edge_text += label_match.group(0)
+            self.pos = label_match.end()
+        self.tokens.append(edge_text)
+        return True
+
+    def render(self) -> str:
+        parts = []
+        for token in self.tokens:
+            parts.append(token.render() if isinstance(
+                token, _NodeToken) else token)
+        return " ".join(parts)
+
+
+def _split_inline_comment(line: str) -> Tuple[str, str]:
+    """クォートの外側にある行末の '%%' コメントを切り離し、(本文, コメント) を返す。"""
+    in_quote = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quote = not in_quote
+        elif not in_quote and line.startswith("%%", i) and not line.startswith("%%{", i):
+            return line[:i].rstrip(), line[i:]
+    return line, ""
+
+
+def _split_statements(line: str) -> List[str]:
+    """クォートと括弧の外側にある ';' でステートメントを分割する。"""
+    statements, current, depth, in_quote = [], [], 0, False
+    for ch in line:
+        if ch == '"':
+            in_quote = not in_quote
+        elif not in_quote:
+            if ch in "([{":
+                depth += 1
+            elif ch in ")]}" and depth > 0:
+                depth -= 1
+            elif ch == ";" and depth == 0:
+                statements.append("".join(current))
+                current = []
+                continue
+        current.append(ch)
+    statements.append("".join(current))
+    return [s for s in statements if s.strip()]
+
+
+def _is_quoted(text: str) -> bool:
+    return len(text) >= 2 and text.startswith('"') and text.endswith('"')
+
+
+def _check_subgraph(rest: str) -> Optional[Tuple[str, bool]]:
+    """`subgraph` の後ろを検証し、問題があれば (メッセージ, 自動修復可否) を返す。"""
+    if not rest:
+        return ("subgraph without title", False)
+    if _is_quoted(rest):
+        return None
+    id_match = NODE_ID_RE.match(rest)
+    if id_match:
+        remainder = rest[id_match.end():].strip()
+        if not remainder:
+            return None
+        if remainder.startswith("[") and remainder.endswith("]"):
+            title = remainder[1:-1]
+            if _is_quoted(title) or not any(c in UNSAFE_LABEL_CHARS for c in title):
+                return None
+            return ("subgraph title with special characters must be quoted", True)
+    if any(c in UNSAFE_LABEL_CHARS for c in rest):
+        return ("unquoted subgraph title with special characters", True)
+    return None
+
+
+def _quote_subgraph_title(rest: str) -> str:
+    id_match = NODE_ID_RE.match(rest)
+    if id_match and rest[id_match.end():].strip().startswith("["):
+        title = rest[id_match.end():].strip()[1:-1]
+        return f'{id_match.group(0)}["{_sanitize_title(title)}"]'
+    return f'"{_sanitize_title(rest)}"'
+
+
+def _sanitize_title(title: str) -> str:
+    # タイトル中の半角括弧は全角に置き換え、引用符は取り除く
+    return title.replace("(", "（").replace(")", "）").replace('"', "").strip()
+
+
+def _iter_body_lines(definition: str):
+    """(行番号, インデント, 本文) を返す。空行は除外し、行末の '%%' コメントは取り除く。"""
+    for number, raw in enumerate(definition.splitlines(), start=1):
+        stripped = raw.strip()
+        if stripped and not stripped.startswith("%"):
+            stripped = _split_inline_comment(stripped)[0]
+        if stripped:
+            yield number, raw[:len(raw) - len(raw.lstrip())], stripped
+
+
+def _classify_line(stripped: str) -> str:
+    lowered = stripped.lower()
+    if stripped.startswith("%"):
+        return "comment"
+    if lowered == "end" or lowered == "end;":
+        return "end"
+    for keyword in ("subgraph", "classdef", "class", "style", "linkstyle", "click", "direction"):
+        if lowered == keyword or lowered.startswith(keyword + " "):
+            return keyword
+    return "statement"
+
+
+def validate_mermaid(definition: str) -> List[MermaidIssue]:
+    """Mermaid定義を検証し、見つかった問題のリストを返す（空なら妥当）。"""
+    issues: List[MermaidIssue] = []
+    if not definition or not definition.strip():
+        return [MermaidIssue(0, "empty definition")]
+
+    header_seen = False
+    subgraph_depth = 0
+    for number, _, stripped in _iter_body_lines(definition):
+        kind = _classify_line(stripped)
+        if kind == "comment":
+            if not stripped.startswith("%%"):
+                issues.append(MermaidIssue(
+                    number, "comment must start with '%%'", True))
+            continue
+        if not header_seen:
+            if HEADER_RE.match(stripped):
+                header_seen = True
+                continue
+            issues.append(MermaidIssue(
+                number, "definition must start with 'graph TD' or 'graph LR'", False))
+            header_seen = True
+            continue
+
+        if kind == "subgraph":
+            subgraph_depth += 1
+            problem = _check_subgraph(stripped[len("subgraph"):].strip())
+            if problem:
+                issues.append(MermaidIssue(number, problem[0], problem[1]))
+        elif kind == "end":
+            if subgraph_depth == 0:
+                issues.append(MermaidIssue(
+                    number, "'end' without matching subgraph", False))
+            else:
+                subgraph_depth -= 1
+        elif kind == "classdef":
+            parts = stripped.split(None, 2)
+            if len(parts) < 3 or not CLASS_NAME_RE.fullmatch(parts[1]):
+                issues.append(MermaidIssue(
+                    number, "classDef requires a name and styles", False))
+        elif kind == "class":
+            parts = stripped.rstrip(";").split()
+            if len(parts) != 3 or not all(NODE_ID_RE.fullmatch(i) for i in parts[1].split(",")) \
+                    or not CLASS_NAME_RE.fullmatch(parts[2]):
+                issues.append(MermaidIssue(
+                    number, "class assignment must be 'class ID[,ID] className'", False))
+        elif kind in ("style", "linkstyle", "click", "direction"):
+            if len(stripped.split()) < 2:
+                issues.append(MermaidIssue(
+                    number, f"incomplete '{kind}' statement", False))
+        else:
+            for statement in _split_statements(stripped):
+                parser = _StatementParser(statement.strip())
+                parser.parse()
+                for message, fixable in parser.issues:
+                    issues.append(MermaidIssue(number, message, fixable))
+
+    if not header_seen:
+        issues.append(MermaidIssue(0, "missing 'graph TD/LR' header", False))
+    if subgraph_depth > 0:
+        issues.append(MermaidIssue(
+            0, f"{subgraph_depth} subgraph(s) not closed with 'end'", True))
+    return issues
+
+
+def strip_code_fences(text: str) -> str:
+    """LLM応答に付いたコードフェンスやバッククォートを取り除く。"""
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        first_newline = cleaned.find("\n")
+        cleaned = cleaned[first_newline + 1:] if first_newline != -1 else ""
+        if cleaned.rstrip().endswith("```"):
+            cleaned = cleaned.rstrip()[:-3]
+    elif cleaned.startswith("`") and cleaned.endswith("`"):
+        cleaned = cleaned[1:-1]
+    return cleaned.strip()
+
+
+def _fix_comment(indent: str, stripped: str) -> str:
+    # Mermaidのコメントは '%%'。非ASCII文字はパースエラーの原因になるため除去する
+    comment_text = stripped.lstrip("%").strip()
+    comment_text = comment_text.encode("ascii", "ignore").decode("ascii").strip()
+    return f"{indent}%% {comment_text or 'Comment'}"
+
+
+def auto_fix_mermaid(definition: str) -> Tuple[str, List[str]]:
+    """
+    既知の失敗パターンをローカルで修復する。
+    修復後の定義と、適用した修復内容の説明リストを返す。
+    """
+    applied: List[str] = []
+    fixed_lines: List[str] = []
+    deferred_class_lines: List[str] = []
+    header_seen = False
+    subgraph_depth = 0
+
+    for raw in strip_code_fences(definition).splitlines():
+        stripped = raw.strip()
+        indent = raw[:len(raw) - len(raw.lstrip())]
+        if not stripped:
+            fixed_lines.append(raw)
+            continue
+        kind = _classify_line(stripped)
+        trailing_comment = ""
+        if kind != "comment":
+            stripped, trailing_comment = _split_inline_comment(stripped)
+            if trailing_comment:
+                trailing_comment = " " + trailing_comment
+            kind = _classify_line(stripped)
+        if kind == "comment":
+            fixed = _fix_comment(indent, stripped)
+            if fixed != raw:
+                applied.append("normalized comment")
+            fixed_lines.append(fixed)
+            continue
+        if not header_seen:
+            header_seen = True
+            if HEADER_RE.match(stripped) or re.match(r'^(graph|flowchart)\b', stripped):
+                # 壊れたヘッダーはローカルでは推測せず、そのまま検証に回す
+                fixed_lines.append(raw)
+                continue
+            fixed_lines.append(DEFAULT_HEADER)
+            applied.append(f"added '{DEFAULT_HEADER}' header")
+
+        if kind == "subgraph":
+            subgraph_depth += 1
+            rest = stripped[len("subgraph"):].strip()
+            problem = _check_subgraph(rest)
+            if problem and problem[1]:
+                fixed_lines.append(
+                    f"{indent}subgraph {_quote_subgraph_title(rest)}{trailing_comment}")
+                applied.append("quoted subgraph title")
+                continue
+        elif kind == "end":
+            subgraph_depth = max(0, subgraph_depth - 1)
+        elif kind == "statement":
+            rendered_statements = []
+            changed = False
+            for statement in _split_statements(stripped):
+                parser = _StatementParser(statement.strip())
+                if parser.parse() and any(fixable for _, fixable in parser.issues):
+                    for token in parser.tokens:
+                        if isinstance(token, _NodeToken) and token.class_suffix:
+                            deferred_class_lines.append(
+                                f"class {token.node_id} {token.class_suffix}")
+                            token.class_suffix = None
+                    rendered_statements.append(parser.render())
+                    changed = True
+                else:
+                    rendered_statements.append(statement.strip())
+            if changed:
+                fixed_lines.append(indent + "; ".join(rendered_statements) + trailing_comment)
+                applied.append("rewrote node definitions")
+                continue
+        fixed_lines.append(raw)
+
+    if subgraph_depth > 0:
+        fixed_lines.extend(["end"] * subgraph_depth)
+        applied.append("closed unterminated subgraph")
+    if deferred_class_lines:
+        fixed_lines.extend(deferred_class_lines)
+        applied.append("converted ':::' to class statements")
+
+    # 同じ種類の修復は1回だけ報告する
+    return "\n".join(fixed_lines), list(dict.fromkeys(applied))
+
+
+def format_issues(issues: List[MermaidIssue]) -> str:
+    return "\n".join(f"- {issue}" for issue in issues)
+
+
+if __name__ == '__main__':
+    # 妥当な定義が誤検知されないこと、壊れた定義が検出・修復されることを確認する
+    valid_definitions = [
+        "graph TD\n    A[開始] --> B(議題1)\n    B -.-> C{議論}\n    C -- はい --> D((田中))",
+        "graph LR\n    A --o B\n    A --x C\n    D o--o E\n    F <--> G\n    H x--x I\n    J -- 完了 --o K",
+        "graph TD\n    A --> B %% 行末のコメント\n    subgraph S1[\"グループ\"] %% note\n        C\n    end %% done",
+        "graph TD\n    api.v1 --> db.main\n    C[\"進捗 100%%\"] --> D\n    class api.v1 primary",
+        'graph TD\n    subgraph "既存環境"\n        SRV_A["Server A"] & SRV_B["Server B"]\n    end',
+    ]
+    for definition in valid_definitions:
+        found = validate_mermaid(definition)
+        assert not found, f"{definition!r}: {format_issues(found)}"
+
+    broken = "graph LR\n  subgraph 既存環境 (現行クラウド)\n    P((\"Taro\")):::person --> T[仕様 (案)] %% keep\n"
+    assert validate_mermaid(broken)
+    repaired, fixes = auto_fix_mermaid(broken)
+    assert not validate_mermaid(repaired), format_issues(validate_mermaid(repaired))
+    assert "%% keep" in repaired
+    assert validate_mermaid("graph TD\n    A --> \n")
+    print(f"mermaid_validator self-check passed ({len(valid_definitions)} valid, fixes: {fixes})")
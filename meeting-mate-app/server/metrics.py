@@ -0,0 +1,332 @@
+"""
+Prometheus形式のメトリクス（GET /metrics で公開）。
+
+/invoke・トリガー判定・orchestrate_agents・process_single_agent の各ステージの処理時間をヒストグラムに、
+リクエスト・トリガー判定・エージェント呼び出し・LLM呼び出しの結果をカウンターに記録する。
+RTDBの操作は instrument_database() で包んだ db を通して、操作の種類とトップレベルのパス（rooms / transcripts など）ごとに
+回数・処理時間・概算バイト数を数える。バイト数はペイロードをJSONにして測るため、操作の一部（METRICS_RTDB_BYTES_SAMPLE_RATE）だけを
+測って 1/割合 倍して加算する（全件を測るとトランスクリプトの読み出しやリスナーの初回スナップショットを毎回シリアライズすることになる）。
+ラベルにはルームIDではなくルームの分類（METRICS_ROOM_CLASSES の接頭辞で決まる）を使い、系列数を有限に保つ。
+prometheus_client がない場合や METRICS_ENABLED=false の場合は、記録はすべて何もしない。
+"""
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import logger, METRICS_ENABLED, METRICS_ROOM_CLASSES, METRICS_RTDB_BYTES_SAMPLE_RATE
+
+PROMETHEUS_AVAILABLE = False
+if METRICS_ENABLED:
+    try:
+        from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+        from prometheus_client import ProcessCollector, PlatformCollector
+        PROMETHEUS_AVAILABLE = True
+    except ImportError:
+        logger.warning(
+            "prometheus_client library not found. /metrics will be unavailable.")
+
+DEFAULT_ROOM_CLASS = "standard"
+# LLMの応答待ちを含むため、数十秒まで区切る
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+RTDB_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def parse_room_classes(value: str) -> List[Tuple[str, str]]:
+    """"demo_zenn=demo,bench_=benchmark" を (接頭辞, 分類) のリストにする（長い接頭辞を優先）。"""
+    classes = []
+    for item in (value or "").split(","):
+        prefix, separator, room_class = item.partition("=")
+        if separator and prefix.strip() and room_class.strip():
+            classes.append((prefix.strip(), room_class.strip()))
+        elif item.strip():
+            logger.warning(f"Ignoring invalid METRICS_ROOM_CLASSES entry: '{item}'")
+    return sorted(classes, key=lambda pair: len(pair[0]), reverse=True)
+
+
+_room_classes = parse_room_classes(METRICS_ROOM_CLASSES)
+
+
+def room_class(room_id: Optional[str]) -> str:
+    for prefix, label in _room_classes:
+        if room_id and room_id.startswith(prefix):
+            return label
+    return DEFAULT_ROOM_CLASS
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+if PROMETHEUS_AVAILABLE:
+    registry = CollectorRegistry()
+    ProcessCollector(registry=registry)
+    PlatformCollector(registry=registry)
+
+    STAGE_SECONDS = Histogram(
+        "aimeebo_stage_duration_seconds", "Duration of each stage of /invoke, trigger evaluation and orchestration.",
+        ["operation", "stage", "room_class"], buckets=LATENCY_BUCKETS, registry=registry)
+    AGENT_STAGE_SECONDS = Histogram(
+        "aimeebo_agent_stage_duration_seconds", "Duration of each stage of process_single_agent.",
+        ["agent", "model", "stage", "room_class"], buckets=LATENCY_BUCKETS, registry=registry)
+    REQUESTS = Counter(
+        "aimeebo_invoke_requests_total", "Requests to /invoke and /invoke_batch by outcome.",
+        ["endpoint", "room_class", "outcome"], registry=registry)
+    TRIGGER_DECISIONS = Counter(
+        "aimeebo_trigger_decisions_total", "Trigger policy evaluations by decision.",
+        ["room_class", "decision"], registry=registry)
+    AGENT_INVOCATIONS = Counter(
+        "aimeebo_agent_invocations_total", "Agent invocations by outcome (ok, error, cached).",
+        ["agent", "model", "outcome"], registry=registry)
+    SECTION_WRITES = Counter(
+        "aimeebo_section_writes_total", "Room section writes by agents (written, unchanged).",
+        ["section", "outcome"], registry=registry)
+    LLM_REQUEST_SECONDS = Histogram(
+        "aimeebo_llm_request_duration_seconds", "Duration of LLM requests by prompt and model.",
+        ["prompt", "model"], buckets=LATENCY_BUCKETS, registry=registry)
+    LLM_REQUESTS = Counter(
+        "aimeebo_llm_requests_total", "LLM requests by prompt, model and outcome.",
+        ["prompt", "model", "outcome"], registry=registry)
+    LLM_TOKENS = Counter(
+        "aimeebo_llm_tokens_total", "LLM tokens from usage_metadata by prompt, model and kind (prompt, output, cached, thoughts).",
+        ["prompt", "model", "kind"], registry=registry)
+    RTDB_OPERATIONS = Counter(
+        "aimeebo_rtdb_operations_total", "RTDB operations by type and top-level path.",
+        ["operation", "root"], registry=registry)
+    RTDB_OPERATION_SECONDS = Histogram(
+        "aimeebo_rtdb_operation_duration_seconds", "Duration of RTDB operations by type and top-level path.",
+        ["operation", "root"], buckets=RTDB_LATENCY_BUCKETS, registry=registry)
+    RTDB_BYTES = Counter(
+        "aimeebo_rtdb_bytes_total", "Estimated JSON bytes read from and written to RTDB (sampled and scaled).",
+        ["direction", "root"], registry=registry)
+else:
+    registry = None
+    STAGE_SECONDS = AGENT_STAGE_SECONDS = REQUESTS = TRIGGER_DECISIONS = AGENT_INVOCATIONS = _NoopMetric()
+    SECTION_WRITES = LLM_REQUEST_SECONDS = LLM_REQUESTS = LLM_TOKENS = _NoopMetric()
+    RTDB_OPERATIONS = RTDB_OPERATION_SECONDS = RTDB_BYTES = _NoopMetric()
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """/metrics の本文と Content-Type。"""
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class StageTimer:
+    """
+    mark(stage) を呼ぶたびに、前回の mark（または開始）からの経過時間をそのステージとして記録する。
+    処理を with ブロックで囲まずに、既存の処理の区切りに mark を置くだけで計測できる。
+    """
+
+    def __init__(self, histogram, **labels: str):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = self._last = time.perf_counter()
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.histogram.labels(stage=stage, **self.labels).observe(now - self._last)
+        self._last = now
+
+    def skip(self):
+        """ここまでの区間を記録せずに捨てる。"""
+        self._last = time.perf_counter()
+
+    def finish(self, stage: str = "total") -> float:
+        elapsed = time.perf_counter() - self.started
+        self.histogram.labels(stage=stage, **self.labels).observe(elapsed)
+        return elapsed
+
+
+def stage_timer(operation: str, room_id: Optional[str]) -> StageTimer:
+    return StageTimer(STAGE_SECONDS, operation=operation, room_class=room_class(room_id))
+
+
+def agent_stage_timer(agent_name: str, model_name: str, room_id: Optional[str]) -> StageTimer:
+    return StageTimer(AGENT_STAGE_SECONDS, agent=agent_name, model=model_name or "unknown", room_class=room_class(room_id))
+
+
+def record_request(endpoint: str, room_id: Optional[str], response) -> None:
+    outcome = "error" if getattr(response, "error", None) else "ok"
+    REQUESTS.labels(endpoint=endpoint, room_class=room_class(room_id), outcome=outcome).inc()
+
+
+def record_trigger_decision(room_id: Optional[str], decision: str) -> None:
+    TRIGGER_DECISIONS.labels(room_class=room_class(room_id), decision=decision).inc()
+
+
+def record_agent_invocation(agent_name: str, model_name: str, outcome: str) -> None:
+    AGENT_INVOCATIONS.labels(agent=agent_name, model=model_name or "unknown", outcome=outcome).inc()
+
+
+def record_section_write(section: str, written: bool) -> None:
+    SECTION_WRITES.labels(section=section, outcome="written" if written else "unchanged").inc()
+
+
+def record_llm_request(prompt_name: str, model_name: str, seconds: float, outcome: str) -> None:
+    LLM_REQUEST_SECONDS.labels(prompt=prompt_name, model=model_name or "unknown").observe(seconds)
+    LLM_REQUESTS.labels(prompt=prompt_name, model=model_name or "unknown", outcome=outcome).inc()
+
+
+_TOKEN_KINDS = (("prompt", "prompt_token_count"), ("output", "candidates_token_count"),
+                ("cached", "cached_content_token_count"), ("thoughts", "thoughts_token_count"))
+
+
+def record_llm_tokens(prompt_name: str, model_name: str, usage_metadata: Any) -> None:
+    if usage_metadata is None:
+        return
+    for kind, attribute in _TOKEN_KINDS:
+        count = getattr(usage_metadata, attribute, 0) or 0
+        if count:
+            LLM_TOKENS.labels(prompt=prompt_name, model=model_name or "unknown", kind=kind).inc(count)
+
+
+# --- RTDB ---
+
+def _payload_size(value: Any) -> int:
+    if value is None:
+        return 0
+    try:
+        return len(json.dumps(value, ensure_ascii=False))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _count_rtdb_bytes(direction: str, root: str, value: Any):
+    """サンプリングした操作だけペイロードの大きさを測り、1/割合 倍して加算する。"""
+    if not PROMETHEUS_AVAILABLE or value is None or METRICS_RTDB_BYTES_SAMPLE_RATE <= 0:
+        return
+    if METRICS_RTDB_BYTES_SAMPLE_RATE < 1 and random.random() >= METRICS_RTDB_BYTES_SAMPLE_RATE:
+        return
+    RTDB_BYTES.labels(direction=direction, root=root).inc(
+        _payload_size(value) / min(METRICS_RTDB_BYTES_SAMPLE_RATE, 1.0))
+
+
+def _path_root(path: str) -> str:
+    segments = [segment for segment in (path or "").split("/") if segment]
+    return segments[0] if segments else "root"
+
+
+def _observe_rtdb(operation: str, root: str, started: float, read: Any = None, written: Any = None):
+    RTDB_OPERATIONS.labels(operation=operation, root=root).inc()
+    RTDB_OPERATION_SECONDS.labels(operation=operation, root=root).observe(time.perf_counter() - started)
+    _count_rtdb_bytes("read", root, read)
+    _count_rtdb_bytes("written", root, written)
+
+
+class _InstrumentedQuery:
+    def __init__(self, query, root: str):
+        self._query = query
+        self._root = root
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._query, name)
+        if not callable(attribute):
+            return attribute
+
+        def _chained(*args, **kwargs):
+            # start_at / limit_to_last などはクエリを返すので、包み直して get を数えられるようにする
+            return _InstrumentedQuery(attribute(*args, **kwargs), self._root)
+        return _chained
+
+    def get(self):
+        started = time.perf_counter()
+        result = self._query.get()
+        _observe_rtdb("query", self._root, started, read=result)
+        return result
+
+
+class _InstrumentedReference:
+    def __init__(self, reference):
+        self._reference = reference
+        self._root = _path_root(getattr(reference, "path", ""))
+
+    def __getattr__(self, name: str):
+        return getattr(self._reference, name)
+
+    @property
+    def parent(self):
+        parent = self._reference.parent
+        return _InstrumentedReference(parent) if parent is not None else None
+
+    def child(self, path: str):
+        return _InstrumentedReference(self._reference.child(path))
+
+    def get(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._reference.get(*args, **kwargs)
+        # etag=True の場合は (値, etag) が返る
+        etag = kwargs.get("etag", args[0] if args else False)
+        value = result[0] if etag and isinstance(result, tuple) else result
+        _observe_rtdb("get", self._root, started, read=value)
+        return result
+
+    def set(self, value):
+        started = time.perf_counter()
+        self._reference.set(value)
+        _observe_rtdb("set", self._root, started, written=value)
+
+    def update(self, value):
+        started = time.perf_counter()
+        self._reference.update(value)
+        _observe_rtdb("update", self._root, started, written=value)
+
+    def push(self, value=""):
+        started = time.perf_counter()
+        result = self._reference.push(value)
+        _observe_rtdb("push", self._root, started, written=value)
+        return _InstrumentedReference(result)
+
+    def delete(self):
+        started = time.perf_counter()
+        self._reference.delete()
+        _observe_rtdb("delete", self._root, started)
+
+    def transaction(self, transaction_update: Callable[[Any], Any]):
+        started = time.perf_counter()
+        result = self._reference.transaction(transaction_update)
+        _observe_rtdb("transaction", self._root, started, written=result)
+        return result
+
+    def listen(self, callback: Callable[[Any], None]):
+        root = self._root
+
+        def _counted(event):
+            RTDB_OPERATIONS.labels(operation="event", root=root).inc()
+            _count_rtdb_bytes("read", root, getattr(event, "data", None))
+            callback(event)
+        return self._reference.listen(_counted)
+
+    def order_by_child(self, path: str):
+        return _InstrumentedQuery(self._reference.order_by_child(path), self._root)
+
+    def order_by_key(self):
+        return _InstrumentedQuery(self._reference.order_by_key(), self._root)
+
+    def order_by_value(self):
+        return _InstrumentedQuery(self._reference.order_by_value(), self._root)
+
+
+class InstrumentedDatabase:
+    """db.reference(...) が返す参照の操作を数えるラッパー（それ以外の属性は元のdbにそのまま委譲する）。"""
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name: str):
+        return getattr(self._database, name)
+
+    def reference(self, path: str = "/", *args, **kwargs):
+        return _InstrumentedReference(self._database.reference(path, *args, **kwargs))
+
+
+def instrument_database(database):
+    if not PROMETHEUS_AVAILABLE:
+        return database
+    return InstrumentedDatabase(database)
@@ -0,0 +1,112 @@
+"""
+既存ルームを新しいRTDBレイアウトへ移行するスクリプト。
+
+旧: rooms/{id} に状態・transcript・カウンター類がすべて入っている
+新: rooms/{id}（状態のみ） / transcripts/{id}（発言履歴） / room_meta/{id}（カウンターと処理中フラグ）
+
+使い方:
+    python migrate_room_layout.py              # すべてのルームを移行
+    python migrate_room_layout.py --dry-run    # 書き込まずに移行内容だけ表示
+    python migrate_room_layout.py --room abc   # 指定したルームだけ移行（複数指定可）
+
+何度実行しても安全で、移行済みのルームはスキップする。
+新レイアウトのサーバーが既に transcripts/{id} に書き込んでいた場合は、旧トランスクリプトの後ろに連結する。
+"""
+import argparse
+import os
+
+import firebase_admin
+from firebase_admin import credentials
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# file_utils はインポート時に Firebase Admin SDK を初期化する（main.py と同じ）
+from file_utils import (ROOMS_ROOT, ROOM_META_KEYS, room_path, transcript_path,  # noqa: E402
+                        room_meta_path, transcript_as_list, count_user_entries)
+from rtdb import db, USE_MEMORY_RTDB  # noqa: E402
+
+
+def initialize_firebase():
+    if USE_MEMORY_RTDB or firebase_admin._apps:
+        return
+    database_url = os.getenv('FIREBASE_DATABASE_URL')
+    if not database_url:
+        gcp_project_id = os.getenv('GCP_PROJECT_ID')
+        if not gcp_project_id:
+            raise ValueError(
+                "FIREBASE_DATABASE_URL and GCP_PROJECT_ID not set.")
+        database_url = f"https://{gcp_project_id}-default-rtdb.firebaseio.com"
+        print(f"FIREBASE_DATABASE_URL inferred: {database_url}")
+    cred_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+    cred = credentials.Certificate(cred_path) if cred_path and os.path.exists(
+        cred_path) else credentials.ApplicationDefault()
+    firebase_admin.initialize_app(cred, {'databaseURL': database_url})
+    print("Firebase Admin SDK initialized.")
+
+
+def migrate_room(room_id: str, dry_run: bool = False) -> bool:
+    """1ルームを移行する。移行が必要だった場合は True を返す。"""
+    room_ref = db.reference(room_path(room_id))
+    room_data = room_ref.get()
+    if not isinstance(room_data, dict):
+        print(f"[{room_id}] not found or not an object. Skipped.")
+        return False
+
+    legacy_keys = [key for key in ("transcript",) + ROOM_META_KEYS if key in room_data]
+    if not legacy_keys:
+        print(f"[{room_id}] already migrated.")
+        return False
+
+    legacy_transcript = transcript_as_list(room_data.get("transcript"))
+    current_transcript = transcript_as_list(db.reference(transcript_path(room_id)).get())
+    if current_transcript[:len(legacy_transcript)] == legacy_transcript:
+        # 前回の実行が旧フィールドの削除前に中断した場合
+        merged_transcript = current_transcript
+    else:
+        merged_transcript = legacy_transcript + current_transcript
+
+    current_meta = db.reference(room_meta_path(room_id)).get() or {}
+    meta = {
+        "transcript_length": len(merged_transcript),
+        "user_message_count": count_user_entries(merged_transcript),
+        "last_llm_processed_message_count": max(
+            room_data.get("last_llm_processed_message_count") or 0,
+            current_meta.get("last_llm_processed_message_count") or 0),
+        "is_llm_processing": False,
+    }
+    if meta["user_message_count"] > meta["last_llm_processed_message_count"]:
+        meta["llm_pending_since"] = current_meta.get("llm_pending_since") or room_data.get(
+            "llm_pending_since") or next((entry.get("timestamp") for entry in merged_transcript
+                                          if entry.get("role") != "ai"), None)
+
+    print(f"[{room_id}] transcript: {len(legacy_transcript)} legacy + {len(current_transcript)} new entries, "
+          f"meta: {meta}, removing from rooms/{room_id}: {legacy_keys}")
+    if dry_run:
+        return True
+
+    # 新しい場所へ書き込んでから旧フィールドを削除する（途中で失敗しても再実行で復旧できる順序）
+    if merged_transcript:
+        db.reference(transcript_path(room_id)).set(merged_transcript)
+    db.reference(room_meta_path(room_id)).set(meta)
+    room_ref.update({key: None for key in legacy_keys})
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move transcripts and LLM trigger counters out of rooms/{id}.")
+    parser.add_argument("--room", action="append", dest="rooms",
+                        help="Room ID to migrate (repeatable). Defaults to all rooms.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Show what would be migrated without writing.")
+    args = parser.parse_args()
+
+    initialize_firebase()
+    room_ids = args.rooms or sorted((db.reference(ROOMS_ROOT).get(shallow=True) or {}).keys())
+    migrated = sum(1 for room_id in room_ids if migrate_room(room_id, args.dry_run))
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {migrated} of {len(room_ids)} rooms.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+エージェント用プロンプトの組み立て。
+
+各プロンプトを「静的プレフィックス」（役割・スキーマ・ルール・出力例など、呼び出しごとに変わらない部分）と
+「動的サフィックス」（セッションデータ・会話履歴・指示など）に分ける。
+静的プレフィックスはモジュール読み込み時に1回だけ連結され、どの呼び出しでも同じ文字列になるため、
+プロバイダ側のコンテキストキャッシュ・プレフィックスキャッシュの対象にできる。
+"""
+import hashlib
+import math
+import string
+from typing import Any, Dict, List, Sequence, Tuple
+
+SECTION_SEPARATOR = "\n\n"
+
+# --- 複数のエージェントで共有する断片 ---
+
+# 静的プレフィックス用
+TRANSCRIPT_ERROR_NOTE = "トランスクリプトのため、文字起こしに誤りがある場合があります。推測して補ってください。"
+ANALYZE_INPUTS_JA = "このあとに続く現在の完全なセッションデータ（JSON形式）、過去の会話履歴（参考情報）、そして末尾の「今回対応すべき新しい指示」を分析してください。"
+
+# 動的サフィックス用（str.format の書式）
+SESSION_DATA_SECTION = "現在のセッションデータ:\n```json\n{session_data_json}\n```"
+HISTORY_SECTION = "過去の会話履歴 (参考情報):\n{history}"
+INSTRUCTION_SECTION = "今回対応すべき新しい指示: {instruction}"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数の概算（APIを呼ばずにログ用に見積もる）。
+    ASCIIはおよそ4文字で1トークン、日本語などの非ASCII文字はおよそ1文字で1トークンとして数える。
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 0x7f)
+    return math.ceil((len(text) - non_ascii) / 4 + non_ascii)
+
+
+def _template_fields(template: str) -> List[str]:
+    return [field_name for _, field_name, _, _ in string.Formatter().parse(template) if field_name]
+
+
+class RenderedPrompt:
+    """組み立て済みのプロンプト。静的プレフィックスと動的サフィックスを別々に保持する。"""
+
+    def __init__(self, template: "PromptTemplate", dynamic_sections: List[Tuple[str, str]]):
+        self.template = template
+        self.dynamic_sections = dynamic_sections
+        self.dynamic_suffix = SECTION_SEPARATOR.join(
+            text for _, text in dynamic_sections)
+
+    @property
+    def name(self) -> str:
+        return self.template.name
+
+    @property
+    def static_prefix(self) -> str:
+        return self.template.static_prefix
+
+    @property
+    def text(self) -> str:
+        return SECTION_SEPARATOR.join(part for part in (self.static_prefix, self.dynamic_suffix) if part)
+
+    def section_token_counts(self) -> Dict[str, int]:
+        """セクションごとの概算トークン数（静的セクション → 動的セクションの順）。"""
+        counts = dict(self.template.static_token_counts)
+        for section_name, text in self.dynamic_sections:
+            counts[section_name] = estimate_tokens(text)
+        return counts
+
+    def token_summary(self) -> str:
+        counts = self.section_token_counts()
+        sections = ", ".join(f"{section_name}={count}" for section_name, count in counts.items())
+        return (f"{self.name}: static~{self.template.static_tokens} + dynamic~{estimate_tokens(self.dynamic_suffix)} tokens "
+                f"({sections})")
+
+
+class PromptTemplate:
+    """
+    名前付きセクションから組み立てるプロンプトテンプレート。
+
+    static_sections はそのままの文字列（書式指定を含まない）で、連結結果を static_prefix として保持する。
+    dynamic_sections は str.format の書式で、render() のたびに埋め込む。
+    埋め込んだ結果が空になった動的セクションは出力しない。
+    """
+
+    def __init__(self, name: str, static_sections: Sequence[Tuple[str, str]], dynamic_sections: Sequence[Tuple[str, str]]):
+        self.name = name
+        self.static_sections = [(section_name, text.strip("\n"))
+                                for section_name, text in static_sections]
+        self.dynamic_sections = [(section_name, template.strip("\n"))
+                                 for section_name, template in dynamic_sections]
+        self.static_prefix = SECTION_SEPARATOR.join(
+            text for _, text in self.static_sections)
+        self.static_token_counts = {section_name: estimate_tokens(text)
+                                    for section_name, text in self.static_sections}
+        self.static_tokens = estimate_tokens(self.static_prefix)
+        # 静的プレフィックスの内容が変わったことを検知するためのバージョン
+        self.version = hashlib.sha256(
+            self.static_prefix.encode("utf-8")).hexdigest()[:12]
+        self.fields = sorted({field_name for _, template in self.dynamic_sections
+                              for field_name in _template_fields(template)})
+
+    def render(self, **values: Any) -> RenderedPrompt:
+        missing = [field_name for field_name in self.fields if field_name not in values]
+        if missing:
+            raise KeyError(
+                f"Prompt template '{self.name}' is missing values for: {', '.join(missing)}")
+        rendered_sections = []
+        for section_name, template in self.dynamic_sections:
+            text = template.format(**values).strip("\n")
+            if text:
+                rendered_sections.append((section_name, text))
+        return RenderedPrompt(self, rendered_sections)
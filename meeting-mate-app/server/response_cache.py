@@ -0,0 +1,123 @@
+"""
+エージェントの実行結果のキャッシュ。
+
+再送・トリガーの重複などで、同じルーム状態に対して同じ指示が再びディスパッチされた場合に、
+エージェント（LLM呼び出し）を実行せずに前回の結果を返す。
+キーは（エージェント, モデル, 正規化した指示, エージェントが参照するコンテキスト）のハッシュで、
+ルーム状態や会話履歴が少しでも変わればキーも変わる。LRUとTTLで上限を設ける。
+キャッシュするのは、エージェントがLLM応答の取得と解析に成功したことを mark_agent_succeeded() で示した結果だけ
+（LLM利用不可・応答不正・エラー時のフォールバックの結果はキャッシュしない）。
+"""
+import contextvars
+import copy
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import AGENT_RESPONSE_CACHE_ENABLED, AGENT_RESPONSE_CACHE_MAX_ENTRIES, AGENT_RESPONSE_CACHE_TTL_SECONDS
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# エージェントの実行が成功したか（process_single_agent が実行ごとにリセットし、エージェントが成功時に立てる）
+_agent_succeeded: contextvars.ContextVar[bool] = contextvars.ContextVar("agent_succeeded", default=False)
+
+
+def normalize_instruction(instruction: str) -> str:
+    """全角/半角の揺れと空白の違いを吸収する。"""
+    normalized = unicodedata.normalize("NFKC", instruction or "")
+    return _WHITESPACE_RE.sub(" ", normalized).strip()
+
+
+def reset_agent_succeeded():
+    _agent_succeeded.set(False)
+
+
+def mark_agent_succeeded():
+    """エージェントがLLM応答（または決定的なパターン処理）から更新後のデータを作れたときに呼ぶ。"""
+    _agent_succeeded.set(True)
+
+
+def agent_succeeded() -> bool:
+    return _agent_succeeded.get()
+
+
+class AgentResponseCache:
+    """エージェント結果のLRU + TTLキャッシュ。"""
+
+    def __init__(self, max_entries: int = AGENT_RESPONSE_CACHE_MAX_ENTRIES, ttl_seconds: float = AGENT_RESPONSE_CACHE_TTL_SECONDS,
+                 enabled: bool = AGENT_RESPONSE_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        # key -> (expires_at, data, message)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @staticmethod
+    def make_key(agent_name: str, model_name: str, instruction: str, context: Dict[str, Any]) -> str:
+        payload = json.dumps([agent_name, model_name, normalize_instruction(instruction), context],
+                             ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            expires_at, data, message = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return copy.deepcopy(data), message
+
+    def put(self, key: str, data: Dict[str, Any], message: str):
+        """成功した結果だけを渡すこと（呼び出し側で agent_succeeded() を確認する）。"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(data), message)
+            self._entries.move_to_end(key)
+            self._stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "maxEntries": self.max_entries,
+                "ttlSeconds": self.ttl_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hitRate": (self._hits / lookups) if lookups else 0.0,
+                "stores": self._stores,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+
+agent_response_cache = AgentResponseCache()
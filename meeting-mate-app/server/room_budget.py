@@ -0,0 +1,136 @@
+"""
+ルームごとのトークン予算と段階的な機能縮退。
+
+orchestrate_agents の開始時に、ルームの使用量（token_usage の会議全体・直近1時間のトークン数）を予算と比べて段階を決める。
+予算に対する使用率が ROOM_BUDGET_TIER_THRESHOLDS を超えるごとに、次の順で縮退する（前の段階の縮退も続ける）。
+  1. no_diagram   : OverviewDiagramAgent を呼び出さない
+  2. cheap_model  : ROOM_BUDGET_FALLBACK_MODEL（安価なモデル）に切り替える
+  3. slow_trigger : トリガーに必要な発言数を ROOM_BUDGET_TRIGGER_MULTIPLIER 倍にする
+予算を使い切っても処理は止めず、最後の段階のまま続ける。
+現在の段階と使用率は room_meta/{room_id}/budget に書き込み、UIに表示できるようにする
+（段階が変わったとき、または使用率が BUDGET_META_RATIO_STEP 以上変わったときだけ書く）。
+予算は ROOM_TOKEN_BUDGET_PER_HOUR / ROOM_TOKEN_BUDGET_PER_MEETING を既定とし、
+room_secrets/{room_id}/token_budget の perHour / perMeeting で上書きできる（0 は無制限）。
+"""
+from datetime import datetime
+from typing import Any, Dict, Tuple
+
+from config import (logger, LLM_TRIGGER_MESSAGE_COUNT, ROOM_TOKEN_BUDGET_PER_HOUR, ROOM_TOKEN_BUDGET_PER_MEETING,
+                    ROOM_BUDGET_TIER_THRESHOLDS, ROOM_BUDGET_FALLBACK_MODEL, ROOM_BUDGET_TRIGGER_MULTIPLIER)
+from file_utils import room_meta_path
+from room_state_cache import room_meta_cache
+from rtdb import db
+from token_usage import TokenUsageAccountant, token_usage
+
+BUDGET_TIERS = ("normal", "no_diagram", "cheap_model", "slow_trigger")
+TIER_NORMAL, TIER_NO_DIAGRAM, TIER_CHEAP_MODEL, TIER_SLOW_TRIGGER = range(len(BUDGET_TIERS))
+DIAGRAM_AGENT_NAME = "OverviewDiagramAgent"
+BUDGET_META_RATIO_STEP = 0.05
+
+
+def parse_tier_thresholds(value: str) -> Tuple[float, ...]:
+    """"0.5,0.75,0.9" を段階1〜3の開始使用率にする（不正な値は既定に戻す）。"""
+    try:
+        thresholds = tuple(float(item) for item in (value or "").split(","))
+    except ValueError:
+        thresholds = ()
+    if len(thresholds) != len(BUDGET_TIERS) - 1 or list(thresholds) != sorted(thresholds):
+        logger.warning(f"Invalid ROOM_BUDGET_TIER_THRESHOLDS '{value}'. Using 0.5,0.75,0.9.")
+        return (0.5, 0.75, 0.9)
+    return thresholds
+
+
+_tier_thresholds = parse_tier_thresholds(ROOM_BUDGET_TIER_THRESHOLDS)
+
+
+class BudgetDecision:
+    def __init__(self, tier: int = TIER_NORMAL, meeting_tokens: int = 0, hour_tokens: int = 0,
+                 meeting_budget: int = 0, hour_budget: int = 0, usage_ratio: float = 0.0):
+        self.tier = tier
+        self.meeting_tokens = meeting_tokens
+        self.hour_tokens = hour_tokens
+        self.meeting_budget = meeting_budget
+        self.hour_budget = hour_budget
+        self.usage_ratio = usage_ratio
+
+    @property
+    def tier_name(self) -> str:
+        return BUDGET_TIERS[self.tier]
+
+    def drops_agent(self, agent_name: str) -> bool:
+        return self.tier >= TIER_NO_DIAGRAM and agent_name == DIAGRAM_AGENT_NAME
+
+    def model_for(self, model_name: str) -> str:
+        if self.tier >= TIER_CHEAP_MODEL and ROOM_BUDGET_FALLBACK_MODEL:
+            return ROOM_BUDGET_FALLBACK_MODEL
+        return model_name
+
+    def to_meta(self) -> Dict[str, Any]:
+        """room_meta/{room_id}/budget に書き込む値（UI向け）。"""
+        return {
+            "tier": self.tier,
+            "tierName": self.tier_name,
+            "usageRatio": round(self.usage_ratio, 3),
+            "meetingTokens": self.meeting_tokens,
+            "hourTokens": self.hour_tokens,
+            "meetingBudget": self.meeting_budget,
+            "hourBudget": self.hour_budget,
+            "updatedAt": datetime.utcnow().isoformat() + "Z",
+        }
+
+
+def room_token_budget(room_id: str) -> Tuple[int, int]:
+    """(1時間あたり, 会議全体) のトークン予算。room_secrets の設定があればそちらを使う。"""
+    per_hour, per_meeting = ROOM_TOKEN_BUDGET_PER_HOUR, ROOM_TOKEN_BUDGET_PER_MEETING
+    override = db.reference(f"room_secrets/{room_id}/token_budget").get()
+    if isinstance(override, dict):
+        try:
+            per_hour = int(override.get("perHour", per_hour) or 0)
+            per_meeting = int(override.get("perMeeting", per_meeting) or 0)
+        except (TypeError, ValueError):
+            logger.warning(f"[{room_id}] Invalid token_budget in room_secrets: {override}. Using the defaults.")
+    return per_hour, per_meeting
+
+
+def evaluate_room_budget(room_id: str, usage: TokenUsageAccountant = token_usage) -> BudgetDecision:
+    per_hour, per_meeting = room_token_budget(room_id)
+    if per_hour <= 0 and per_meeting <= 0:
+        return BudgetDecision()
+    meeting_tokens, hour_tokens = usage.budget_usage(room_id)
+    ratios = []
+    if per_hour > 0:
+        ratios.append(hour_tokens / per_hour)
+    if per_meeting > 0:
+        ratios.append(meeting_tokens / per_meeting)
+    usage_ratio = max(ratios)
+    tier = sum(1 for threshold in _tier_thresholds if usage_ratio >= threshold)
+    return BudgetDecision(tier, meeting_tokens, hour_tokens, per_meeting, per_hour, usage_ratio)
+
+
+def publish_budget_state(room_id: str, decision: BudgetDecision):
+    """段階または使用率が変わったときだけ room_meta/{room_id}/budget を書き換える。"""
+    current = room_meta_cache.get_child(room_id, "budget")
+    if not isinstance(current, dict):
+        if decision.tier == TIER_NORMAL and not (decision.hour_budget or decision.meeting_budget):
+            return  # 予算が設定されていないルーム
+        current = {}
+    tier_changed = current.get("tier", TIER_NORMAL) != decision.tier
+    if not tier_changed and current and abs((current.get("usageRatio") or 0) - decision.usage_ratio) < BUDGET_META_RATIO_STEP:
+        return
+    value = decision.to_meta()
+    db.reference(f"{room_meta_path(room_id)}/budget").set(value)
+    room_meta_cache.apply_local_write(room_id, "budget", value)
+    if not tier_changed:
+        return
+    logger.info(
+        f"[{room_id}] Token budget tier changed to {decision.tier_name} "
+        f"(usage {decision.usage_ratio:.0%}, hour {decision.hour_tokens}/{decision.hour_budget}, "
+        f"meeting {decision.meeting_tokens}/{decision.meeting_budget}).")
+
+
+def trigger_message_count(room_id: str) -> int:
+    """トリガーに必要な新しい発言数。最後の段階では ROOM_BUDGET_TRIGGER_MULTIPLIER 倍にする。"""
+    budget = room_meta_cache.get_child(room_id, "budget")
+    if isinstance(budget, dict) and (budget.get("tier") or 0) >= TIER_SLOW_TRIGGER:
+        return LLM_TRIGGER_MESSAGE_COUNT * max(ROOM_BUDGET_TRIGGER_MULTIPLIER, 1)
+    return LLM_TRIGGER_MESSAGE_COUNT
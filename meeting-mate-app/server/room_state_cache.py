@@ -0,0 +1,266 @@
+"""
+アクティブなルームのデータをプロセス内に保持するキャッシュ。
+
+ルームを初めて読むときに {root}/{id}（rooms / transcripts / room_meta）へ
+RTDBのストリーミングリスナーを張り、
+以降の変更イベント（put/patch）でメモリ上のスナップショットを更新し続ける。
+読み出しはメモリから返し、ルーム数とおおよそのメモリ使用量の上限を超えたら
+最も長く使われていないルームのリスナーを閉じて破棄する（LRU）。
+リスナーの初回スナップショットが届く前の読み出しは、イベントループ上では待たずにRTDBから直接読む
+（待つとそのルームだけでなく全ルームの処理が止まるため）。待つのはワーカースレッドからの読み出しだけ。
+"""
+import asyncio
+import copy
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from config import logger, ROOM_CACHE_ENABLED, ROOM_CACHE_MAX_ROOMS, ROOM_CACHE_MAX_BYTES, ROOM_CACHE_WARMUP_TIMEOUT
+from file_utils import ROOMS_ROOT, TRANSCRIPTS_ROOT, ROOM_META_ROOT
+from rtdb import db
+
+
+def _estimate_size(value: Any) -> int:
+    if value is None:
+        return 0
+    try:
+        return len(json.dumps(value, ensure_ascii=False))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _split_path(path: str) -> List[str]:
+    return [segment for segment in (path or "").split("/") if segment]
+
+
+def _get_at(root: Any, segments: List[str]) -> Any:
+    node = root
+    for segment in segments:
+        if isinstance(node, dict):
+            node = node.get(segment)
+        elif isinstance(node, list) and segment.isdigit() and int(segment) < len(node):
+            node = node[int(segment)]
+        else:
+            return None
+    return node
+
+
+def _set_at(root: Any, segments: List[str], value: Any) -> Any:
+    """root の segments の位置を value に置き換えた結果を返す（value が None なら削除）。"""
+    if not segments:
+        return value
+    head, rest = segments[0], segments[1:]
+    if isinstance(root, list) and head.isdigit():
+        index = int(head)
+        if index < len(root):
+            root[index] = _set_at(root[index], rest, value)
+            return root
+        if value is None:
+            return root
+        # リストの末尾への追記（トランスクリプト）以外は辞書として扱う
+        if index == len(root):
+            root.append(_set_at(None, rest, value))
+            return root
+        root = {str(i): item for i, item in enumerate(root)}
+    if root is None and head == "0" and value is not None:
+        # 空のトランスクリプトへの最初の追記
+        return [_set_at(None, rest, value)]
+    if not isinstance(root, dict):
+        if value is None:
+            return root
+        root = {}
+    child = _set_at(root.get(head), rest, value)
+    if child is None:
+        root.pop(head, None)
+    else:
+        root[head] = child
+    return root
+
+
+class _CachedRoom:
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.data: Any = None
+        self.size = 0
+        self.ready = threading.Event()
+        self.registration = None
+
+
+class RoomStateCache:
+    """{root}/{ルームID} ごとのスナップショットと、それを最新に保つリスナーを管理する。"""
+
+    def __init__(self, root: str = ROOMS_ROOT, max_rooms: int = ROOM_CACHE_MAX_ROOMS, max_bytes: int = ROOM_CACHE_MAX_BYTES,
+                 warmup_timeout: float = ROOM_CACHE_WARMUP_TIMEOUT, enabled: bool = ROOM_CACHE_ENABLED):
+        self.root = root
+        self.max_rooms = max_rooms
+        self.max_bytes = max_bytes
+        self.warmup_timeout = warmup_timeout
+        self.enabled = enabled
+        self._rooms: "OrderedDict[str, _CachedRoom]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._total_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._listener_events = 0
+        self._listener_errors = 0
+
+    # --- 読み出し ---
+
+    def get(self, room_id: str, exclude: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+        """{root}/{room_id} 全体のスナップショットのコピーを返す。exclude のトップレベルキーはコピーしない。"""
+        excluded = set(exclude)
+
+        def _copy(data):
+            if not isinstance(data, dict):
+                return copy.deepcopy(data)
+            return {key: copy.deepcopy(value) for key, value in data.items() if key not in excluded}
+        return self._read(room_id, _copy)
+
+    def get_child(self, room_id: str, path: str) -> Any:
+        """{root}/{room_id}/{path} の値のコピーを返す。"""
+        segments = _split_path(path)
+        return self._read(room_id, lambda data: copy.deepcopy(_get_at(data, segments)))
+
+    def _read(self, room_id: str, extract: Callable[[Any], Any]) -> Any:
+        """
+        キャッシュ済みのスナップショットに extract を適用して返す。
+        リスナースレッドが同時に更新するため、コピーはロックを保持したまま行う。
+        """
+        if not self.enabled:
+            return extract(db.reference(f"{self.root}/{room_id}").get())
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is not None and room.ready.is_set():
+                self._hits += 1
+                self._rooms.move_to_end(room_id)
+                return extract(room.data)
+            self._misses += 1
+            if room is None:
+                room = self._start_listener(room_id)
+
+        if room is not None and not _on_event_loop() and room.ready.wait(self.warmup_timeout):
+            with self._lock:
+                if self._rooms.get(room_id) is room:
+                    return extract(room.data)
+        # リスナーが使えない・初回イベントがまだ届いていない場合は直接読む
+        logger.info(
+            f"[{room_id}] {self.root} cache not ready. Reading from RTDB directly.")
+        return extract(db.reference(f"{self.root}/{room_id}").get())
+
+    # --- 書き込みの反映 ---
+
+    def apply_local_write(self, room_id: str, path: str, value: Any):
+        """
+        サーバー自身が書き込んだ値をリスナーのイベントを待たずに反映する（write-through）。
+        キャッシュしていないルームへの書き込みは無視する。
+        """
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None or not room.ready.is_set():
+                return
+            self._apply(room, _split_path(path), copy.deepcopy(value))
+
+    def invalidate(self, room_id: str):
+        with self._lock:
+            room = self._rooms.pop(room_id, None)
+            if room is not None:
+                self._release(room)
+
+    def close_all(self):
+        with self._lock:
+            while self._rooms:
+                _, room = self._rooms.popitem(last=False)
+                self._release(room)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "root": self.root,
+                "enabled": self.enabled,
+                "rooms": len(self._rooms),
+                "approxBytes": self._total_bytes,
+                "maxRooms": self.max_rooms,
+                "maxBytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hitRate": (self._hits / lookups) if lookups else 0.0,
+                "evictions": self._evictions,
+                "listenerEvents": self._listener_events,
+                "listenerErrors": self._listener_errors,
+            }
+
+    # --- 内部処理 ---
+
+    def _start_listener(self, room_id: str) -> Optional[_CachedRoom]:
+        room = _CachedRoom(room_id)
+        self._rooms[room_id] = room
+        try:
+            room.registration = db.reference(f"{self.root}/{room_id}").listen(
+                lambda event: self._on_event(room, event))
+        except Exception as e:
+            self._listener_errors += 1
+            self._rooms.pop(room_id, None)
+            logger.error(f"[{room_id}] Failed to start {self.root} cache listener: {e}")
+            return None
+        logger.info(f"[{room_id}] {self.root} cache listener started.")
+        self._evict_if_needed()
+        return room
+
+    def _on_event(self, room: _CachedRoom, event):
+        with self._lock:
+            if self._rooms.get(room.room_id) is not room:
+                return  # 破棄済みのルームへの遅延イベント
+            self._listener_events += 1
+            segments = _split_path(event.path)
+            if event.event_type == "put":
+                self._apply(room, segments, event.data)
+            elif event.event_type == "patch" and isinstance(event.data, dict):
+                for key, value in event.data.items():
+                    self._apply(room, segments + _split_path(key), value)
+            room.ready.set()
+            self._evict_if_needed()
+
+    def _apply(self, room: _CachedRoom, segments: List[str], value: Any):
+        # 変更されたサブツリーだけでサイズの増減を見積もる
+        delta = _estimate_size(value) - _estimate_size(_get_at(room.data, segments))
+        room.data = _set_at(room.data, segments, value)
+        room.size += delta
+        self._total_bytes += delta
+
+    def _evict_if_needed(self):
+        while len(self._rooms) > 1 and (len(self._rooms) > self.max_rooms or self._total_bytes > self.max_bytes):
+            room_id, room = self._rooms.popitem(last=False)
+            self._evictions += 1
+            self._release(room)
+            logger.info(f"[{room_id}] Evicted from {self.root} cache.")
+
+    def _release(self, room: _CachedRoom):
+        self._total_bytes -= room.size
+        room.ready.set()  # 待機中の読み出しを解放する
+        if room.registration is not None:
+            # close() はリスナースレッドの終了を待つため、ロック外の別スレッドで閉じる
+            threading.Thread(target=self._close_registration,
+                             args=(room.registration,), daemon=True).start()
+
+    @staticmethod
+    def _close_registration(registration):
+        try:
+            registration.close()
+        except Exception as e:
+            logger.warning(f"Failed to close room cache listener: {e}")
+
+
+room_state_cache = RoomStateCache(ROOMS_ROOT)
+transcript_cache = RoomStateCache(TRANSCRIPTS_ROOT)
+room_meta_cache = RoomStateCache(ROOM_META_ROOT)
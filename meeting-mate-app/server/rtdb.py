@@ -0,0 +1,37 @@
+"""
+RTDBアクセスの切り替え。
+
+サーバーのモジュールは firebase_admin.db の代わりにここの `db` を使う。
+RTDB_BACKEND=memory のときはプロセス内のインメモリ実装（memory_rtdb）を、
+それ以外は firebase_admin.db をそのまま返すため、呼び出し側は db.reference(...) のまま変わらない。
+メトリクスが有効な場合は、操作の回数・時間・バイト数を数えるラッパー（metrics.instrument_database）で包む。
+"""
+import firebase_admin
+
+from metrics import instrument_database
+from config import logger, RTDB_BACKEND, RTDB_MEMORY_LATENCY_MS, RTDB_MEMORY_LATENCY_OVERRIDES, RTDB_MEMORY_SEED_PATH
+
+USE_MEMORY_RTDB = RTDB_BACKEND == "memory"
+
+if USE_MEMORY_RTDB:
+    from memory_rtdb import InMemoryDatabase, parse_latency_overrides
+
+    _memory_options = {
+        "latency_ms": RTDB_MEMORY_LATENCY_MS,
+        "latency_overrides": parse_latency_overrides(RTDB_MEMORY_LATENCY_OVERRIDES),
+    }
+    db = (InMemoryDatabase.from_json_file(RTDB_MEMORY_SEED_PATH, **_memory_options)
+          if RTDB_MEMORY_SEED_PATH else InMemoryDatabase(**_memory_options))
+    logger.info(
+        f"Using in-memory RTDB (latency {RTDB_MEMORY_LATENCY_MS} ms, overrides: {_memory_options['latency_overrides']}).")
+else:
+    if RTDB_BACKEND != "firebase":
+        logger.warning(f"Unknown RTDB_BACKEND '{RTDB_BACKEND}'. Using Firebase.")
+    from firebase_admin import db
+
+db = instrument_database(db)
+
+
+def rtdb_initialized() -> bool:
+    """DB操作が可能な状態か（インメモリ実装は常に可能、Firebaseは Admin SDK の初期化が必要）。"""
+    return USE_MEMORY_RTDB or bool(firebase_admin._apps)
@@ -0,0 +1,70 @@
+"""
+エージェント出力の書き込み要否を内容のハッシュで判定する。
+
+RTDBは None の値や空のオブジェクト/配列を保存しないため、それらを取り除いた正規形で比較し、
+ルームの現在の値（リスナーで最新に保たれたスナップショット）と同じ内容の書き込みは行わない。
+同じ内容を set() し直すとクライアント側でリスナーが発火し、画面全体の再描画が起きるため。
+"""
+import hashlib
+import json
+import threading
+from typing import Any, Dict
+
+from metrics import record_section_write
+
+
+def normalize_section_value(value: Any) -> Any:
+    """RTDBに保存された場合と同じ形になるよう、None と空のコンテナを再帰的に取り除く。"""
+    if isinstance(value, dict):
+        normalized = {}
+        for key, item in value.items():
+            item = normalize_section_value(item)
+            if item is not None:
+                normalized[str(key)] = item
+        return normalized or None
+    if isinstance(value, (list, tuple)):
+        items = [normalize_section_value(item) for item in value]
+        if not any(item is not None for item in items):
+            return None
+        # RTDBは途中の欠番を保持しないため、末尾の None だけを落とす
+        while items and items[-1] is None:
+            items.pop()
+        return items
+    return value
+
+
+def section_hash(value: Any) -> str:
+    payload = json.dumps(normalize_section_value(value), ensure_ascii=False,
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SectionWriteStats:
+    """書き込み・スキップした回数（セクションごと）。"""
+
+    def __init__(self):
+        self._written: Dict[str, int] = {}
+        self._skipped: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, section: str, written: bool):
+        record_section_write(section, written)
+        with self._lock:
+            counts = self._written if written else self._skipped
+            counts[section] = counts.get(section, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            written = sum(self._written.values())
+            skipped = sum(self._skipped.values())
+            total = written + skipped
+            return {
+                "written": written,
+                "skipped": skipped,
+                "skipRate": (skipped / total) if total else 0.0,
+                "writtenBySection": dict(self._written),
+                "skippedBySection": dict(self._skipped),
+            }
+
+
+section_write_stats = SectionWriteStats()
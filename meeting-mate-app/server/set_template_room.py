@@ -56,8 +56,6 @@ try:
             "details": []
         },
         "suggestedNextTopics": [],
-        "transcript": [],
-        "last_llm_processed_message_count": 0,
         "representativeMode": False
     }
 
@@ -0,0 +1,200 @@
+"""
+ノート・タスクの近似重複を検出するルーム単位の類似度インデックス。
+
+日本語向けに文字n-gramのシングルを使い、MinHash署名 + LSHバンディングで候補を絞り込んでから
+正確なJaccard係数で判定する。署名はアイテムIDとテキストが変わらない限り再計算しない。
+文字n-gramでは「4月リリース準備」と「5月リリース準備」のように数字だけが違うものも似てしまうため、
+テキスト中の数字が一致しないアイテムは重複とみなさない。
+"""
+import random
+import re
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, List, Tuple
+
+from config import logger, NEAR_DUPLICATE_THRESHOLD, NEAR_DUPLICATE_ACTION
+
+NGRAM_SIZE = 2
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+MAX_INDEXED_COLLECTIONS = 512
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240520)  # プロセス間で同じ署名になるよう固定シード
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(NUM_PERMUTATIONS)]
+
+_IGNORED_CHARS_RE = re.compile(r"[\s\W_]+", re.UNICODE)
+_HIRAGANA_RE = re.compile(r"[ぁ-ゟ]+")
+_NUMBER_RE = re.compile(r"\d+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    比較用にテキストを正規化する。
+    送り仮名や助詞の揺れ（「作成」と「を作成する」）を吸収するため、
+    ひらがなを除いても十分な内容が残る場合はひらがなを取り除く。
+    """
+    normalized = _IGNORED_CHARS_RE.sub(
+        "", unicodedata.normalize("NFKC", text or "").lower())
+    content = _HIRAGANA_RE.sub("", normalized)
+    if len(content) >= 4 and len(content) * 2 >= len(normalized):
+        return content
+    return normalized
+
+
+def numbers_in(text: str) -> Tuple[str, ...]:
+    """テキスト中の数字（全角は半角に揃え、先頭の0は無視する）を出現順に返す。"""
+    return tuple(number.lstrip("0") or "0"
+                 for number in _NUMBER_RE.findall(unicodedata.normalize("NFKC", text or "")))
+
+
+def shingles(text: str, n: int = NGRAM_SIZE) -> FrozenSet[str]:
+    normalized = normalize_text(text)
+    if len(normalized) <= n:
+        return frozenset([normalized]) if normalized else frozenset()
+    return frozenset(normalized[i:i + n] for i in range(len(normalized) - n + 1))
+
+
+def minhash_signature(shingle_set: FrozenSet[str]) -> Tuple[int, ...]:
+    if not shingle_set:
+        return tuple([_MERSENNE_PRIME] * NUM_PERMUTATIONS)
+    hashed = [zlib.crc32(s.encode("utf-8")) for s in shingle_set]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashed) for a, b in _PERMUTATIONS)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _band_keys(signature: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+    return [(band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]) for band in range(LSH_BANDS)]
+
+
+def merge_near_duplicate(kept: Dict[str, Any], duplicate: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    重複アイテムの情報を残す側に統合する（欠けているフィールドを補い、より詳しい説明を採用）。
+    状態（status）は残す側のものを変えない（重複側が完了でも、残す側の未完了のタスクを完了にしない）。
+    """
+    merged = dict(kept)
+    for key, value in duplicate.items():
+        if key in ("id", "status") or value in (None, ""):
+            continue
+        current = merged.get(key)
+        if current in (None, ""):
+            merged[key] = value
+        elif key in ("text", "detail") and isinstance(value, str) and isinstance(current, str) \
+                and len(value) > len(current):
+            merged[key] = value
+    return merged
+
+
+class NearDuplicateIndex:
+    """1ルーム・1コレクション分のMinHashインデックス。"""
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        # item_id -> (text, shingles, signature, numbers)
+        self._entries: Dict[str, Tuple[str, FrozenSet[str], Tuple[int, ...], Tuple[str, ...]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _entry_for(self, item_id: str, text: str):
+        cached = self._entries.get(item_id)
+        if cached and cached[0] == text:
+            return cached
+        shingle_set = shingles(text)
+        return (text, shingle_set, minhash_signature(shingle_set), numbers_in(text))
+
+    def deduplicate(self, items: Dict[str, Dict[str, Any]], text_of: Callable[[Dict[str, Any]], str], action: str = NEAR_DUPLICATE_ACTION) -> Tuple[Dict[str, Dict[str, Any]], List[Tuple[str, str, float]]]:
+        """
+        近似重複を統合（action="merge"）またはフラグ付け（action="flag"）した結果と、
+        検出した (重複ID, 残したID, 類似度) のリストを返す。
+        既にコミット済みのIDを優先して残し、新規アイテムを既存側へ統合する。
+        """
+        positions = {item_id: pos for pos, item_id in enumerate(items)}
+        ordered_ids = sorted(items, key=lambda i: (
+            i not in self._entries, positions[i]))
+        buckets: Dict[Tuple[int, Tuple[int, ...]], List[str]] = {}
+        new_entries = {}
+        result: Dict[str, Dict[str, Any]] = {}
+        duplicates: List[Tuple[str, str, float]] = []
+
+        for item_id in ordered_ids:
+            item = items[item_id]
+            entry = self._entry_for(item_id, text_of(item) or "")
+            keys = _band_keys(entry[2])
+
+            best_id, best_score = None, 0.0
+            for candidate_id in {c for key in keys for c in buckets.get(key, [])}:
+                if new_entries[candidate_id][3] != entry[3]:
+                    continue  # 日付・番号などの数字が違うものは別のアイテム
+                score = jaccard(entry[1], new_entries[candidate_id][1])
+                if score > best_score:
+                    best_id, best_score = candidate_id, score
+
+            if best_id is not None and best_score >= self.threshold:
+                duplicates.append((item_id, best_id, best_score))
+                if action == "merge":
+                    result[best_id] = merge_near_duplicate(
+                        result[best_id], item)
+                    continue
+                item = {**item, "duplicateOf": best_id}
+
+            result[item_id] = item
+            new_entries[item_id] = entry
+            for key in keys:
+                buckets.setdefault(key, []).append(item_id)
+
+        self._entries = new_entries
+        # 元の順序を維持して返す
+        return {i: result[i] for i in items if i in result}, duplicates
+
+
+class RoomSimilarityIndexes:
+    """ルームIDとコレクション名ごとにインデックスを保持する（LRUで上限付き）。"""
+
+    def __init__(self, max_entries: int = MAX_INDEXED_COLLECTIONS):
+        self.max_entries = max_entries
+        self._indexes: "OrderedDict[Tuple[str, str], NearDuplicateIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, room_id: str, collection: str) -> NearDuplicateIndex:
+        key = (room_id, collection)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = NearDuplicateIndex()
+                self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+            return index
+
+
+room_similarity_indexes = RoomSimilarityIndexes()
+
+# コレクションごとの比較対象テキスト
+COLLECTION_TEXT_FIELDS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    "tasks": lambda item: item.get("title", ""),
+    "notes": lambda item: item.get("text", ""),
+}
+
+
+def deduplicate_collection(room_id: str, collection: str, items: Any) -> Tuple[Any, List[Tuple[str, str, float]]]:
+    """コミット前にルームのタスク/ノートから近似重複を取り除く。対象外のデータはそのまま返す。"""
+    text_of = COLLECTION_TEXT_FIELDS.get(collection)
+    if text_of is None or not isinstance(items, dict) or NEAR_DUPLICATE_ACTION == "off":
+        return items, []
+    deduplicated, duplicates = room_similarity_indexes.get(
+        room_id, collection).deduplicate(items, text_of)
+    for duplicate_id, kept_id, score in duplicates:
+        logger.info(
+            f"[{room_id}] Near-duplicate {collection} item {duplicate_id} ~ {kept_id} (jaccard={score:.2f}, action={NEAR_DUPLICATE_ACTION})")
+    return deduplicated, duplicates
@@ -0,0 +1,283 @@
+"""
+LLM呼び出しのトークン使用量と概算コストの集計。
+
+LLMClient がすべての呼び出しの usage_metadata（入力・出力・キャッシュ済み・思考トークン数）を
+ルーム × エージェント × モデルごとにメモリ上で加算する。エージェントはプロンプト名で判別し、
+エージェントの中で組み立てた文字列のプロンプト（概要図の修復など）は process_single_agent が設定したエージェント名に付ける。
+RTDBへは呼び出しのたびではなく、TOKEN_USAGE_FLUSH_INTERVAL_SECONDS ごとに前回からの差分を
+ルームごとに1回のトランザクションで room_usage/{room_id} に加算する（複数インスタンスでも合計が失われない）。
+予算の判定用に、トークン数は1時間ごとのバケット（hourly/{YYYYMMDDHH}）にも加算する。
+"""
+import asyncio
+import contextvars
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import logger, LLM_TOKEN_PRICES, TOKEN_USAGE_FLUSH_INTERVAL_SECONDS
+from file_utils import room_usage_path
+from rtdb import db
+
+COUNTER_KEYS = ("calls", "promptTokens", "outputTokens", "cachedTokens", "thoughtsTokens", "costUsd")
+# room_usage/{id}/hourly に残す時間バケットの数
+HOURLY_BUCKETS_KEPT = 48
+
+# 実行中のエージェント名（process_single_agent がタスクごとに設定する）
+usage_agent: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("usage_agent", default=None)
+
+
+def parse_token_prices(value: str) -> List[Tuple[str, Tuple[float, float, float]]]:
+    """"gemini-2.5-flash=0.30/2.50/0.075" を (モデル名の接頭辞, (入力, 出力, キャッシュ済み)) のリストにする（長い接頭辞を優先）。"""
+    prices = []
+    for item in (value or "").split(","):
+        model, separator, rates = item.partition("=")
+        try:
+            input_rate, output_rate, cached_rate = (float(rate) for rate in rates.split("/"))
+        except ValueError:
+            if item.strip():
+                logger.warning(f"Ignoring invalid LLM_TOKEN_PRICES entry: '{item}'")
+            continue
+        if separator and model.strip():
+            prices.append((model.strip(), (input_rate, output_rate, cached_rate)))
+    return sorted(prices, key=lambda pair: len(pair[0]), reverse=True)
+
+
+def _empty_counters() -> Dict[str, Any]:
+    return {key: 0.0 if key == "costUsd" else 0 for key in COUNTER_KEYS}
+
+
+def _add_counters(target: Dict[str, Any], delta: Dict[str, Any]):
+    for key in COUNTER_KEYS:
+        target[key] = (target.get(key) or 0) + (delta.get(key) or 0)
+    target["costUsd"] = round(target["costUsd"], 6)
+
+
+def billed_tokens(counters: Dict[str, Any]) -> int:
+    """予算に数えるトークン数（キャッシュから読んだ分も入力に含まれる）。"""
+    return int((counters.get("promptTokens") or 0) + (counters.get("outputTokens") or 0) +
+               (counters.get("thoughtsTokens") or 0))
+
+
+def _hour_key(now: Optional[datetime] = None) -> str:
+    return (now or datetime.utcnow()).strftime("%Y%m%d%H")
+
+
+def _model_key(model_name: str) -> str:
+    # RTDBのキーには "." などを使えない
+    return "".join("_" if char in ".#$[]/" else char for char in model_name or "unknown")
+
+
+class TokenUsageAccountant:
+    def __init__(self, prices: List[Tuple[str, Tuple[float, float, float]]], flush_interval_seconds: float):
+        self.prices = prices
+        self.flush_interval_seconds = flush_interval_seconds
+        # プロセス起動後の累計と、まだRTDBに書いていない差分（どちらも room -> (agent, model) -> counters）
+        self._totals: Dict[str, Dict[Tuple[str, str], Dict[str, Any]]] = {}
+        self._pending: Dict[str, Dict[Tuple[str, str], Dict[str, Any]]] = {}
+        # まだRTDBに書いていないトークン数（room -> 時間バケット -> tokens）
+        self._pending_hourly: Dict[str, Dict[str, int]] = {}
+        # 最後に書き込んだ（または読んだ）room_usage/{room_id} の値。他のインスタンスの分も含む
+        self._stored: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flushes = 0
+        self._flush_errors = 0
+
+    def price_for(self, model_name: str) -> Optional[Tuple[float, float, float]]:
+        for prefix, rates in self.prices:
+            if model_name and model_name.startswith(prefix):
+                return rates
+        return None
+
+    def cost_usd(self, model_name: str, prompt_tokens: int, output_tokens: int, cached_tokens: int,
+                 thoughts_tokens: int = 0) -> float:
+        rates = self.price_for(model_name)
+        if rates is None:
+            return 0.0
+        input_rate, output_rate, cached_rate = rates
+        # prompt_token_count はキャッシュから読んだトークンを含む
+        uncached_tokens = max(prompt_tokens - cached_tokens, 0)
+        return (uncached_tokens * input_rate + cached_tokens * cached_rate +
+                (output_tokens + thoughts_tokens) * output_rate) / 1_000_000
+
+    def record(self, room_id: Optional[str], prompt_name: str, model_name: str, usage_metadata: Any):
+        """1回のLLM呼び出しの usage_metadata を加算する（ルームが分からない呼び出しは数えない）。"""
+        if not room_id or usage_metadata is None:
+            return
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", 0) or 0
+        output_tokens = getattr(usage_metadata, "candidates_token_count", 0) or 0
+        cached_tokens = getattr(usage_metadata, "cached_content_token_count", 0) or 0
+        thoughts_tokens = getattr(usage_metadata, "thoughts_token_count", 0) or 0
+        delta = {
+            "calls": 1,
+            "promptTokens": prompt_tokens,
+            "outputTokens": output_tokens,
+            "cachedTokens": cached_tokens,
+            "thoughtsTokens": thoughts_tokens,
+            "costUsd": self.cost_usd(model_name, prompt_tokens, output_tokens, cached_tokens, thoughts_tokens),
+        }
+        key = (usage_agent.get() or prompt_name, model_name or "unknown")
+        hour = _hour_key()
+        with self._lock:
+            for table in (self._totals, self._pending):
+                _add_counters(table.setdefault(room_id, {}).setdefault(key, _empty_counters()), delta)
+            room_hourly = self._pending_hourly.setdefault(room_id, {})
+            room_hourly[hour] = room_hourly.get(hour, 0) + billed_tokens(delta)
+
+    # --- RTDBへの書き込み ---
+
+    def flush(self) -> int:
+        """未書き込みの差分をルームごとに room_usage/{room_id} へ加算する。書き込んだルーム数を返す。"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            pending_hourly, self._pending_hourly = self._pending_hourly, {}
+        flushed = 0
+        for room_id, entries in pending.items():
+            hourly = pending_hourly.get(room_id, {})
+            try:
+                stored = db.reference(room_usage_path(room_id)).transaction(
+                    lambda current, entries=entries, hourly=hourly: self._merge_into(current, entries, hourly))
+                with self._lock:
+                    self._stored[room_id] = stored if isinstance(stored, dict) else {}
+                flushed += 1
+            except Exception as e:
+                logger.warning(f"[{room_id}] Failed to flush token usage: {e}. Retrying on the next flush.")
+                self._flush_errors += 1
+                with self._lock:
+                    room_pending = self._pending.setdefault(room_id, {})
+                    for key, counters in entries.items():
+                        _add_counters(room_pending.setdefault(key, _empty_counters()), counters)
+                    room_hourly = self._pending_hourly.setdefault(room_id, {})
+                    for hour, tokens in hourly.items():
+                        room_hourly[hour] = room_hourly.get(hour, 0) + tokens
+        self._flushes += 1
+        return flushed
+
+    @staticmethod
+    def _merge_into(current: Any, entries: Dict[Tuple[str, str], Dict[str, Any]],
+                    hourly: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        usage = current if isinstance(current, dict) else {}
+        total = usage.setdefault("total", {})
+        by_agent = usage.setdefault("byAgent", {})
+        for (agent_name, model_name), counters in entries.items():
+            entry = by_agent.setdefault(agent_name, {}).setdefault(_model_key(model_name), {"model": model_name})
+            _add_counters(entry, counters)
+            _add_counters(total, counters)
+        if hourly:
+            buckets = usage.setdefault("hourly", {})
+            for hour, tokens in hourly.items():
+                buckets[hour] = (buckets.get(hour) or 0) + tokens
+            for hour in sorted(buckets)[:-HOURLY_BUCKETS_KEPT]:
+                del buckets[hour]
+        usage["updatedAt"] = datetime.utcnow().isoformat() + "Z"
+        return usage
+
+    async def run_periodic_flush(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Token usage flush failed: {e}", exc_info=True)
+
+    def start(self):
+        """定期的な書き込みを開始する（アプリの起動時に呼ぶ）。"""
+        if self._flush_task is None and self.flush_interval_seconds > 0:
+            self._flush_task = asyncio.create_task(self.run_periodic_flush())
+
+    def stop(self):
+        """定期的な書き込みを止め、残りの差分を書き込む（アプリの終了時に呼ぶ）。"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self.flush()
+
+    # --- 予算の判定 ---
+
+    def _stored_usage(self, room_id: str) -> Dict[str, Any]:
+        with self._lock:
+            stored = self._stored.get(room_id)
+        if stored is None:
+            # このプロセスで初めて見るルームだけRTDBから読む（以降は書き込みのたびに更新される）
+            stored = db.reference(room_usage_path(room_id)).get() or {}
+            with self._lock:
+                stored = self._stored.setdefault(room_id, stored)
+        return stored
+
+    def budget_usage(self, room_id: str, now: Optional[datetime] = None) -> Tuple[int, int]:
+        """
+        (会議全体のトークン数, 直近1時間のトークン数) を返す。
+        直近1時間は、現在の時間バケットに前の時間バケットを経過していない割合だけ足した近似（スライディングウィンドウ）。
+        """
+        now = now or datetime.utcnow()
+        stored = self._stored_usage(room_id)
+        current_hour = _hour_key(now)
+        previous_hour = _hour_key(now - timedelta(hours=1))
+        with self._lock:
+            pending_entries = list(self._pending.get(room_id, {}).values())
+            pending_hourly = dict(self._pending_hourly.get(room_id, {}))
+        meeting_tokens = billed_tokens(stored.get("total") or {}) + sum(
+            billed_tokens(counters) for counters in pending_entries)
+        stored_hourly = stored.get("hourly") or {}
+
+        def _bucket(hour: str) -> int:
+            return (stored_hourly.get(hour) or 0) + pending_hourly.get(hour, 0)
+
+        elapsed_fraction = (now.minute * 60 + now.second) / 3600.0
+        hour_tokens = _bucket(current_hour) + int(_bucket(previous_hour) * (1.0 - elapsed_fraction))
+        return meeting_tokens, hour_tokens
+
+    # --- レポート ---
+
+    @staticmethod
+    def _summarize(entries: Dict[Tuple[str, str], Dict[str, Any]]) -> Dict[str, Any]:
+        total = _empty_counters()
+        by_agent: Dict[str, Dict[str, Any]] = {}
+        by_model: Dict[str, Dict[str, Any]] = {}
+        for (agent_name, model_name), counters in entries.items():
+            _add_counters(total, counters)
+            _add_counters(by_agent.setdefault(agent_name, _empty_counters()), counters)
+            _add_counters(by_model.setdefault(model_name, _empty_counters()), counters)
+        return {"total": total, "byAgent": by_agent, "byModel": by_model}
+
+    def room_report(self, room_id: str) -> Dict[str, Any]:
+        """
+        ルームの累計（RTDBに書き込み済みの分 + 未書き込みの差分）と、このプロセスでの集計。
+        RTDBの分には他のインスタンスや過去のプロセスでの使用量も含まれる。
+        """
+        stored = db.reference(room_usage_path(room_id)).get() or {}
+        with self._lock:
+            pending = {key: dict(counters) for key, counters in self._pending.get(room_id, {}).items()}
+            process_entries = {key: dict(counters) for key, counters in self._totals.get(room_id, {}).items()}
+        # 書き込み済みの分に未書き込みの差分を重ねる（元の値は変更しない）
+        cumulative = self._merge_into(
+            {"total": dict(stored.get("total") or {}),
+             "byAgent": {agent: {model: dict(counters) for model, counters in models.items()}
+                         for agent, models in (stored.get("byAgent") or {}).items()}}, pending)
+        cumulative["updatedAt"] = stored.get("updatedAt")
+        return {"roomId": room_id, "cumulative": cumulative, "process": self._summarize(process_entries)}
+
+    def report(self, top: int = 20) -> Dict[str, Any]:
+        """このプロセスでの全ルームの集計（コストの大きい順に top 件のルーム）。"""
+        with self._lock:
+            snapshot = {room_id: {key: dict(counters) for key, counters in entries.items()}
+                        for room_id, entries in self._totals.items()}
+            pending_rooms = len(self._pending)
+        all_entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        rooms = []
+        for room_id, entries in snapshot.items():
+            for key, counters in entries.items():
+                _add_counters(all_entries.setdefault(key, _empty_counters()), counters)
+            rooms.append({"roomId": room_id, **self._summarize(entries)["total"]})
+        rooms.sort(key=lambda room: (room["costUsd"], room["promptTokens"]), reverse=True)
+        return {
+            **self._summarize(all_entries),
+            "rooms": len(snapshot),
+            "topRooms": rooms[:top],
+            "pendingRooms": pending_rooms,
+            "flushes": self._flushes,
+            "flushErrors": self._flush_errors,
+        }
+
+
+token_usage = TokenUsageAccountant(parse_token_prices(LLM_TOKEN_PRICES), TOKEN_USAGE_FLUSH_INTERVAL_SECONDS)
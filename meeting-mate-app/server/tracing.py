@@ -0,0 +1,209 @@
+"""
+OpenTelemetry による分散トレース。
+
+/invoke・/invoke_batch ごとに1つのトレースを作り、認証・トランスクリプト追記・トリガー判定・
+シークレットの読み取り・オーケストレーターのLLM呼び出しと応答の解析・各エージェントのLLM呼び出しと応答の解析・
+RTDBへの書き込みを子スパンとして記録する。遅いトリガーでどの区間が支配的だったかを1本のトレースで確認できる。
+トレースIDはAIのトランスクリプトエントリ（traceId）とログの構造化フィールド（trace_id）に残す。
+エクスポーターは TRACING_EXPORTER で選ぶ（otlp / console / file）。opentelemetry-sdk がない場合や
+TRACING_EXPORTER=none の場合は、スパンの記録はすべて何もしない。
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Dict, Mapping, Optional
+
+from config import logger, TRACING_EXPORTER, TRACING_SERVICE_NAME, TRACING_FILE_PATH, TRACING_SAMPLE_RATIO
+from log_pipeline import add_log_filter
+
+TRACING_AVAILABLE = False
+if TRACING_EXPORTER not in ("", "none", "off"):
+    try:
+        from opentelemetry import trace, propagate
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SpanExporter, SpanExportResult
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+        TRACING_AVAILABLE = True
+    except ImportError:
+        logger.warning(
+            "opentelemetry-sdk library not found. Tracing will be disabled.")
+
+ATTRIBUTE_PREFIX = "aimeebo."
+
+# 直近のLLM応答を受け取った時刻（応答の解析区間の開始時刻として使う）
+_llm_response_received_ns: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "llm_response_received_ns", default=None)
+
+
+if TRACING_AVAILABLE:
+    class JsonLinesFileSpanExporter(SpanExporter):
+        """オフライン確認用に、スパンを1行1件のJSONでファイルへ追記する。"""
+
+        def __init__(self, path: str):
+            self.path = path
+            self._lock = threading.Lock()
+
+        def export(self, spans) -> "SpanExportResult":
+            lines = [json.dumps(json.loads(span.to_json(indent=None)), ensure_ascii=False) for span in spans]
+            try:
+                with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            except OSError as e:
+                logger.warning(f"Failed to write spans to {self.path}: {e}")
+                return SpanExportResult.FAILURE
+            return SpanExportResult.SUCCESS
+
+        def shutdown(self):
+            pass
+
+
+def _build_exporter():
+    if TRACING_EXPORTER == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.warning(
+                "opentelemetry-exporter-otlp-proto-http library not found. Tracing will be disabled.")
+            return None
+        return OTLPSpanExporter()
+    if TRACING_EXPORTER == "console":
+        return ConsoleSpanExporter()
+    if TRACING_EXPORTER == "file":
+        return JsonLinesFileSpanExporter(TRACING_FILE_PATH)
+    logger.warning(f"Unknown TRACING_EXPORTER '{TRACING_EXPORTER}'. Tracing will be disabled.")
+    return None
+
+
+_provider = None
+_tracer = None
+if TRACING_AVAILABLE:
+    _exporter = _build_exporter()
+    if _exporter is None:
+        TRACING_AVAILABLE = False
+    else:
+        _provider = TracerProvider(
+            resource=Resource.create({"service.name": TRACING_SERVICE_NAME}),
+            sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO)))
+        _provider.add_span_processor(BatchSpanProcessor(_exporter))
+        trace.set_tracer_provider(_provider)
+        _tracer = trace.get_tracer("aimeebo")
+        logger.info(f"Tracing enabled with the '{TRACING_EXPORTER}' exporter.")
+
+
+def _attributes(attributes: Mapping[str, Any]) -> Dict[str, Any]:
+    converted = {}
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if not isinstance(value, (str, bool, int, float)):
+            value = str(value)
+        converted[ATTRIBUTE_PREFIX + key] = value
+    return converted
+
+
+def span(name: str, **attributes):
+    """現在のスパンの子スパンを開始する with 用のコンテキスト（例外はスパンにエラーとして記録される）。"""
+    if not TRACING_AVAILABLE:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, attributes=_attributes(attributes))
+
+
+def request_span(name: str, headers: Optional[Mapping[str, str]] = None, **attributes):
+    """
+    リクエストのルートスパン。traceparent ヘッダーがあれば呼び出し元のトレースに連結する。
+    フレームワーク側（FastAPI・ASGIの計装）がすでにサーバースパンを開いていれば、その子スパンにする。
+    """
+    if not TRACING_AVAILABLE:
+        return nullcontext()
+    if trace.get_current_span().get_span_context().is_valid:
+        return _tracer.start_as_current_span(name, attributes=_attributes(attributes))
+    return _tracer.start_as_current_span(
+        name, context=propagate.extract(dict(headers or {})), kind=trace.SpanKind.SERVER,
+        attributes=_attributes(attributes))
+
+
+def traced(name: str):
+    """関数（同期・非同期）の呼び出し全体を1つのスパンにするデコレーター。"""
+    def decorator(func):
+        if not TRACING_AVAILABLE:
+            return func
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def _async_wrapper(*args, **kwargs):
+                with _tracer.start_as_current_span(name):
+                    return await func(*args, **kwargs)
+            return _async_wrapper
+
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            with _tracer.start_as_current_span(name):
+                return func(*args, **kwargs)
+        return _wrapper
+    return decorator
+
+
+def set_span_attributes(**attributes):
+    if TRACING_AVAILABLE:
+        trace.get_current_span().set_attributes(_attributes(attributes))
+
+
+def current_trace_id() -> Optional[str]:
+    """記録（エクスポート）されるトレースの中であれば、そのトレースIDを16進数32桁で返す。"""
+    if not TRACING_AVAILABLE:
+        return None
+    context = trace.get_current_span().get_span_context()
+    if not context.is_valid or not context.trace_flags.sampled:
+        return None
+    return format(context.trace_id, "032x")
+
+
+def mark_llm_response_received():
+    """LLMの応答を受け取った時刻を記録する（LLMClient から呼ぶ）。"""
+    if TRACING_AVAILABLE:
+        _llm_response_received_ns.set(time.time_ns())
+
+
+def record_span_since_llm_response(name: str, **attributes):
+    """
+    直近のLLM応答の受信から現在までを1つのスパンとして記録する。
+    各エージェントの応答の解析・検証はエージェントの中にあるため、その区間をエージェントのコードに手を入れずに切り出す。
+    """
+    if not TRACING_AVAILABLE:
+        return
+    started = _llm_response_received_ns.get()
+    _llm_response_received_ns.set(None)
+    if started is None:
+        return
+    _tracer.start_span(name, start_time=started, attributes=_attributes(attributes)).end()
+
+
+class TraceContextFilter(logging.Filter):
+    """記録されるトレースの中で出したログレコードに trace_id を付ける。"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace_id = current_trace_id()
+        if trace_id:
+            record.trace_id = trace_id
+        return True
+
+
+def install_log_correlation():
+    """ログを出したスレッドでトレースIDを取得し、ログの構造化フィールドに含める。"""
+    if not TRACING_AVAILABLE:
+        return
+    add_log_filter(TraceContextFilter())
+
+
+def shutdown_tracing():
+    """未送信のスパンを送り出してエクスポーターを閉じる。"""
+    if _provider is not None:
+        _provider.shutdown()
+
+
+install_log_correlation()
@@ -0,0 +1,134 @@
+"""
+トランスクリプトに対するルーム単位のBM25転置インデックス。
+
+各エージェントに会話履歴全体を渡す代わりに、直近の発言ウィンドウと、
+指示内容に関連する過去の発言上位k件だけを選んで渡すために使う。
+トランスクリプトは追記のみなので、インデックスも新しいエントリだけを追加する。
+"""
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import HISTORY_RECENT_WINDOW, HISTORY_RETRIEVAL_TOP_K
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+MAX_INDEXED_ROOMS = 256
+
+_ASCII_WORD_RE = re.compile(r"[a-z0-9]+")
+_NON_ASCII_RUN_RE = re.compile(r"[^\x00-\x7f\s\W]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """英数字は単語単位、日本語などの非ASCII文字列は文字bigram単位でトークン化する。"""
+    normalized = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = _ASCII_WORD_RE.findall(normalized)
+    for run in _NON_ASCII_RUN_RE.findall(normalized):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class TranscriptIndex:
+    """トランスクリプト位置をドキュメントIDとするインクリメンタルなBM25インデックス。"""
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._doc_lengths: List[int] = []
+        self._first_text: str = ""
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def _reset(self):
+        self._postings = {}
+        self._doc_lengths = []
+        self._first_text = ""
+        self._total_length = 0
+
+    def sync(self, texts: Sequence[str]) -> int:
+        """未登録のエントリだけを追加する。追記以外の変更を検知した場合は作り直す。戻り値は追加件数。"""
+        with self._lock:
+            if len(texts) < len(self._doc_lengths) or (texts and self._doc_lengths and texts[0] != self._first_text):
+                self._reset()
+            start = len(self._doc_lengths)
+            for position in range(start, len(texts)):
+                term_counts = Counter(tokenize(texts[position]))
+                for term, count in term_counts.items():
+                    self._postings.setdefault(term, {})[position] = count
+                length = sum(term_counts.values())
+                self._doc_lengths.append(length)
+                self._total_length += length
+            if texts and start == 0:
+                self._first_text = texts[0]
+            return len(texts) - start
+
+    def search(self, query: str, top_k: int, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """クエリに対するBM25スコア上位の (位置, スコア) を返す。limit 以降の位置は対象外。"""
+        with self._lock:
+            doc_count = len(self._doc_lengths) if limit is None else min(
+                limit, len(self._doc_lengths))
+            if doc_count == 0 or top_k <= 0:
+                return []
+            avg_length = (self._total_length / len(self._doc_lengths)) or 1.0
+            scores: Dict[int, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (len(self._doc_lengths) - len(postings) + 0.5) / (len(postings) + 0.5))
+                for position, tf in postings.items():
+                    if position >= doc_count:
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B *
+                                      self._doc_lengths[position] / avg_length)
+                    scores[position] = scores.get(
+                        position, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+            return ranked[:top_k]
+
+
+class RoomTranscriptIndexes:
+    """ルームごとのインデックスを保持する（LRUで上限付き）。"""
+
+    def __init__(self, max_rooms: int = MAX_INDEXED_ROOMS):
+        self.max_rooms = max_rooms
+        self._indexes: "OrderedDict[str, TranscriptIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, room_id: str) -> TranscriptIndex:
+        with self._lock:
+            index = self._indexes.get(room_id)
+            if index is None:
+                index = TranscriptIndex()
+                self._indexes[room_id] = index
+            self._indexes.move_to_end(room_id)
+            while len(self._indexes) > self.max_rooms:
+                self._indexes.popitem(last=False)
+            return index
+
+
+room_transcript_indexes = RoomTranscriptIndexes()
+
+
+def select_history_positions(room_id: str, texts: Sequence[str], query: str, recent_window: int = HISTORY_RECENT_WINDOW, top_k: int = HISTORY_RETRIEVAL_TOP_K) -> List[int]:
+    """
+    直近 recent_window 件と、それより前の発言のうち query に関連する上位 top_k 件の位置を
+    時系列順で返す。選ばれる件数は会議の長さに関わらず recent_window + top_k 以下になる。
+    """
+    total = len(texts)
+    recent_start = max(0, total - recent_window)
+    if recent_start == 0:
+        return list(range(total))
+    index = room_transcript_indexes.get(room_id)
+    index.sync(texts)
+    relevant = [position for position, _ in index.search(
+        query, top_k, limit=recent_start)]
+    return sorted(relevant) + list(range(recent_start, total))
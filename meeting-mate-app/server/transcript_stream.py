@@ -0,0 +1,128 @@
+"""
+WebSocketでストリーミングされる音声認識結果のバッファ。
+
+1つの接続（1人の発言者）について、途中結果（interim）と確定結果（final）を
+utteranceId 単位で保持し、確定した発言だけをマイクロバッチとして取り出す。
+同じ utteranceId の途中結果は上書きされ、同じ確定結果が再送されても1回しか追記しない。
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from config import TRANSCRIPT_STREAM_FLUSH_INTERVAL_MS, TRANSCRIPT_STREAM_MAX_BATCH
+
+# 再送判定のために覚えておく確定済み utteranceId の件数
+MAX_REMEMBERED_UTTERANCES = 1024
+# この秒数以上更新されない途中結果は、確定しないまま放棄されたものとして捨てる
+STALE_INTERIM_SECONDS = 10.0
+
+
+class TranscriptStreamBuffer:
+    """1つのストリーミング接続分の発言バッファ。"""
+
+    def __init__(self, flush_interval_ms: int = TRANSCRIPT_STREAM_FLUSH_INTERVAL_MS, max_batch: int = TRANSCRIPT_STREAM_MAX_BATCH):
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        # utteranceId -> {"text", "isFinal", "updatedAt"}（受信順を維持）
+        self._pending: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._flushed_ids: "OrderedDict[str, None]" = OrderedDict()
+        self._last_flushed_text: Optional[str] = None
+        self._first_final_at: Optional[float] = None
+
+    def add(self, utterance_id: str, text: str, is_final: bool) -> bool:
+        """認識結果を取り込む。バッファに反映した場合は True、重複として捨てた場合は False。"""
+        text = (text or "").strip()
+        if not utterance_id or utterance_id in self._flushed_ids:
+            return False
+        current = self._pending.get(utterance_id)
+        if current and current["isFinal"]:
+            # 確定済みの発言に遅れて届いた途中結果・再送は無視する
+            return False
+        if not text:
+            if is_final:
+                self._pending.pop(utterance_id, None)
+            return False
+        if is_final and text == self._last_flushed_text and not current:
+            # 認識エンジンが同じ文を別IDで二重に確定することがあるため、直前の確定文と同じなら捨てる
+            self._remember(utterance_id)
+            return False
+        self._pending[utterance_id] = {
+            "text": text, "isFinal": is_final, "updatedAt": time.monotonic()}
+        if is_final and self._first_final_at is None:
+            self._first_final_at = time.monotonic()
+        return True
+
+    def _drop_stale_interims(self):
+        now = time.monotonic()
+        stale_ids = [utterance_id for utterance_id, entry in self._pending.items()
+                     if not entry["isFinal"] and now - entry["updatedAt"] >= STALE_INTERIM_SECONDS]
+        for utterance_id in stale_ids:
+            del self._pending[utterance_id]
+
+    def ready_count(self) -> int:
+        """先頭から連続して確定している（取り出せる）発言の件数。"""
+        self._drop_stale_interims()
+        count = 0
+        for entry in self._pending.values():
+            if not entry["isFinal"]:
+                break
+            count += 1
+        return count
+
+    def seconds_until_flush(self) -> Optional[float]:
+        """次のフラッシュまでの秒数。確定済みの発言がなければ None。"""
+        if self._first_final_at is None:
+            return None
+        ready = self.ready_count()
+        if ready >= self.max_batch:
+            return 0.0
+        now = time.monotonic()
+        remaining = self._first_final_at + self.flush_interval - now
+        if ready == 0:
+            # 先頭の途中結果が確定するか放棄されるまで、後続の確定済み発言は取り出せない
+            head = next(iter(self._pending.values()))
+            remaining = max(remaining, head["updatedAt"] + STALE_INTERIM_SECONDS - now)
+        return max(0.0, remaining)
+
+    def should_flush(self) -> bool:
+        remaining = self.seconds_until_flush()
+        return remaining is not None and remaining <= 0 and self.ready_count() > 0
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """
+        確定済みの発言を受信順に取り出す。
+        途中結果の発言を追い越さないよう、先頭から連続して確定している分だけを返す。
+        """
+        self._drop_stale_interims()
+        drained = []
+        while self._pending:
+            utterance_id, entry = next(iter(self._pending.items()))
+            if not entry["isFinal"]:
+                break
+            self._pending.popitem(last=False)
+            self._remember(utterance_id)
+            self._last_flushed_text = entry["text"]
+            drained.append(self._as_entry(utterance_id, entry))
+        has_final = any(entry["isFinal"] for entry in self._pending.values())
+        self._first_final_at = time.monotonic() if has_final else None
+        return drained
+
+    def drain_all(self) -> List[Dict[str, Any]]:
+        """切断時用。確定済みの発言をすべて取り出し、未確定の途中結果は破棄する。"""
+        finals = [(utterance_id, entry) for utterance_id, entry in self._pending.items() if entry["isFinal"]]
+        self._pending.clear()
+        self._first_final_at = None
+        drained = []
+        for utterance_id, entry in finals:
+            self._remember(utterance_id)
+            drained.append(self._as_entry(utterance_id, entry))
+        return drained
+
+    @staticmethod
+    def _as_entry(utterance_id: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {"utteranceId": utterance_id, "text": entry["text"]}
+
+    def _remember(self, utterance_id: str):
+        self._flushed_ids[utterance_id] = None
+        while len(self._flushed_ids) > MAX_REMEMBERED_UTTERANCES:
+            self._flushed_ids.popitem(last=False)
@@ -71,6 +71,28 @@ export const useRoomData = (roomId: string | null): UseRoomDataResult => {
       setIsLoading(true);
       setError(null);
       const roomRef = ref(firebaseDb, `rooms/${roomId}`);
+      // トランスクリプトは transcripts/{roomId} に分離されているため、会議の状態とは別に購読する
+      const transcriptRef = ref(firebaseDb, `transcripts/${roomId}`);
+      const transcriptListener = onValue(transcriptRef, (snapshot) => {
+        const data = snapshot.val();
+        // 連番キーが欠けるとオブジェクトで返るため、キー順に並べてリストに揃える
+        const entries: TranscriptEntry[] = Array.isArray(data)
+          ? data
+          : data && typeof data === 'object'
+            ? Object.keys(data).sort((a, b) => Number(a) - Number(b)).map(key => data[key])
+            : [];
+        const newTranscript: TranscriptEntry[] = entries.filter(Boolean).map((t: TranscriptEntry) => {
+          return {
+            userId: t.userId || 'unknown', // userIdがなければ'unknown'
+            userName: t.userName || '不明なユーザー', // userNameがなければ'不明なユーザー'
+            text: t.text || '',
+            timestamp: t.timestamp || new Date().toISOString(),
+          };
+        });
+        setTranscript(newTranscript);
+      }, (firebaseError) => {
+        console.error("Firebase onValue: Transcript fetch error:", firebaseError);
+      });
       const listener = onValue(roomRef, (snapshot) => {
         console.log("Firebase onValue: Received data for room", roomId);
         const data = snapshot.val();
@@ -79,15 +101,6 @@ export const useRoomData = (roomId: string | null): UseRoomDataResult => {
           setRoomData(data as SessionData);
           const newParticipants = data.participants ? Object.entries(data.participants).map(([id, p]) => ({ id, ...(p as Omit<ParticipantEntry, 'id'>) })) : [];
           setParticipants(newParticipants);
-          const newTranscript: TranscriptEntry[] = (data.transcript || []).map((t: TranscriptEntry) => {
-            return {
-              userId: t.userId || 'unknown', // userIdがなければ'unknown'
-              userName: t.userName || '不明なユーザー', // userNameがなければ'不明なユーザー'
-              text: t.text || '',
-              timestamp: t.timestamp || new Date().toISOString(),
-            };
-          });
-          setTranscript(newTranscript);
           const newTasks = data.tasks && typeof data.tasks === 'object' ? Object.values(data.tasks) : [];
           setTasks(newTasks as TodoItem[]);
           const newNotes = data.notes && typeof data.notes === 'object' ? Object.values(data.notes) : [];
@@ -141,6 +154,7 @@ export const useRoomData = (roomId: string | null): UseRoomDataResult => {
       return () => {
         console.log("Firebase onValue: Cleaning up listener for room", roomId);
         off(roomRef, 'value', listener);
+        off(transcriptRef, 'value', transcriptListener);
       };
     } else { // roomIdがない場合
       setIsLoading(false);
@@ -19,7 +19,7 @@ export type OverviewDiagramData = {
   title: string; 
   mermaidDefinition: string; 
 };
-export interface SessionData { sessionId?: string; sessionTitle?: string; startTime?: string; participants: ParticipantsData; transcript: TranscriptEntry[]; tasks: TodoItem[]; notes: Notes; projectTitle?: string; projectSubtitle?: string; meetingDate?: string; overviewDiagram?: OverviewDiagramData; currentAgenda?: CurrentAgenda; suggestedNextTopics?: string[]; }
+export interface SessionData { sessionId?: string; sessionTitle?: string; startTime?: string; participants: ParticipantsData; transcript?: TranscriptEntry[]; tasks: TodoItem[]; notes: Notes; projectTitle?: string; projectSubtitle?: string; meetingDate?: string; overviewDiagram?: OverviewDiagramData; currentAgenda?: CurrentAgenda; suggestedNextTopics?: string[]; }
 
 export type PanelId = "participants" | "currentAgenda" | "suggestedTopics" | "overviewDiagram" | "notes" | "tasks" | "conversationHistory";
 